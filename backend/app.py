@@ -4,16 +4,23 @@ Professional backend for live astronomical data streaming
 """
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 from loguru import logger
 import sys
-import os
 from pathlib import Path
 
 from config import settings
 from services.cache_service import cache_service
+from services.local_catalog_service import local_catalog_service
+from services.bright_catalog_responses import bright_catalog_responses
+from services.executors import executors
+from services.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, metrics
+from services.single_flight import single_flight
+from services.sky_tile_cache import gaia_tile_cache
+from services.tap_client import tap_client
+from services.warmup import warmup_service
 from routes.stars_api import router as stars_router
 
 
@@ -43,15 +50,25 @@ async def lifespan(app: FastAPI):
     logger.info(f"Debug mode: {settings.DEBUG}")
     
     # Initialize services
+    await executors.start()
     await cache_service.initialize()
+    await local_catalog_service.initialize()
+    metrics.start()
+    # Preload the catalog and prebuild popular responses while already serving /health
+    warmup_service.start(app)
     
-    logger.success("✅ API ready!")
+    logger.success("✅ API started!")
     
     yield
     
     # Shutdown
     logger.info("🛑 Shutting down API...")
+    await warmup_service.stop()
+    await metrics.stop()
     await cache_service.clear_expired()
+    await cache_service.close()
+    await tap_client.close()
+    executors.shutdown()
 
 
 # Create FastAPI app
@@ -74,6 +91,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-endpoint latency and response size for /metrics (outermost, so it times everything)
+app.add_middleware(MetricsMiddleware)
+
+
+# Service counters exported by /metrics, read when scraped (the same ones /health reports)
+metrics.collect("in_flight_queries", "Distinct queries running (identical concurrent requests share one)", (), "gauge",
+                lambda: {(): single_flight.in_flight})
+metrics.collect("coalesced_requests_total", "Requests that joined a query already in flight", (), "counter",
+                lambda: {(): single_flight.coalesced})
+metrics.collect("gaia_queries", "Gaia TAP queries running or waiting for a slot", ("state",), "gauge",
+                lambda: {("active",): tap_client.active, ("waiting",): tap_client.waiting})
+metrics.collect("gaia_queries_total", "Finished Gaia TAP queries by outcome", ("outcome",), "counter",
+                lambda: {
+                    ("completed",): tap_client.completed,
+                    ("failed",): tap_client.failed,
+                    ("timeout",): tap_client.timeouts,
+                    ("cancelled",): tap_client.cancelled
+                })
+metrics.collect("executor_tasks", "Executor tasks waiting for a worker (queued) or running", ("pool", "state"), "gauge",
+                lambda: {
+                    (pool, state): stats[state]
+                    for pool, stats in executors.stats().items()
+                    for state in ("queued", "running")
+                })
+metrics.collect("executor_tasks_total", "Finished executor tasks by outcome", ("pool", "outcome"), "counter",
+                lambda: {
+                    (pool, outcome): stats[outcome]
+                    for pool, stats in executors.stats().items()
+                    for outcome in ("completed", "failed")
+                })
+metrics.collect("cache_memory_bytes", "Size of the in-memory query cache", (), "gauge",
+                lambda: {(): cache_service.memory_cache.total_bytes})
+metrics.collect("cache_evictions_total", "Entries evicted from the in-memory query cache", (), "counter",
+                lambda: {(): cache_service.memory_cache.evictions})
+metrics.collect("sky_tiles_total", "Gaia sky tiles served from the cache (hit) or fetched", ("result",), "counter",
+                lambda: {("hit",): gaia_tile_cache.tile_hits, ("fetch",): gaia_tile_cache.tile_fetches})
+metrics.collect("bright_catalog_bodies_total", "Bright catalog bodies served from memory, built, or loaded from another worker", ("result",), "counter",
+                lambda: {
+                    ("hit",): bright_catalog_responses.hits,
+                    ("build",): bright_catalog_responses.builds,
+                    ("shared_load",): bright_catalog_responses.shared_loads
+                })
+
 
 # Include routers
 app.include_router(stars_router)
@@ -88,16 +148,45 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """Health check endpoint (liveness: healthy while the process serves requests)"""
     cache_stats = await cache_service.stats()
     
     return {
         "status": "healthy",
+        "ready": warmup_service.ready,
+        "warmup": warmup_service.stats(),
         "cache": cache_stats,
+        "in_flight": single_flight.stats(),
+        "executors": executors.stats(),
+        "sky_tiles": gaia_tile_cache.stats(),
+        "bright_catalog": bright_catalog_responses.stats(),
+        "gaia_queries": tap_client.stats(),
         "gaia_endpoint": settings.GAIA_TAP_URL
     }
 
 
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness probe: the process is up and serving"""
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness probe: 503 until the startup warmup has finished"""
+    if not warmup_service.ready:
+        return JSONResponse(status_code=503, content={"ready": False, "warmup": warmup_service.stats()})
+    return {"ready": True, "warmup": warmup_service.stats()}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Prometheus metrics: per-stage latency histograms, cache hit ratios, queue depths"""
+    if not metrics.enabled:
+        return JSONResponse(status_code=404, content={"detail": "Metrics are disabled"})
+    return Response(content=await metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 # Backward/compat alias used by some scripts
 @app.get("/api/health")
 async def health_check_api_alias():
@@ -148,10 +237,15 @@ for data_path in data_paths:
 if __name__ == "__main__":
     import uvicorn
     
-    uvicorn.run(
-        "app:app",
-        host=settings.API_HOST,
-        port=settings.API_PORT,
-        reload=settings.DEBUG,
-        log_level=settings.LOG_LEVEL.lower()
-    )
+    if not settings.DEBUG and settings.WORKER_COUNT > 1:
+        # Production: prepare the shared catalog once, then start the workers
+        import serve
+        serve.main()
+    else:
+        uvicorn.run(
+            "app:app",
+            host=settings.API_HOST,
+            port=settings.API_PORT,
+            reload=settings.DEBUG,
+            log_level=settings.LOG_LEVEL.lower()
+        )
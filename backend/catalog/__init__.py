@@ -0,0 +1,4 @@
+"""
+Catalog format and math shared by the API services and the catalog build scripts
+Only depends on NumPy so scripts can import it without starting the API
+"""
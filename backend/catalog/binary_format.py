@@ -0,0 +1,131 @@
+"""
+Fixed-record binary star catalog
+Struct-of-arrays file meant to be np.memmap'ed read-only, so every API
+worker shares the OS page cache instead of holding its own copy.
+
+Layout (little-endian):
+    header      64 bytes: magic, format version, row count, column count
+    directory   64 bytes per column: name, dtype, values per row, offset
+    columns     each column contiguous, starting on a 64-byte boundary
+"""
+from pathlib import Path
+from typing import Dict
+import os
+import sqlite3
+import struct
+
+import numpy as np
+
+from catalog.catalog_db import write_catalog_meta
+from catalog.healpix import HEALPIX_ORDER, ang2pix_nest
+from catalog.lod import lod_levels
+from catalog.star_columns import (
+    DERIVED_COLUMN_LAYOUT, STAR_COLUMN_LAYOUT, columns_content_hash, read_sqlite_columns
+)
+
+
+MAGIC = b"GAIACAT\0"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+_HEADER = struct.Struct("<8sIQI")           # magic, version, rows, columns
+_ENTRY = struct.Struct("<32s8sIQ")          # name, dtype, values per row, offset
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_binary_catalog(path: Path, columns: Dict[str, np.ndarray]):
+    """
+    Write catalog columns (see STAR_COLUMN_LAYOUT) to a binary file
+
+    Derived columns (DERIVED_COLUMN_LAYOUT) are written when present.
+    Written to a temp file and renamed into place, so readers never map a
+    partially written catalog.
+    """
+    path = Path(path)
+    count = len(columns['magnitude'])
+
+    layout = dict(STAR_COLUMN_LAYOUT)
+    layout.update((name, spec) for name, spec in DERIVED_COLUMN_LAYOUT.items() if name in columns)
+    arrays = []
+    for name, (dtype, width) in layout.items():
+        array = np.ascontiguousarray(columns[name], dtype=dtype)
+        expected = (count,) if width == 1 else (count, width)
+        if array.shape != expected:
+            raise ValueError(f"Column {name} has shape {array.shape}, expected {expected}")
+        arrays.append((name, dtype, width, array))
+
+    offset = _align(ALIGNMENT + ALIGNMENT * len(arrays))
+    directory = []
+    for name, dtype, width, array in arrays:
+        directory.append(_ENTRY.pack(name.encode(), dtype.encode(), width, offset))
+        offset = _align(offset + array.nbytes)
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as fh:
+        fh.write(_HEADER.pack(MAGIC, FORMAT_VERSION, count, len(arrays)).ljust(ALIGNMENT, b"\0"))
+        for entry in directory:
+            fh.write(entry.ljust(ALIGNMENT, b"\0"))
+        for (name, dtype, width, array), entry in zip(arrays, directory):
+            column_offset = _ENTRY.unpack(entry)[3]
+            fh.write(b"\0" * (column_offset - fh.tell()))
+            fh.write(array.tobytes())
+        fh.write(b"\0" * (_align(fh.tell()) - fh.tell()))
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+
+
+def open_binary_catalog(path: Path) -> Dict[str, np.ndarray]:
+    """
+    Memory-map a binary catalog read-only
+
+    Returns column name -> np.memmap. Raises ValueError for files that are not
+    catalogs or use an unsupported format version.
+    """
+    path = Path(path)
+    with open(path, "rb") as fh:
+        magic, version, count, ncolumns = _HEADER.unpack(fh.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a binary star catalog")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {version}, expected {FORMAT_VERSION}")
+        fh.seek(ALIGNMENT)
+        entries = [_ENTRY.unpack(fh.read(ALIGNMENT)[:_ENTRY.size]) for _ in range(ncolumns)]
+
+    columns = {}
+    for raw_name, raw_dtype, width, offset in entries:
+        name = raw_name.rstrip(b"\0").decode()
+        dtype = raw_dtype.rstrip(b"\0").decode()
+        shape = (count,) if width == 1 else (count, width)
+        if count == 0:
+            columns[name] = np.empty(shape, dtype=dtype)
+        else:
+            columns[name] = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+    missing = set(STAR_COLUMN_LAYOUT) - set(columns)
+    if missing:
+        raise ValueError(f"{path} is missing columns: {sorted(missing)}")
+    return columns
+
+
+def export_binary_catalog(db_path: Path, binary_path: Path, color_mode: str = "bp_rp") -> int:
+    """
+    Write the binary copy of a catalog database, with LOD levels precomputed
+
+    Also records the catalog content hash (API ETags) in catalog_meta, before
+    the binary copy so that it stays newer than the database. Returns the
+    number of stars written.
+    """
+    columns = read_sqlite_columns(db_path, color_mode)
+    columns['lod'] = lod_levels(ang2pix_nest(HEALPIX_ORDER, columns['ra'], columns['dec']), HEALPIX_ORDER)
+    conn = sqlite3.connect(str(db_path))
+    try:
+        write_catalog_meta(conn, {'content_hash': columns_content_hash(columns)})
+        conn.commit()
+    finally:
+        conn.close()
+    write_binary_catalog(binary_path, columns)
+    return len(columns['magnitude'])
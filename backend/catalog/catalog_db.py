@@ -0,0 +1,325 @@
+"""
+Bulk loader for the catalog SQLite database
+The database is built in a temp file with build-only pragmas (no journal, no
+fsync), rows go in as large batches of tuples in one transaction, indexes are
+created after the load and the finished file is renamed into place, so a
+running API never opens a half-written catalog.
+
+An existing catalog can also be refreshed in place: delta rows are upserted
+by source_id and only the derived index entries they touch are rewritten.
+"""
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import os
+import sqlite3
+
+import numpy as np
+
+from catalog.healpix import HEALPIX_ORDER
+from catalog.lod import LodAssigner, assign_appended_lod, update_lod_column
+from catalog.magnitude_index import create_offsets_table, update_offsets_table
+from catalog.star_records import CATALOG_FIELDS
+
+
+# Columns of a star row, in insert order (tuples fed to the loader follow it)
+STAR_ROW_COLUMNS: List[str] = [name for name, _ in CATALOG_FIELDS] + ['hpx']
+
+# Safe only because an interrupted build is simply discarded
+CATALOG_BUILD_PRAGMAS = (
+    "PRAGMA journal_mode=OFF",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA locking_mode=EXCLUSIVE",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-524288",        # 512 MB page cache for index builds
+)
+
+STARS_TABLE_SQL = """
+CREATE TABLE stars (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source_id TEXT NOT NULL,
+    ra REAL NOT NULL,
+    dec REAL NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    z REAL NOT NULL,
+    parallax REAL,
+    distance_pc REAL,
+    magnitude REAL NOT NULL,
+    bp_rp REAL,
+    rgb INTEGER,
+    pmra REAL,
+    pmdec REAL,
+    radial_velocity REAL,
+    temperature REAL,
+    hpx INTEGER,
+    lod INTEGER,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Built after the rows are in (one sorted pass each instead of per-row upkeep)
+STARS_INDEX_SQL = (
+    "CREATE UNIQUE INDEX idx_source_id ON stars(source_id)",
+    "CREATE INDEX idx_magnitude ON stars(magnitude)",
+    "CREATE INDEX idx_distance ON stars(distance_pc)",
+    "CREATE INDEX idx_hpx ON stars(hpx)",
+    # LOD queries: per-level hpx ranges (see catalog.lod)
+    "CREATE INDEX idx_lod_hpx ON stars(lod, hpx)",
+)
+
+# Build parameters of the catalog (mag_limit, color_mode, ...), as text
+CATALOG_META_SQL = "CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value TEXT)"
+
+# Row tuples plus the LOD level assigned while loading
+INSERT_STAR_SQL = (
+    f"INSERT INTO stars ({', '.join(STAR_ROW_COLUMNS)}, lod) "
+    f"VALUES ({', '.join('?' * (len(STAR_ROW_COLUMNS) + 1))})"
+)
+
+
+def column_rows(columns: Dict[str, np.ndarray], names: Sequence[str] = STAR_ROW_COLUMNS) -> Iterator[tuple]:
+    """Row tuples from column arrays (NaN binds as NULL in SQLite)"""
+    return zip(*[np.asarray(columns[name]).tolist() for name in names])
+
+
+def read_catalog_meta(conn: sqlite3.Connection) -> Dict[str, str]:
+    """Build parameters recorded in the catalog ({} for catalogs without them)"""
+    try:
+        return dict(conn.execute("SELECT key, value FROM catalog_meta").fetchall())
+    except sqlite3.OperationalError:
+        return {}
+
+
+def write_catalog_meta(conn: sqlite3.Connection, meta: Dict[str, str]):
+    conn.execute(CATALOG_META_SQL)
+    conn.executemany("INSERT OR REPLACE INTO catalog_meta (key, value) VALUES (?, ?)", meta.items())
+
+
+def create_catalog_indexes(conn: sqlite3.Connection, sorted_magnitudes: Optional[np.ndarray] = None):
+    """
+    Secondary indexes, R*Tree and magnitude offsets for a loaded stars table
+
+    sorted_magnitudes (magnitudes in rowid order) is passed when the rows were
+    loaded in magnitude order; otherwise no mag_offsets table is written and
+    the LOD levels assigned during the load are recomputed.
+    """
+    if sorted_magnitudes is None:
+        update_lod_column(conn, HEALPIX_ORDER)
+    for sql in STARS_INDEX_SQL:
+        conn.execute(sql)
+
+    # R*Tree over x/y/z for 3D box/sphere queries around the camera
+    conn.execute("CREATE VIRTUAL TABLE stars_rtree USING rtree(id, min_x, max_x, min_y, max_y, min_z, max_z)")
+    conn.execute("INSERT INTO stars_rtree SELECT id, x, x, y, y, z, z FROM stars")
+
+    if sorted_magnitudes is not None:
+        create_offsets_table(conn, sorted_magnitudes)
+
+
+def build_catalog_db(
+    path: Path,
+    batches: Iterable[Sequence[tuple]],
+    meta: Optional[Dict[str, str]] = None
+) -> Tuple[int, bool]:
+    """
+    Build the catalog database at path from batches of STAR_ROW_COLUMNS tuples
+
+    Batches should arrive in magnitude order (rowid order is then magnitude
+    order, see catalog.magnitude_index); otherwise no mag_offsets table is
+    written. meta goes to the catalog_meta table. Returns (number of stars,
+    whether they were in magnitude order).
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    conn = sqlite3.connect(str(tmp_path), isolation_level=None)
+    try:
+        for pragma in CATALOG_BUILD_PRAGMAS:
+            conn.execute(pragma)
+        conn.execute("BEGIN")
+        conn.execute(STARS_TABLE_SQL)
+
+        magnitude_index = STAR_ROW_COLUMNS.index('magnitude')
+        hpx_index = STAR_ROW_COLUMNS.index('hpx')
+        lod = LodAssigner(HEALPIX_ORDER)
+        magnitudes = []
+        in_order = True
+        count = 0
+        for batch in batches:
+            if not batch:
+                continue
+            batch_mags = np.fromiter((row[magnitude_index] for row in batch), dtype=np.float64, count=len(batch))
+            if np.any(batch_mags[1:] < batch_mags[:-1]) or (magnitudes and batch_mags[0] < magnitudes[-1][-1]):
+                in_order = False
+            magnitudes.append(batch_mags)
+            levels = lod.assign(np.fromiter((row[hpx_index] for row in batch), dtype=np.int64, count=len(batch)))
+            conn.executemany(INSERT_STAR_SQL, [row + (level,) for row, level in zip(batch, levels.tolist())])
+            count += len(batch)
+
+        create_catalog_indexes(
+            conn,
+            (np.concatenate(magnitudes) if magnitudes else np.array([])) if in_order else None
+        )
+        write_catalog_meta(conn, meta or {})
+        conn.execute("COMMIT")
+        conn.execute("ANALYZE")
+    except BaseException:
+        conn.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    conn.close()
+
+    # Atomic on the same filesystem: readers see the old or the new catalog
+    os.replace(tmp_path, path)
+    return count, in_order
+
+
+def _magnitude_order_kept(conn: sqlite3.Connection, ids: Iterable[int]) -> bool:
+    """Whether each given row still sits between its rowid neighbours' magnitudes"""
+    for row_id in ids:
+        magnitude = conn.execute("SELECT magnitude FROM stars WHERE id = ?", (row_id,)).fetchone()
+        if magnitude is None:
+            continue
+        before = conn.execute(
+            "SELECT magnitude FROM stars WHERE id < ? ORDER BY id DESC LIMIT 1", (row_id,)
+        ).fetchone()
+        after = conn.execute(
+            "SELECT magnitude FROM stars WHERE id > ? ORDER BY id ASC LIMIT 1", (row_id,)
+        ).fetchone()
+        if (before and before[0] > magnitude[0]) or (after and after[0] < magnitude[0]):
+            return False
+    return True
+
+
+def update_catalog_db(
+    path: Path,
+    batches: Iterable[Sequence[tuple]],
+    mag_limit: float,
+    meta: Optional[Dict[str, str]] = None
+) -> Dict[str, int]:
+    """
+    Refresh an existing catalog in place with delta rows and a new magnitude limit
+
+    Stars at or fainter than mag_limit are removed, then the batches
+    (STAR_ROW_COLUMNS tuples) are upserted by source_id. New stars are
+    fainter than the old limit, so they are appended and rowid order stays
+    magnitude order; only their R*Tree entries and LOD levels (looked up per
+touched HEALPix tile, see catalog.lod.assign_appended_lod), the affected
+    tail of mag_offsets and the catalog_meta table are rewritten. Everything
+    runs in one transaction, so readers see the old or the new catalog.
+
+    Returns counts of inserted, updated and removed stars, plus in_order
+    (False if an updated star broke magnitude order; mag_offsets is then
+    dropped and the catalog should be rebuilt).
+    """
+    conn = sqlite3.connect(str(path), isolation_level=None)
+    try:
+        conn.execute("PRAGMA cache_size=-524288")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"CREATE TEMP TABLE delta AS SELECT {', '.join(STAR_ROW_COLUMNS)} FROM stars WHERE 0")
+        conn.execute("BEGIN IMMEDIATE")
+
+        has_rtree = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stars_rtree'"
+        ).fetchone() is not None
+        has_offsets = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'mag_offsets'"
+        ).fetchone() is not None
+
+        # Trim: the faint tail of a magnitude-sorted table
+        if has_rtree:
+            conn.execute(
+                "DELETE FROM stars_rtree WHERE id IN (SELECT id FROM stars WHERE magnitude >= ?)", (mag_limit,)
+            )
+        removed = conn.execute("DELETE FROM stars WHERE magnitude >= ?", (mag_limit,)).rowcount
+        # Keep rowids dense (bright-catalog reads use id <= prefix length)
+        conn.execute(
+            "UPDATE sqlite_sequence SET seq = (SELECT IFNULL(MAX(id), 0) FROM stars) WHERE name = 'stars'"
+        )
+        last_id = conn.execute("SELECT IFNULL(MAX(id), 0) FROM stars").fetchone()[0]
+
+        # Stage the delta, then upsert it in one statement
+        for batch in batches:
+            if batch:
+                conn.executemany(
+                    f"INSERT INTO temp.delta VALUES ({', '.join('?' * len(STAR_ROW_COLUMNS))})", batch
+                )
+        conn.execute("DELETE FROM temp.delta WHERE magnitude >= ?", (mag_limit,))
+        staged_min = conn.execute("SELECT MIN(magnitude) FROM temp.delta").fetchone()[0]
+        updated_ids = [
+            row_id for (row_id,) in conn.execute(
+                "SELECT stars.id FROM temp.delta JOIN stars ON stars.source_id = temp.delta.source_id"
+            )
+        ]
+        updated_min = conn.execute(
+            "SELECT MIN(stars.magnitude) FROM temp.delta JOIN stars ON stars.source_id = temp.delta.source_id"
+        ).fetchone()[0]
+        # Updated stars that moved in magnitude or sky position change other stars' LOD ranks
+        moved = conn.execute("""
+            SELECT 1 FROM temp.delta JOIN stars ON stars.source_id = temp.delta.source_id
+            WHERE stars.magnitude != temp.delta.magnitude OR stars.hpx IS NOT temp.delta.hpx
+            LIMIT 1
+        """).fetchone() is not None
+        faintest = conn.execute("SELECT MAX(magnitude) FROM stars").fetchone()[0]
+        columns = ', '.join(STAR_ROW_COLUMNS)
+        # Update-then-insert rather than INSERT ... ON CONFLICT, which burns an
+        # AUTOINCREMENT id per conflicting row and would leave gaps in the rowids.
+        # Plain UPDATEs by source_id work on any SQLite (UPDATE ... FROM needs 3.33)
+        changes = conn.execute(f"""
+        SELECT {', '.join(f"delta.{name}" for name in STAR_ROW_COLUMNS[1:])}, delta.source_id
+        FROM temp.delta AS delta JOIN stars ON stars.source_id = delta.source_id
+        """).fetchall()
+        conn.executemany(
+            f"UPDATE stars SET {', '.join(f'{name} = ?' for name in STAR_ROW_COLUMNS[1:])} WHERE source_id = ?",
+            changes
+        )
+        conn.execute(f"""
+        INSERT INTO stars ({columns})
+        SELECT {columns} FROM temp.delta AS delta
+        WHERE NOT EXISTS (SELECT 1 FROM stars WHERE stars.source_id = delta.source_id)
+        ORDER BY magnitude ASC
+        """)
+        inserted = conn.execute("SELECT COUNT(*) FROM stars WHERE id > ?", (last_id,)).fetchone()[0]
+
+        # Derived indexes: only the rows that changed (B-tree indexes update themselves)
+        if has_rtree:
+            conn.executemany(
+                "INSERT OR REPLACE INTO stars_rtree SELECT id, x, x, y, y, z, z FROM stars WHERE id = ?",
+                [(row_id,) for row_id in updated_ids]
+            )
+            conn.execute("INSERT INTO stars_rtree SELECT id, x, x, y, y, z, z FROM stars WHERE id > ?", (last_id,))
+
+        if 'lod' in {row[1] for row in conn.execute("PRAGMA table_info(stars)")}:
+            appended_min = conn.execute("SELECT MIN(magnitude) FROM stars WHERE id > ?", (last_id,)).fetchone()[0]
+            unleveled = conn.execute(
+                "SELECT 1 FROM stars WHERE lod IS NULL AND id <= ? LIMIT 1", (last_id,)
+            ).fetchone() is not None
+            if moved or unleveled or (faintest is not None and appended_min is not None and appended_min < faintest):
+                update_lod_column(conn, HEALPIX_ORDER)
+            else:
+                # Earlier stars keep their levels; only the appended tiles are looked at
+                assign_appended_lod(conn, HEALPIX_ORDER, last_id)
+
+        in_order = _magnitude_order_kept(conn, updated_ids + [last_id + 1])
+        if has_offsets:
+            if not in_order:
+                conn.execute("DROP TABLE mag_offsets")
+            else:
+                changed = [m for m in (staged_min, updated_min) if m is not None]
+                if removed:
+                    changed.append(mag_limit)
+                if changed:
+                    update_offsets_table(conn, min(changed))
+
+        write_catalog_meta(conn, meta or {})
+        conn.execute("COMMIT")
+        conn.execute("PRAGMA optimize")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        conn.close()
+        raise
+    conn.close()
+    return {'inserted': inserted, 'updated': len(updated_ids), 'removed': removed, 'in_order': in_order}
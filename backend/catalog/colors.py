@@ -0,0 +1,120 @@
+"""
+Star color mapping shared by the catalog builder, GaiaService and the query engines
+Colors come from precomputed uint8 lookup tables indexed with whole NumPy
+columns; the catalog builder bakes the result into the `rgb` column so local
+queries never compute colors.
+"""
+import numpy as np
+
+
+# "bp_rp": ramp over Gaia BP-RP; "temperature": blackbody color from teff_gspphot
+# where available (BP-RP otherwise)
+COLOR_MODES = ("bp_rp", "temperature")
+
+LUT_SIZE = 4096
+BP_RP_RANGE = (-0.5, 4.0)
+TEFF_RANGE = (1000.0, 40000.0)
+
+
+def _bp_rp_ramp(bp_rp: np.ndarray) -> np.ndarray:
+    """
+    Piecewise-linear ramp from -0.5 (hot blue) to 4.0 (cool red), float RGB 0-1
+
+    Blue-white (O/B) -> white (A/F) -> yellow (G/K) -> orange-red (M)
+    """
+    normalized = np.clip((np.asarray(bp_rp, dtype=np.float64) + 0.5) / 4.5, 0.0, 1.0)
+    ones = np.ones_like(normalized)
+    conditions = [normalized < 0.2, normalized < 0.5, normalized < 0.7]
+    r = np.select(conditions, [0.6 + normalized * 2.0, ones, ones], ones)
+    g = np.select(
+        conditions,
+        [0.7 + normalized * 1.5, ones, 1.0 - (normalized - 0.5) * 1.5],
+        0.6 - (normalized - 0.7) * 1.0
+    )
+    b = np.select(conditions, [ones, 1.0 - (normalized - 0.2) * 2.0, 0.4 * ones], 0.3 * ones)
+    return np.clip(np.stack([r, g, b], axis=-1), 0.0, 1.0)
+
+
+def _blackbody_ramp(teff: np.ndarray) -> np.ndarray:
+    """
+    Approximate sRGB color of a blackbody at teff Kelvin, float RGB 0-1
+
+    Fit to the CIE 1964 blackbody locus (T. Helland's approximation), good to a
+    few percent over 1000-40000 K.
+    """
+    t = np.asarray(teff, dtype=np.float64) / 100.0
+    hot = t > 66.0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = np.where(hot, 329.698727446 * np.power(t - 60.0, -0.1332047592), 255.0)
+        g = np.where(
+            hot,
+            288.1221695283 * np.power(t - 60.0, -0.0755148492),
+            99.4708025861 * np.log(t) - 161.1195681661
+        )
+        b = np.where(
+            t >= 66.0, 255.0,
+            np.where(t <= 19.0, 0.0, 138.5177312231 * np.log(t - 10.0) - 305.0447927307)
+        )
+    return np.clip(np.stack([r, g, b], axis=-1) / 255.0, 0.0, 1.0)
+
+
+def _build_lut(ramp, value_range) -> np.ndarray:
+    values = np.linspace(value_range[0], value_range[1], LUT_SIZE)
+    return np.round(ramp(values) * 255).astype(np.uint8)
+
+
+BP_RP_LUT = _build_lut(_bp_rp_ramp, BP_RP_RANGE)
+TEFF_LUT = _build_lut(_blackbody_ramp, TEFF_RANGE)
+
+
+def _lut_index(values: np.ndarray, value_range) -> np.ndarray:
+    low, high = value_range
+    scaled = (values - low) * ((LUT_SIZE - 1) / (high - low))
+    return np.clip(np.rint(scaled), 0, LUT_SIZE - 1).astype(np.intp)
+
+
+def star_rgb8(bp_rp, temperature=None) -> np.ndarray:
+    """
+    (N, 3) uint8 colors for whole columns
+
+    Args:
+        bp_rp: BP-RP color index (NaN/None treated as 0)
+        temperature: Effective temperature in K; when given, stars with a known
+                     temperature use the blackbody table instead of BP-RP
+    """
+    bp_rp = np.nan_to_num(np.asarray(bp_rp, dtype=np.float64), nan=0.0)
+    rgb = BP_RP_LUT[_lut_index(bp_rp, BP_RP_RANGE)]
+    if temperature is not None:
+        teff = np.asarray(temperature, dtype=np.float64)
+        known = np.flatnonzero(teff > 0)
+        rgb[known] = TEFF_LUT[_lut_index(teff[known], TEFF_RANGE)]
+    return rgb
+
+
+def colors_for_mode(bp_rp, temperature, mode: str) -> np.ndarray:
+    """star_rgb8 for a COLOR_MODES setting"""
+    if mode not in COLOR_MODES:
+        raise ValueError(f"Unknown star color mode: {mode}")
+    return star_rgb8(bp_rp, temperature if mode == "temperature" else None)
+
+
+def pack_rgb8(rgb8: np.ndarray) -> np.ndarray:
+    """(N, 3) uint8 -> 0xRRGGBB integers, as stored in the catalog `rgb` column"""
+    rgb = np.asarray(rgb8, dtype=np.int64)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+
+def unpack_rgb8(packed) -> np.ndarray:
+    """0xRRGGBB integers -> (N, 3) uint8"""
+    packed = np.asarray(packed, dtype=np.int64)
+    return np.stack([(packed >> 16) & 0xFF, (packed >> 8) & 0xFF, packed & 0xFF], axis=-1).astype(np.uint8)
+
+
+def rgb8_to_float(rgb8: np.ndarray) -> np.ndarray:
+    """uint8 colors -> float64 in 0-1, as returned by the API"""
+    return np.asarray(rgb8, dtype=np.float64) / 255.0
+
+
+def packed_to_float(packed: int) -> tuple:
+    """One 0xRRGGBB value -> (r, g, b) floats (per-row helper for SQLite rows)"""
+    return ((packed >> 16) & 0xFF) / 255.0, ((packed >> 8) & 0xFF) / 255.0, (packed & 0xFF) / 255.0
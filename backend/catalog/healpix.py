@@ -0,0 +1,218 @@
+"""
+Minimal HEALPix (nested scheme) implementation for sky indexing
+Vectorized with NumPy so catalog builds and cone searches need no extra dependency
+
+Pixels are stored at a single deep order (HEALPIX_ORDER). Because the nested
+scheme is hierarchical, the parent pixel at any coarser order k is simply
+``pix >> 2 * (HEALPIX_ORDER - k)``, so one integer column indexes every order.
+"""
+from typing import List, Tuple
+import math
+
+import numpy as np
+
+
+# Order stored in the catalog DB: nside = 1024, ~3.4 arcmin pixels
+HEALPIX_ORDER = 10
+
+# Gaia source_id encodes the source's HEALPix level-12 nested pixel:
+# pixel = source_id // 2^35 (Gaia DR3 documentation, source_id)
+SOURCE_ID_HEALPIX_ORDER = 12
+SOURCE_ID_HEALPIX_SHIFT = 35
+
+# Face layout of the 12 base pixels (from healpix_base)
+_JRLL = np.array([2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4], dtype=np.int64)
+_JPLL = np.array([1, 3, 5, 7, 0, 2, 4, 6, 1, 3, 5, 7], dtype=np.int64)
+
+# Upper bound on pixel radius times nside. Measured maxima sit around 0.84 at
+# order 0 and ~1.05 at deep orders; padded so the disc search stays conservative.
+_MAX_PIXRAD_ORDER0 = 1.2
+
+
+def _spread_bits(v: np.ndarray) -> np.ndarray:
+    """Interleave zero bits between the low 32 bits of v"""
+    v = v.astype(np.uint64) & np.uint64(0x00000000FFFFFFFF)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x3333333333333333)
+    v = (v | (v << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return v.astype(np.int64)
+
+
+def _compress_bits(v: np.ndarray) -> np.ndarray:
+    """Inverse of _spread_bits: keep every other bit"""
+    v = v.astype(np.uint64) & np.uint64(0x5555555555555555)
+    v = (v | (v >> np.uint64(1))) & np.uint64(0x3333333333333333)
+    v = (v | (v >> np.uint64(2))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    v = (v | (v >> np.uint64(4))) & np.uint64(0x00FF00FF00FF00FF)
+    v = (v | (v >> np.uint64(8))) & np.uint64(0x0000FFFF0000FFFF)
+    v = (v | (v >> np.uint64(16))) & np.uint64(0x00000000FFFFFFFF)
+    return v.astype(np.int64)
+
+
+def ang2pix_nest(order: int, ra_deg, dec_deg) -> np.ndarray:
+    """
+    Convert RA/Dec (degrees) to nested HEALPix pixel ids at the given order
+
+    Args:
+        order: HEALPix order (nside = 2**order)
+        ra_deg, dec_deg: Scalars or arrays of equatorial coordinates
+
+    Returns:
+        int64 array of pixel ids
+    """
+    nside = 1 << order
+    z = np.sin(np.radians(np.asarray(dec_deg, dtype=np.float64)))
+    phi = np.radians(np.mod(np.asarray(ra_deg, dtype=np.float64), 360.0))
+    z, phi = np.broadcast_arrays(z, phi)
+    za = np.abs(z)
+    tt = np.mod(phi * (2.0 / math.pi), 4.0)
+
+    face = np.empty(z.shape, dtype=np.int64)
+    ix = np.empty(z.shape, dtype=np.int64)
+    iy = np.empty(z.shape, dtype=np.int64)
+
+    # Equatorial region
+    eq = za <= 2.0 / 3.0
+    if np.any(eq):
+        temp1 = nside * (0.5 + tt[eq])
+        temp2 = nside * (z[eq] * 0.75)
+        jp = (temp1 - temp2).astype(np.int64)
+        jm = (temp1 + temp2).astype(np.int64)
+        ifp = jp >> order
+        ifm = jm >> order
+        face[eq] = np.where(ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8))
+        ix[eq] = jm & (nside - 1)
+        iy[eq] = nside - (jp & (nside - 1)) - 1
+
+    # Polar caps
+    polar = ~eq
+    if np.any(polar):
+        ttp = tt[polar]
+        ntt = np.minimum(ttp.astype(np.int64), 3)
+        tp = ttp - ntt
+        tmp = nside * np.sqrt(3.0 * (1.0 - za[polar]))
+        jp = np.minimum((tp * tmp).astype(np.int64), nside - 1)
+        jm = np.minimum(((1.0 - tp) * tmp).astype(np.int64), nside - 1)
+        north = z[polar] >= 0
+        face[polar] = np.where(north, ntt, ntt + 8)
+        ix[polar] = np.where(north, nside - jm - 1, jp)
+        iy[polar] = np.where(north, nside - jp - 1, jm)
+
+    return (face << (2 * order)) + _spread_bits(ix) + (_spread_bits(iy) << 1)
+
+
+def pix2ang_nest(order: int, pix) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Convert nested HEALPix pixel ids to the RA/Dec (degrees) of pixel centers
+    """
+    nside = 1 << order
+    pix = np.asarray(pix, dtype=np.int64)
+    npface = nside * nside
+    face = pix >> (2 * order)
+    ipf = pix & (npface - 1)
+    ix = _compress_bits(ipf)
+    iy = _compress_bits(ipf >> 1)
+
+    jr = _JRLL[face] * nside - ix - iy - 1
+    fact2 = 4.0 / (12 * npface)
+    fact1 = 2 * nside * fact2
+
+    north = jr < nside
+    south = jr > 3 * nside
+    nr = np.where(north, jr, np.where(south, 4 * nside - jr, nside))
+    z = np.where(
+        north, 1.0 - nr * nr * fact2,
+        np.where(south, nr * nr * fact2 - 1.0, (2 * nside - jr) * fact1)
+    )
+    kshift = np.where(north | south, 0, (jr - nside) & 1)
+
+    jp = (_JPLL[face] * nr + ix - iy + 1 + kshift) // 2
+    jp = np.where(jp > 4 * nside, jp - 4 * nside, jp)
+    jp = np.where(jp < 1, jp + 4 * nside, jp)
+    phi = (jp - (kshift + 1) * 0.5) * (0.5 * math.pi / nr)
+
+    ra = np.degrees(phi) % 360.0
+    dec = np.degrees(np.arcsin(np.clip(z, -1.0, 1.0)))
+    return ra, dec
+
+
+def max_pixrad(order: int) -> float:
+    """Conservative upper bound on pixel center-to-corner distance (radians)"""
+    return _MAX_PIXRAD_ORDER0 / (1 << order)
+
+
+def order_for_radius(radius_deg: float, max_order: int = HEALPIX_ORDER) -> int:
+    """Pick the coarsest order whose pixels are under half the search radius"""
+    radius_rad = math.radians(radius_deg)
+    order = 0
+    while order < max_order and max_pixrad(order) > radius_rad / 2:
+        order += 1
+    return order
+
+
+def _unit_vectors(ra_deg, dec_deg) -> np.ndarray:
+    ra = np.radians(np.asarray(ra_deg, dtype=np.float64))
+    dec = np.radians(np.asarray(dec_deg, dtype=np.float64))
+    cos_dec = np.cos(dec)
+    return np.stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axis=-1)
+
+
+def query_disc_nest(order: int, ra_deg: float, dec_deg: float, radius_deg: float) -> np.ndarray:
+    """
+    Candidate pixels (nested, at `order`) that may intersect a disc on the sky
+
+    Descends the pixel hierarchy from the 12 base pixels, keeping children whose
+    bounding circle overlaps the disc. The result may contain a few pixels that
+    only touch the disc; callers apply an exact angular filter afterwards.
+    """
+    center = _unit_vectors(ra_deg, dec_deg)
+    radius_rad = math.radians(radius_deg)
+
+    pixels = np.arange(12, dtype=np.int64)
+    for level in range(order + 1):
+        if level > 0:
+            pixels = ((pixels << 2)[:, None] + np.arange(4, dtype=np.int64)).ravel()
+        pra, pdec = pix2ang_nest(level, pixels)
+        cos_dist = np.clip(_unit_vectors(pra, pdec) @ center, -1.0, 1.0)
+        limit = min(math.pi, radius_rad + max_pixrad(level))
+        pixels = pixels[np.arccos(cos_dist) <= limit]
+    return pixels
+
+
+def pixel_ranges(order: int, pixels: np.ndarray, target_order: int = HEALPIX_ORDER) -> List[Tuple[int, int]]:
+    """
+    Convert pixels at `order` into merged half-open id ranges at `target_order`
+
+    Adjacent nested pixels are contiguous at deeper orders, so a disc usually
+    collapses into a handful of ranges that map to index range scans.
+    """
+    if len(pixels) == 0:
+        return []
+    shift = 2 * (target_order - order)
+    ranges: List[Tuple[int, int]] = []
+    start = prev = None
+    for pix in np.sort(pixels).tolist():
+        if start is None:
+            start = prev = pix
+        elif pix == prev + 1:
+            prev = pix
+        else:
+            ranges.append((start << shift, (prev + 1) << shift))
+            start = prev = pix
+    ranges.append((start << shift, (prev + 1) << shift))
+    return ranges
+
+
+def source_id_range(order: int, pixel: int) -> Tuple[int, int]:
+    """Half-open Gaia source_id range of the sources in one nested pixel (order <= 12)"""
+    shift = SOURCE_ID_HEALPIX_SHIFT + 2 * (SOURCE_ID_HEALPIX_ORDER - order)
+    return pixel << shift, (pixel + 1) << shift
+
+
+def angular_separation_mask(ra_deg, dec_deg, center_ra: float, center_dec: float, radius_deg: float) -> np.ndarray:
+    """Exact mask of points within radius_deg of the center (great-circle distance)"""
+    vectors = _unit_vectors(ra_deg, dec_deg)
+    center = _unit_vectors(center_ra, center_dec)
+    return vectors @ center >= math.cos(math.radians(radius_deg))
@@ -0,0 +1,178 @@
+"""
+Level-of-detail pyramid over the sky
+Level L keeps the LOD_TILE_STARS brightest stars of every HEALPix tile of
+order L, so each level has a flat, known density (dense Milky Way tiles are
+capped, sparse ones keep everything) and every level contains the previous
+one. A star's LOD level is the first level that keeps it; a query at level L
+returns the stars with lod <= L.
+"""
+import math
+
+import numpy as np
+
+
+# Stars kept per tile at each level
+LOD_TILE_STARS = 256
+
+# Deepest pyramid level; stars past it get level LOD_MAX_ORDER + 1 (full depth)
+LOD_MAX_ORDER = 8
+
+# Tile lookups above which assign_appended_lod() recomputes the whole column
+LOD_TILE_LOOKUP_LIMIT = 20000
+
+SKY_AREA_DEG2 = 4 * math.pi * (180 / math.pi) ** 2
+
+
+def level_density(level: int, tile_stars: int = LOD_TILE_STARS) -> float:
+    """Upper bound on stars per square degree at a level"""
+    return tile_stars * 12 * 4 ** level / SKY_AREA_DEG2
+
+
+def level_for_budget(
+    budget: int,
+    radius_deg: float,
+    tile_stars: int = LOD_TILE_STARS,
+    max_order: int = LOD_MAX_ORDER
+) -> int:
+    """
+    Deepest level whose density fills a cone with at most about budget stars
+
+    Returns max_order + 1 (no thinning) when even the deepest level fits;
+    level 0 is the floor, so very wide cones may still exceed the budget.
+    """
+    area = 2 * math.pi * (1 - math.cos(math.radians(min(radius_deg, 180.0)))) * (180 / math.pi) ** 2
+    level = 0
+    while level <= max_order and level_density(level, tile_stars) * area <= budget:
+        level += 1
+    return max(level - 1, 0) if level <= max_order else max_order + 1
+
+
+def tile_ranks(tiles: np.ndarray) -> np.ndarray:
+    """Rank of each star within its tile, for stars given in magnitude order"""
+    tiles = np.asarray(tiles, dtype=np.int64)
+    if len(tiles) == 0:
+        return np.zeros(0, dtype=np.int64)
+    by_tile = np.argsort(tiles, kind='stable')
+    grouped = tiles[by_tile]
+    starts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+    first = np.repeat(starts, np.diff(np.r_[starts, len(grouped)]))
+    ranks = np.empty(len(tiles), dtype=np.int64)
+    ranks[by_tile] = np.arange(len(tiles)) - first
+    return ranks
+
+
+class LodAssigner:
+    """
+    LOD levels for stars arriving in magnitude order, batch by batch
+
+    Keeps per-tile star counts for every level, so a catalog can be leveled
+    while it streams into the database.
+    """
+
+    def __init__(self, pixel_order: int, tile_stars: int = LOD_TILE_STARS, max_order: int = LOD_MAX_ORDER):
+        """pixel_order: order of the nested HEALPix ids passed to assign() (>= max_order)"""
+        self.pixel_order = pixel_order
+        self.tile_stars = tile_stars
+        self.max_order = max_order
+        self.counts = [np.zeros(12 * 4 ** level, dtype=np.int64) for level in range(max_order + 1)]
+
+    def assign(self, pixels: np.ndarray) -> np.ndarray:
+        """Levels of the next stars (fainter than every star assigned before)"""
+        pixels = np.asarray(pixels, dtype=np.int64)
+        levels = np.full(len(pixels), self.max_order + 1, dtype=np.uint8)
+        # Finest level first: a star kept at a level is kept at every finer one
+        for level in range(self.max_order, -1, -1):
+            tiles = pixels >> (2 * (self.pixel_order - level))
+            counts = self.counts[level]
+            levels[counts[tiles] + tile_ranks(tiles) < self.tile_stars] = level
+            counts += np.bincount(tiles, minlength=len(counts))
+        return levels
+
+
+def lod_levels(
+    pixels: np.ndarray,
+    pixel_order: int,
+    tile_stars: int = LOD_TILE_STARS,
+    max_order: int = LOD_MAX_ORDER
+) -> np.ndarray:
+    """
+    LOD level of each star, for stars given in magnitude order
+
+    pixels are nested HEALPix ids at pixel_order (>= max_order); the tile at
+    level L is the parent pixel at order L.
+    """
+    return LodAssigner(pixel_order, tile_stars, max_order).assign(pixels)
+
+
+def thin_to_level(
+    pixels: np.ndarray,
+    pixel_order: int,
+    level: int,
+    tile_stars: int = LOD_TILE_STARS
+) -> np.ndarray:
+    """Mask keeping the tile_stars brightest of each level tile (stars in magnitude order)"""
+    pixels = np.asarray(pixels, dtype=np.int64)
+    if level > pixel_order:
+        return np.ones(len(pixels), dtype=bool)
+    return tile_ranks(pixels >> (2 * (pixel_order - level))) < tile_stars
+
+
+def update_lod_column(conn, pixel_order: int) -> int:
+    """
+    Recompute the `lod` column of the stars table from its `hpx` column
+
+    Stars are ranked in magnitude order and only rows whose level changed are
+    written, so refreshing a catalog that gained faint stars touches just the
+    new rows. Returns the number of rows written.
+    """
+    rows = conn.execute("SELECT id, hpx, lod FROM stars ORDER BY magnitude, id").fetchall()
+    if not rows:
+        return 0
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    pixels = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    stored = np.fromiter((-1 if row[2] is None else row[2] for row in rows), dtype=np.int64, count=len(rows))
+    levels = lod_levels(pixels, pixel_order)
+    changed = np.flatnonzero(levels != stored)
+    conn.executemany(
+        "UPDATE stars SET lod = ? WHERE id = ?",
+        zip(levels[changed].tolist(), ids[changed].tolist())
+    )
+    return len(changed)
+
+
+def assign_appended_lod(conn, pixel_order: int, last_id: int) -> int:
+    """
+    Level the rows appended after last_id, when none is brighter than an earlier star
+
+    Earlier stars keep their levels (a rank only counts brighter stars), so
+    only the new rows are written. The earlier stars of each level-L tile the
+    new rows fall in are counted through idx_lod_hpx: those with lod <= L are
+    the tile's first min(n, tile_stars) stars, so a lookup reads at most
+    LOD_TILE_STARS entries. Falls back to update_lod_column() when the new
+    rows touch more than LOD_TILE_LOOKUP_LIMIT tiles. Returns rows written.
+    """
+    rows = conn.execute(
+        "SELECT id, hpx FROM stars WHERE id > ? ORDER BY magnitude, id", (last_id,)
+    ).fetchall()
+    if not rows:
+        return 0
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    pixels = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    tiles = [np.unique(pixels >> (2 * (pixel_order - level))) for level in range(LOD_MAX_ORDER + 1)]
+    if sum(len(level_tiles) for level_tiles in tiles) > LOD_TILE_LOOKUP_LIMIT:
+        return update_lod_column(conn, pixel_order)
+
+    assigner = LodAssigner(pixel_order)
+    for level, level_tiles in enumerate(tiles):
+        shift = 2 * (pixel_order - level)
+        levels = ", ".join(str(kept) for kept in range(level + 1))
+        for tile in level_tiles.tolist():
+            assigner.counts[level][tile] = conn.execute(
+                f"SELECT COUNT(*) FROM stars WHERE lod IN ({levels}) AND hpx >= ? AND hpx < ? AND id <= ?",
+                (tile << shift, (tile + 1) << shift, last_id)
+            ).fetchone()[0]
+    conn.executemany(
+        "UPDATE stars SET lod = ? WHERE id = ?",
+        zip(assigner.assign(pixels).tolist(), ids.tolist())
+    )
+    return len(rows)
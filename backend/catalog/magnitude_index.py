@@ -0,0 +1,83 @@
+"""
+Magnitude prefix index
+Catalogs are stored sorted by magnitude, so "all stars brighter than m" is a
+row prefix. The offsets table maps magnitude edges to prefix lengths.
+"""
+from typing import List, Tuple
+import math
+
+import numpy as np
+
+
+# Spacing of magnitude edges in the mag_offsets table
+MAG_OFFSET_STEP = 0.1
+
+
+def build_offsets(sorted_magnitudes: np.ndarray, step: float = MAG_OFFSET_STEP) -> List[Tuple[float, int]]:
+    """
+    Cumulative counts for a magnitude-sorted catalog
+
+    Returns (edge, count) pairs where count is the number of stars with
+    magnitude < edge. Edges run from below the brightest star to just past
+    the faintest, so every limit falls between two rows.
+    """
+    mags = np.asarray(sorted_magnitudes, dtype=np.float64)
+    if len(mags) == 0:
+        return []
+    first = math.floor(mags[0] / step)
+    last = math.floor(mags[-1] / step) + 1
+    edges = np.round(np.arange(first, last + 1) * step, 6)
+    counts = np.searchsorted(mags, edges, side='left')
+    return list(zip(edges.tolist(), counts.tolist()))
+
+
+def create_offsets_table(conn, sorted_magnitudes: np.ndarray):
+    """(Re)create the mag_offsets table for a magnitude-sorted stars table"""
+    conn.execute("DROP TABLE IF EXISTS mag_offsets")
+    conn.execute("""
+    CREATE TABLE mag_offsets (
+        magnitude REAL PRIMARY KEY,
+        row_count INTEGER NOT NULL
+    )
+    """)
+    conn.executemany(
+        "INSERT INTO mag_offsets (magnitude, row_count) VALUES (?, ?)",
+        build_offsets(sorted_magnitudes)
+    )
+
+
+def update_offsets_table(conn, from_magnitude: float, step: float = MAG_OFFSET_STEP):
+    """
+    Rewrite the mag_offsets rows affected by a change at or above from_magnitude
+
+    For incremental refreshes that append, update or delete stars no brighter
+    than from_magnitude while keeping rowid order equal to magnitude order.
+    Only the rows of that tail are read; the result matches a full rebuild.
+    """
+    cut = math.floor(from_magnitude / step)
+    prefix_count, prefix_last = conn.execute(
+        "SELECT COUNT(*), MAX(magnitude) FROM stars WHERE magnitude < ?", (round(cut * step, 6),)
+    ).fetchone()
+    if not prefix_count:
+        mags = [m for (m,) in conn.execute("SELECT magnitude FROM stars ORDER BY id")]
+        create_offsets_table(conn, np.array(mags, dtype=np.float64))
+        return
+
+    # Edges between the last unchanged star and the tail keep the prefix count
+    cut = min(cut, math.floor(prefix_last / step) + 1)
+    edge = round(cut * step, 6)
+    tail = np.array(
+        [m for (m,) in conn.execute("SELECT magnitude FROM stars WHERE magnitude >= ? ORDER BY id", (edge,))],
+        dtype=np.float64
+    )
+    if len(tail):
+        tail_offsets = build_offsets(tail, step)
+        first = math.floor(tail[0] / step)
+    else:
+        tail_offsets = []
+        first = cut + 1
+    rows = [(round(k * step, 6), prefix_count) for k in range(cut, first)]
+    rows += [(edge, prefix_count + count) for edge, count in tail_offsets]
+
+    conn.execute("DELETE FROM mag_offsets WHERE magnitude >= ?", (edge,))
+    conn.executemany("INSERT INTO mag_offsets (magnitude, row_count) VALUES (?, ?)", rows)
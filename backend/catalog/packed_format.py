@@ -0,0 +1,85 @@
+"""
+Packed binary star payload for API responses
+Lets the viewer upload geometry straight into Float32Array/BufferAttribute
+without parsing one JSON object per star.
+
+Layout (little-endian), N = star count:
+    header      16 bytes: magic "STRS", version u16, flags u16, N u32, reserved u32
+    positions   float32[N * 3]  x, y, z in parsecs
+    colors      float32[N * 3]  r, g, b in 0-1
+    sizes       float32[N]      base point size derived from magnitude
+    (padding to an 8-byte boundary)
+    ids         int64[N]        Gaia source_id (0 if unknown)
+"""
+from typing import Dict, List
+import struct
+
+import numpy as np
+
+
+PACKED_MEDIA_TYPE = "application/octet-stream"
+PACKED_MAGIC = b"STRS"
+PACKED_VERSION = 1
+
+_HEADER = struct.Struct("<4sHHII")
+
+
+def magnitude_to_point_size(magnitude: np.ndarray) -> np.ndarray:
+    """Base point size per star, same brackets as the viewer's createGalaxyPoints"""
+    mag = np.asarray(magnitude, dtype=np.float32)
+    return np.select(
+        [mag < 2, mag < 3, mag < 4, mag < 5, mag < 6],
+        [
+            15.0 + (2 - mag) * 5.0,
+            10.0 + (3 - mag) * 5.0,
+            6.0 + (4 - mag) * 4.0,
+            3.0 + (5 - mag) * 3.0,
+            1.5 + (6 - mag) * 1.5,
+        ],
+        0.5 + np.maximum(0, (7 - mag) * 1.0)
+    ).astype(np.float32)
+
+
+def pack_arrays(
+    positions: np.ndarray,
+    colors: np.ndarray,
+    magnitudes: np.ndarray,
+    source_ids: np.ndarray
+) -> bytes:
+    """Pack (N, 3) positions, (N, 3) colors, (N,) magnitudes and (N,) ids"""
+    count = len(magnitudes)
+    parts = [
+        _HEADER.pack(PACKED_MAGIC, PACKED_VERSION, 0, count, 0),
+        np.ascontiguousarray(positions, dtype='<f4').tobytes(),
+        np.ascontiguousarray(colors, dtype='<f4').tobytes(),
+        magnitude_to_point_size(magnitudes).astype('<f4').tobytes(),
+    ]
+    # 16-byte header + 28 bytes per star; keep the int64 ids 8-byte aligned
+    if count % 2:
+        parts.append(b"\0" * 4)
+    parts.append(np.ascontiguousarray(source_ids, dtype='<i8').tobytes())
+    return b"".join(parts)
+
+
+def pack_star_records(stars: List[Dict]) -> bytes:
+    """Pack API star dictionaries (used when results only exist as dicts)"""
+    count = len(stars)
+
+    def column(key: str, default: float = 0.0) -> np.ndarray:
+        return np.fromiter(
+            (star[key] if star.get(key) is not None else default for star in stars),
+            dtype=np.float32, count=count
+        )
+
+    positions = np.stack([column('x'), column('y'), column('z')], axis=1) if count else np.empty((0, 3))
+    colors = np.stack([column('r', 1.0), column('g', 1.0), column('b', 1.0)], axis=1) if count else np.empty((0, 3))
+    source_ids = np.fromiter(
+        (int(star['source_id']) if star.get('source_id') else 0 for star in stars),
+        dtype=np.int64, count=count
+    )
+    return pack_arrays(positions, colors, column('magnitude', 15.0), source_ids)
+
+
+def packed_count(body: bytes) -> int:
+    """Star count stored in a packed payload header"""
+    return _HEADER.unpack_from(body)[3]
@@ -0,0 +1,213 @@
+"""
+Binary codec for cached query results
+Encodes lists of flat star dicts column by column (NumPy buffers instead of
+one JSON object per star), with optional zstd/lz4/zlib compression.
+
+Blob layout:
+    header      8 bytes: magic "QCV1", codec u8, compression u8, reserved u16
+    payload     (compressed) codec body
+
+Columnar body:
+    u32 length + JSON column directory {"count": N, "columns": [...]}
+    column buffers back to back, in directory order
+Column kinds:
+    f8 / i8     float64 / int64 values, plus a packed null bitmap if any None
+    str         int32 end offsets + utf-8 bytes
+    json        JSON list (mixed or nested values)
+"""
+from itertools import repeat
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import struct
+import zlib
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # optional dependency
+    lz4_frame = None
+
+
+CODEC_MAGIC = b"QCV1"
+CODEC_JSON = 0
+CODEC_COLUMNAR = 1
+
+COMPRESSIONS = {'none': 0, 'zlib': 1, 'zstd': 2, 'lz4': 3}
+
+_HEADER = struct.Struct("<4sBBH")
+_LENGTH = struct.Struct("<I")
+
+
+def available_compression(name: str) -> str:
+    """Resolve a CACHE_COMPRESSION setting to a codec that is installed"""
+    if name == 'auto':
+        if zstandard is not None:
+            return 'zstd'
+        if lz4_frame is not None:
+            return 'lz4'
+        return 'none'
+    if name == 'zstd' and zstandard is None:
+        return 'none'
+    if name == 'lz4' and lz4_frame is None:
+        return 'none'
+    if name not in COMPRESSIONS:
+        raise ValueError(f"Unknown cache compression: {name}")
+    return name
+
+
+def _compress(data: bytes, compression: str) -> bytes:
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if compression == 'lz4':
+        return lz4_frame.compress(data)
+    if compression == 'zlib':
+        return zlib.compress(data, 1)
+    return data
+
+
+def _decompress(data: bytes, compression: int) -> bytes:
+    if compression == COMPRESSIONS['zstd']:
+        if zstandard is None:
+            raise ValueError("Cached value is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if compression == COMPRESSIONS['lz4']:
+        if lz4_frame is None:
+            raise ValueError("Cached value is lz4-compressed but lz4 is not installed")
+        return lz4_frame.decompress(data)
+    if compression == COMPRESSIONS['zlib']:
+        return zlib.decompress(data)
+    return data
+
+
+def _column_kind(values: List[Any]) -> str:
+    """Narrowest exact column type for the values (None is allowed anywhere)"""
+    types = {type(v) for v in values if v is not None}
+    if not types:
+        return 'json'
+    if types <= {float}:
+        return 'f8'
+    if types <= {int}:
+        if all(-2**63 <= v < 2**63 for v in values if v is not None):
+            return 'i8'
+        return 'json'
+    if types <= {str}:
+        return 'str' if None not in values else 'json'
+    return 'json'
+
+
+def _encode_column(values: List[Any], kind: str) -> Tuple[Dict, List[bytes]]:
+    if kind in ('f8', 'i8'):
+        nulls = np.fromiter((v is None for v in values), dtype=bool, count=len(values))
+        has_nulls = bool(nulls.any())
+        if has_nulls:
+            values = [0 if v is None else v for v in values]
+        data = np.asarray(values, dtype='<' + kind).tobytes()
+        buffers = [data]
+        if has_nulls:
+            buffers.append(np.packbits(nulls).tobytes())
+        return {'kind': kind, 'nulls': has_nulls, 'sizes': [len(b) for b in buffers]}, buffers
+    if kind == 'str':
+        encoded = [v.encode('utf-8') for v in values]
+        ends = np.cumsum([len(b) for b in encoded], dtype=np.int64)
+        if len(ends) and ends[-1] >= 2**31:
+            return _encode_column(values, 'json')
+        buffers = [ends.astype('<i4').tobytes(), b''.join(encoded)]
+        return {'kind': 'str', 'sizes': [len(b) for b in buffers]}, buffers
+    data = json.dumps(values).encode('utf-8')
+    return {'kind': 'json', 'sizes': [len(data)]}, [data]
+
+
+def _decode_column(meta: Dict, buffers: List[memoryview], count: int) -> List[Any]:
+    kind = meta['kind']
+    if kind in ('f8', 'i8'):
+        values = np.frombuffer(buffers[0], dtype='<' + kind, count=count).tolist()
+        if meta.get('nulls'):
+            nulls = np.unpackbits(np.frombuffer(buffers[1], dtype=np.uint8), count=count)
+            for i in np.flatnonzero(nulls).tolist():
+                values[i] = None
+        return values
+    if kind == 'str':
+        ends = np.frombuffer(buffers[0], dtype='<i4', count=count).tolist()
+        starts = [0] + ends[:-1]
+        raw = bytes(buffers[1])
+        text = raw.decode('utf-8')
+        if len(text) == len(raw):
+            # ASCII (e.g. source_id strings): byte offsets are character offsets
+            return [text[s:e] for s, e in zip(starts, ends)]
+        return [raw[s:e].decode('utf-8') for s, e in zip(starts, ends)]
+    return json.loads(bytes(buffers[0]))
+
+
+def _columnar_keys(value: Any) -> Optional[List[str]]:
+    """Shared key order if value is a non-empty list of same-shaped flat dicts"""
+    if not isinstance(value, list) or not value or not isinstance(value[0], dict):
+        return None
+    keys = list(value[0].keys())
+    if not all(isinstance(k, str) for k in keys):
+        return None
+    for record in value:
+        if not isinstance(record, dict) or len(record) != len(keys) or record.keys() != value[0].keys():
+            return None
+    return keys
+
+
+def _encode_columnar(records: List[Dict], keys: List[str]) -> bytes:
+    directory = {'count': len(records), 'columns': []}
+    buffers: List[bytes] = []
+    for key in keys:
+        values = [record[key] for record in records]
+        meta, column_buffers = _encode_column(values, _column_kind(values))
+        meta['name'] = key
+        directory['columns'].append(meta)
+        buffers.extend(column_buffers)
+    header = json.dumps(directory, separators=(',', ':')).encode('utf-8')
+    return b''.join([_LENGTH.pack(len(header)), header] + buffers)
+
+
+def _decode_columnar(body: bytes) -> List[Dict]:
+    (header_len,) = _LENGTH.unpack_from(body, 0)
+    offset = _LENGTH.size
+    directory = json.loads(body[offset:offset + header_len])
+    offset += header_len
+    count = directory['count']
+
+    view = memoryview(body)
+    names = []
+    columns = []
+    for meta in directory['columns']:
+        buffers = []
+        for size in meta['sizes']:
+            buffers.append(view[offset:offset + size])
+            offset += size
+        names.append(meta['name'])
+        columns.append(_decode_column(meta, buffers, count))
+    return list(map(dict, map(zip, repeat(names), zip(*columns))))
+
+
+def encode_value(value: Any, compression: str = 'none', columnar: bool = True) -> bytes:
+    """Serialize a cached value to a self-describing blob"""
+    keys = _columnar_keys(value) if columnar else None
+    if keys is not None:
+        codec, body = CODEC_COLUMNAR, _encode_columnar(value, keys)
+    else:
+        codec, body = CODEC_JSON, json.dumps(value).encode('utf-8')
+    return _HEADER.pack(CODEC_MAGIC, codec, COMPRESSIONS[compression], 0) + _compress(body, compression)
+
+
+def decode_value(blob: bytes) -> Any:
+    """Inverse of encode_value"""
+    magic, codec, compression, _ = _HEADER.unpack_from(blob, 0)
+    if magic != CODEC_MAGIC:
+        raise ValueError("Not an encoded cache value")
+    body = _decompress(bytes(blob[_HEADER.size:]), compression)
+    if codec == CODEC_COLUMNAR:
+        return _decode_columnar(body)
+    if codec == CODEC_JSON:
+        return json.loads(body)
+    raise ValueError(f"Unknown cache codec: {codec}")
@@ -0,0 +1,120 @@
+"""
+Columnar (struct-of-arrays) layout of the star catalog
+Shared by the in-memory engine and the binary catalog writer
+"""
+from pathlib import Path
+from typing import Dict
+import hashlib
+import math
+import sqlite3
+
+import numpy as np
+
+from catalog.colors import colors_for_mode, unpack_rgb8
+
+
+# Column name -> (dtype, values per row). Order is the on-disk order of the binary format.
+STAR_COLUMN_LAYOUT = {
+    'source_id': ('<i8', 1),
+    'ra': ('<f8', 1),
+    'dec': ('<f8', 1),
+    'unit': ('<f8', 3),         # Unit vector on the sky, for cone searches
+    'x': ('<f4', 1),
+    'y': ('<f4', 1),
+    'z': ('<f4', 1),
+    'parallax': ('<f4', 1),
+    'distance_pc': ('<f4', 1),
+    'magnitude': ('<f4', 1),
+    'bp_rp': ('<f4', 1),
+    'rgb': ('u1', 3),
+    'pmra': ('<f4', 1),
+    'pmdec': ('<f4', 1),
+    'radial_velocity': ('<f4', 1),
+    'temperature': ('<f4', 1),
+}
+
+# Derived columns a binary catalog may also carry, so API workers map them
+# instead of each recomputing them at startup
+DERIVED_COLUMN_LAYOUT = {
+    'lod': ('u1', 1),           # LOD level (catalog.lod)
+}
+
+
+def unit_vectors(ra_deg: np.ndarray, dec_deg: np.ndarray) -> np.ndarray:
+    """(N, 3) float64 unit vectors for RA/Dec in degrees"""
+    ra_rad = np.radians(ra_deg)
+    dec_rad = np.radians(dec_deg)
+    cos_dec = np.cos(dec_rad)
+    return np.stack(
+        [cos_dec * np.cos(ra_rad), cos_dec * np.sin(ra_rad), np.sin(dec_rad)],
+        axis=1
+    )
+
+
+def columns_content_hash(columns: Dict[str, np.ndarray]) -> str:
+    """Digest of catalog columns in their binary layout (identifies catalog contents, e.g. for ETags)"""
+    digest = hashlib.blake2b(digest_size=16)
+    for name, (dtype, _) in STAR_COLUMN_LAYOUT.items():
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(columns[name], dtype=dtype))
+    return digest.hexdigest()
+
+
+def read_sqlite_columns(db_path: Path, color_mode: str = "bp_rp") -> Dict[str, np.ndarray]:
+    """
+    Load the whole `stars` table in one pass, in magnitude order
+
+    Colors come from the baked `rgb` column; rows without one (catalogs built
+    before it existed) are colored here with color_mode.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        has_rgb = any(row[1] == 'rgb' for row in conn.execute("PRAGMA table_info(stars)"))
+        rows = conn.execute(f"""
+        SELECT source_id, ra, dec, x, y, z, parallax, distance_pc, magnitude,
+               bp_rp, pmra, pmdec, radial_velocity, temperature,
+               {'rgb' if has_rgb else 'NULL AS rgb'}
+        FROM stars
+        ORDER BY magnitude ASC
+        """).fetchall()
+    finally:
+        conn.close()
+
+    count = len(rows)
+
+    def column(index: int, dtype) -> np.ndarray:
+        # None -> NaN for float columns
+        return np.fromiter(
+            (row[index] if row[index] is not None else math.nan for row in rows),
+            dtype=dtype, count=count
+        )
+
+    ra = column(1, np.float64)
+    dec = column(2, np.float64)
+    bp_rp = column(9, np.float32)
+    temperature = column(13, np.float32)
+
+    packed = np.fromiter((-1 if row[14] is None else row[14] for row in rows), dtype=np.int64, count=count)
+    rgb = unpack_rgb8(packed)
+    unbaked = np.flatnonzero(packed < 0)
+    if len(unbaked):
+        rgb[unbaked] = colors_for_mode(bp_rp[unbaked], temperature[unbaked], color_mode)
+
+    return {
+        'source_id': np.fromiter((int(row[0]) for row in rows), dtype=np.int64, count=count),
+        'ra': ra,
+        'dec': dec,
+        'unit': unit_vectors(ra, dec),
+        'x': column(3, np.float32),
+        'y': column(4, np.float32),
+        'z': column(5, np.float32),
+        'parallax': column(6, np.float32),
+        'distance_pc': column(7, np.float32),
+        'magnitude': column(8, np.float32),
+        'bp_rp': bp_rp,
+        'rgb': rgb,
+        'pmra': column(10, np.float32),
+        'pmdec': column(11, np.float32),
+        'radial_velocity': column(12, np.float32),
+        'temperature': temperature,
+    }
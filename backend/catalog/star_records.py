@@ -0,0 +1,239 @@
+"""
+Vectorized Gaia result -> star record conversion
+Shared by GaiaService and the catalog download script: distances, Cartesian
+positions, colors and null handling are computed on whole columns instead of
+per DataFrame row.
+"""
+from itertools import repeat
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from catalog.colors import colors_for_mode, pack_rgb8, rgb8_to_float, unpack_rgb8
+
+
+# Distance assigned to stars without a usable parallax (when no magnitude estimate is used)
+DEFAULT_DISTANCE_PC = 1000.0
+
+# Output key -> column name of gaia_columns(), for API responses and for catalog DB rows
+API_FIELDS: Sequence[Tuple[str, str]] = (
+    ('source_id', 'source_id'),
+    ('ra', 'ra'),
+    ('dec', 'dec'),
+    ('x', 'x'),
+    ('y', 'y'),
+    ('z', 'z'),
+    ('parallax', 'parallax'),
+    ('distance_pc', 'distance_pc'),
+    ('magnitude', 'magnitude'),
+    ('color_bp_rp', 'bp_rp'),
+    ('r', 'r'),
+    ('g', 'g'),
+    ('b', 'b'),
+    ('pm_ra', 'pmra'),
+    ('pm_dec', 'pmdec'),
+    ('radial_velocity', 'radial_velocity'),
+    ('temperature', 'temperature'),
+)
+
+CATALOG_FIELDS: Sequence[Tuple[str, str]] = (
+    ('source_id', 'source_id'),
+    ('ra', 'ra'),
+    ('dec', 'dec'),
+    ('x', 'x'),
+    ('y', 'y'),
+    ('z', 'z'),
+    ('parallax', 'parallax'),
+    ('distance_pc', 'distance_pc'),
+    ('magnitude', 'magnitude'),
+    ('bp_rp', 'bp_rp'),
+    ('rgb', 'rgb'),
+    ('pmra', 'pmra'),
+    ('pmdec', 'pmdec'),
+    ('radial_velocity', 'radial_velocity'),
+    ('temperature', 'temperature'),
+)
+
+
+def parallax_to_distance(parallax: np.ndarray, magnitude: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Distance in parsecs from parallax in mas (1000 / parallax, clamped to 0.1-100000)
+
+    Stars with a missing or non-positive parallax get DEFAULT_DISTANCE_PC, or a
+    rough magnitude-based estimate when magnitudes are given.
+    """
+    parallax = np.asarray(parallax, dtype=np.float64)
+    valid = parallax > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distance = np.clip(1000.0 / parallax, 0.1, 100000.0)
+    if magnitude is None:
+        return np.where(valid, distance, DEFAULT_DISTANCE_PC)
+    # Rough estimate for the (few) stars without parallax; scalar pow keeps
+    # results bit-identical to the per-row conversion this replaced
+    fallback = np.flatnonzero(~valid)
+    estimates = [10 ** ((mag - 5) / 5 + 1) for mag in np.asarray(magnitude, dtype=np.float64)[fallback].tolist()]
+    distance[fallback] = estimates
+    return distance
+
+
+def equatorial_to_cartesian(ra_deg: np.ndarray, dec_deg: np.ndarray, distance_pc: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Convert RA/Dec/distance to Cartesian X/Y/Z (parsecs)
+
+    Right-handed: X towards RA=0/Dec=0, Y towards RA=90, Z towards the north celestial pole
+    """
+    ra_rad = np.radians(ra_deg)
+    dec_rad = np.radians(dec_deg)
+    x = distance_pc * np.cos(dec_rad) * np.cos(ra_rad)
+    y = distance_pc * np.cos(dec_rad) * np.sin(ra_rad)
+    z = distance_pc * np.sin(dec_rad)
+    return x, y, z
+
+
+def _float_column(df: pd.DataFrame, name: str) -> np.ndarray:
+    """Column as float64 with NaN for nulls (all NaN if the column is absent)"""
+    if name not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _source_ids(df: pd.DataFrame) -> List[Optional[str]]:
+    """source_id as decimal strings (None for nulls), without a float64 round trip"""
+    if 'source_id' not in df.columns:
+        return [None] * len(df)
+    column = df['source_id']
+    if pd.api.types.is_integer_dtype(column.dtype) and not column.isna().any():
+        return list(map(str, column.astype(np.int64).tolist()))
+    return [str(int(v)) if pd.notna(v) else None for v in column.tolist()]
+
+
+def gaia_columns(df: pd.DataFrame, magnitude_distance: bool = False, color_mode: str = "bp_rp") -> Dict[str, np.ndarray]:
+    """
+    Derived star columns for a Gaia result DataFrame (lowercase column names)
+
+    NaN marks nulls in parallax, bp_rp, radial_velocity and temperature; missing
+    proper motions become 0. Colors come from the shared lookup tables, as
+    floats (r, g, b) and packed 0xRRGGBB (rgb, the catalog DB column).
+
+    Args:
+        df: Gaia rows (source_id, ra, dec, parallax, pmra, pmdec, phot_g_mean_mag, bp_rp, ...)
+        magnitude_distance: Estimate distance from magnitude when parallax is unusable
+                            (otherwise DEFAULT_DISTANCE_PC)
+        color_mode: One of catalog.colors.COLOR_MODES
+    """
+    ra = _float_column(df, 'ra')
+    dec = _float_column(df, 'dec')
+    magnitude = _float_column(df, 'phot_g_mean_mag')
+    parallax = _float_column(df, 'parallax')
+    bp_rp = _float_column(df, 'bp_rp')
+
+    distance_pc = parallax_to_distance(parallax, magnitude if magnitude_distance else None)
+    x, y, z = equatorial_to_cartesian(ra, dec, distance_pc)
+    temperature = _float_column(df, 'temperature')
+    rgb8 = colors_for_mode(bp_rp, temperature, color_mode)
+    rgb = rgb8_to_float(rgb8)
+
+    return {
+        'source_id': np.array(_source_ids(df), dtype=object),
+        'ra': ra,
+        'dec': dec,
+        'x': x,
+        'y': y,
+        'z': z,
+        'parallax': parallax,
+        'distance_pc': distance_pc,
+        'magnitude': magnitude,
+        'bp_rp': bp_rp,
+        'r': rgb[:, 0],
+        'g': rgb[:, 1],
+        'b': rgb[:, 2],
+        'rgb': pack_rgb8(rgb8),
+        'pmra': np.nan_to_num(_float_column(df, 'pmra'), nan=0.0),
+        'pmdec': np.nan_to_num(_float_column(df, 'pmdec'), nan=0.0),
+        'radial_velocity': _float_column(df, 'radial_velocity'),
+        'temperature': temperature,
+    }
+
+
+def columns_to_records(columns: Dict[str, np.ndarray], fields: Sequence[Tuple[str, str]] = API_FIELDS) -> List[Dict]:
+    """Build star dictionaries from columns; NaN in float columns becomes None"""
+    keys = [key for key, _ in fields]
+    values = []
+    for _, name in fields:
+        column = columns[name]
+        out = column.tolist()
+        if column.dtype.kind == 'f':
+            for i in np.flatnonzero(np.isnan(column)).tolist():
+                out[i] = None
+        values.append(out)
+    return list(map(dict, map(zip, repeat(keys), zip(*values))))
+
+
+def catalog_row_columns(rows: Sequence[Sequence], color_mode: str = "bp_rp") -> Dict[str, np.ndarray]:
+    """
+    API star columns for catalog DB rows, as numeric arrays
+
+    Rows hold source_id, ra, dec, x, y, z, parallax, distance_pc, magnitude,
+    bp_rp, pmra, pmdec, radial_velocity, temperature and rgb, in that order.
+    Values match the per-row SQLite conversion: a null or zero parallax,
+    radial velocity or temperature is NaN (None in records), a null BP-RP or
+    proper motion is 0, and rows without a baked color are colored with
+    color_mode. source_id stays int64 (see catalog_records()).
+    """
+    count = len(rows)
+
+    def column(index: int, dtype=np.float64) -> np.ndarray:
+        return np.fromiter(
+            (np.nan if row[index] is None else row[index] for row in rows),
+            dtype=dtype, count=count
+        )
+
+    def nonzero(index: int) -> np.ndarray:
+        values = column(index)
+        values[values == 0] = np.nan
+        return values
+
+    bp_rp = np.nan_to_num(column(9), nan=0.0)
+    temperature = column(13)
+    packed = np.fromiter((-1 if row[14] is None else row[14] for row in rows), dtype=np.int64, count=count)
+    unbaked = np.flatnonzero(packed < 0)
+    if len(unbaked):
+        packed[unbaked] = pack_rgb8(colors_for_mode(bp_rp[unbaked], temperature[unbaked], color_mode))
+    rgb = rgb8_to_float(unpack_rgb8(packed)).reshape(count, 3)
+
+    return {
+        'source_id': np.fromiter((int(row[0]) for row in rows), dtype=np.int64, count=count),
+        'ra': column(1),
+        'dec': column(2),
+        'x': column(3),
+        'y': column(4),
+        'z': column(5),
+        'parallax': nonzero(6),
+        'distance_pc': column(7),
+        'magnitude': column(8),
+        'bp_rp': bp_rp,
+        'r': rgb[:, 0],
+        'g': rgb[:, 1],
+        'b': rgb[:, 2],
+        'pmra': np.nan_to_num(column(10), nan=0.0),
+        'pmdec': np.nan_to_num(column(11), nan=0.0),
+        'radial_velocity': nonzero(12),
+        'temperature': np.where(temperature == 0, np.nan, temperature),
+    }
+
+
+def catalog_records(columns: Dict[str, np.ndarray]) -> List[Dict]:
+    """Star dictionaries for catalog_row_columns() output"""
+    source_ids = np.array(list(map(str, columns['source_id'].tolist())), dtype=object)
+    return columns_to_records({**columns, 'source_id': source_ids}, API_FIELDS)
+
+
+def dataframe_to_stars(
+    df: pd.DataFrame,
+    magnitude_distance: bool = False,
+    color_mode: str = "bp_rp",
+    fields: Sequence[Tuple[str, str]] = API_FIELDS
+) -> List[Dict]:
+    """Gaia result DataFrame -> list of star dictionaries"""
+    return columns_to_records(gaia_columns(df, magnitude_distance, color_mode), fields)
@@ -0,0 +1,93 @@
+"""
+Incremental parsing of TAP CSV results into NumPy column chunks
+Bytes are parsed as they arrive and handed out in fixed-size chunks of
+preallocated columns, so a result of any size is held at most one chunk
+(plus one partial line) at a time, instead of as text, table and DataFrame.
+"""
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+
+# Rows per parsed chunk
+DEFAULT_CHUNK_ROWS = 50000
+
+# Integer columns of the Gaia star queries; every other column is float64
+# with NaN for empty (null) fields
+INT_COLUMNS = ('source_id',)
+
+
+class CsvColumnChunker:
+    """
+    Push parser for TAP CSV output (header line, then numeric rows)
+
+    feed() bytes as they are received and collect the full chunks it
+    returns; flush() returns the final partial chunk. Quoted fields are only
+    supported in the header, which is all the star queries produce.
+    """
+
+    def __init__(self, chunk_rows: int = DEFAULT_CHUNK_ROWS, int_columns: Sequence[str] = INT_COLUMNS):
+        self.chunk_rows = chunk_rows
+        self.int_columns = set(int_columns)
+        self.names: Optional[List[str]] = None
+        self.rows = 0
+        self._partial = b''
+        self._lines: List[bytes] = []
+
+    def feed(self, data: bytes) -> List[Dict[str, np.ndarray]]:
+        """Consume received bytes; returns the chunks completed by them"""
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        if self.names is None and lines:
+            self.names = [name.strip().strip('"').lower() for name in lines.pop(0).decode('utf-8').split(',')]
+        self._lines.extend(lines)
+
+        chunks = []
+        while len(self._lines) >= self.chunk_rows:
+            chunks.append(self._parse(self._lines[:self.chunk_rows]))
+            del self._lines[:self.chunk_rows]
+        return chunks
+
+    def flush(self) -> Optional[Dict[str, np.ndarray]]:
+        """Parse whatever is left at the end of the stream (None if nothing)"""
+        if self._partial:
+            if self.names is None:
+                self.names = [name.strip().strip('"').lower() for name in self._partial.decode('utf-8').split(',')]
+            else:
+                self._lines.append(self._partial)
+            self._partial = b''
+        lines = [line for line in self._lines if line.strip()]
+        self._lines = []
+        return self._parse(lines) if lines else None
+
+    def _parse(self, lines: List[bytes]) -> Dict[str, np.ndarray]:
+        lines = [line.rstrip(b'\r') for line in lines if line.strip()]
+        count = len(lines)
+        width = len(self.names)
+        fields = b','.join(lines).split(b',')
+        if len(fields) != count * width:
+            raise ValueError(f"Malformed TAP CSV: expected {width} fields per row")
+        raw = np.array(fields, dtype=np.bytes_).reshape(count, width)
+
+        columns = {}
+        for j, name in enumerate(self.names):
+            values = raw[:, j]
+            if name in self.int_columns:
+                column = np.empty(count, dtype=np.int64)
+            else:
+                column = np.empty(count, dtype=np.float64)
+                values = np.where(values == b'', b'nan', values)
+            column[:] = values  # parses the byte strings in C
+            columns[name] = column
+        self.rows += count
+        return columns
+
+
+def iter_csv_chunks(data: Iterable[bytes], chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[Dict[str, np.ndarray]]:
+    """Column chunks from a byte stream (e.g. a streamed HTTP response body)"""
+    chunker = CsvColumnChunker(chunk_rows)
+    for block in data:
+        yield from chunker.feed(block)
+    last = chunker.flush()
+    if last is not None:
+        yield last
@@ -36,20 +36,71 @@ class Settings(BaseSettings):
     CACHE_ENABLED: bool = True
     CACHE_TTL_SECONDS: int = 3600
     CACHE_DB_PATH: str = "cache.db"
+    # In-memory LRU bounds (entries beyond these are served from the SQLite cache)
+    CACHE_MEMORY_MAX_ENTRIES: int = 4096
+    CACHE_MEMORY_MAX_MB: int = 256
+    # SQLite cache value encoding: "columnar" (binary, see catalog/record_codec.py) or "json";
+    # compression is "auto" (zstd, then lz4 if installed), "zstd", "lz4", "zlib" or "none"
+    CACHE_CODEC: str = "columnar"
+    CACHE_COMPRESSION: str = "auto"
+    
+    # Bright catalog responses: mag_limit is rounded up to a multiple of BRIGHT_CATALOG_MAG_STEP,
+    # and each (bucket, format) body is serialized and compressed once, kept in an LRU of this
+    # many entries and sent with an ETag and this client cache lifetime
+    BRIGHT_CATALOG_MAG_STEP: float = 0.5
+    BRIGHT_CATALOG_CACHE_ENTRIES: int = 8
+    BRIGHT_CATALOG_MAX_AGE_SECONDS: int = 3600
+    # mag_limit buckets whose bodies are built at startup: "all" or comma-separated limits.
+    # Only the last BRIGHT_CATALOG_CACHE_ENTRIES bodies built stay in memory, the default
+    # bucket's among them; "all" relies on BRIGHT_CATALOG_SHARED_DIR for the others
+    BRIGHT_CATALOG_PREBUILD: str = "7.0"
+    # Where API workers share built bodies so only one of them builds each ("" = per worker)
+    BRIGHT_CATALOG_SHARED_DIR: str = "cache/bright_catalog"
+    
+    # Startup warmup (services/warmup.py): runs in the background after startup;
+    # /health/ready answers 503 until it finishes
+    WARMUP_ENABLED: bool = True
+    WARMUP_PRELOAD_CATALOG: bool = True
+    WARMUP_PATHS: str = ""  # More GET paths to warm (comma-separated); Gaia-backed ones query the archive
+    WARMUP_REQUEST_TIMEOUT_SECONDS: int = 120
+    # Lock file so one API worker sends the warmup requests ("" = every worker)
+    WARMUP_LOCK_FILE: str = "cache/warmup.lock"
     
     # Gaia Archive
     GAIA_TAP_URL: str = "https://gea.esac.esa.int/tap-server/tap"
     GAIA_MAX_ROWS: int = 100000
     GAIA_TIMEOUT_SECONDS: int = 60
+    GAIA_STREAM_CHUNK_ROWS: int = 50000  # Rows per parsed chunk of a streamed TAP result
     
     # Query Limits
     MAX_STARS_PER_REQUEST: int = 50000
+    STREAM_BATCH_SIZE: int = 1000  # Stars per chunk for streamed (NDJSON) responses
     SPATIAL_INDEX_ENABLED: bool = True
+    # "sqlite" queries the catalog DB per request; "memory" loads it into NumPy columns at startup
+    CATALOG_ENGINE: str = "sqlite"
+    # Honor the `budget` parameter of star queries with the LOD pyramid (catalog/lod.py)
     LOD_ENABLED: bool = True
+    # Star colors: "bp_rp" (BP-RP ramp) or "temperature" (blackbody from teff_gspphot, BP-RP fallback).
+    # Local catalogs bake colors when built; this applies to live Gaia results and old catalogs
+    STAR_COLOR_MODE: str = "bp_rp"
     
     # Performance
+    # API processes started by serve.py (app.py runs a single reloading process when DEBUG)
     WORKER_COUNT: int = 4
     MAX_CONCURRENT_QUERIES: int = 10
+    API_PROCESSES: int = 1  # Set by serve.py for its workers
+    # Executor pools (services/executors.py): threads for blocking I/O, worker processes
+    # for CPU-bound catalog scans (0 = run those on the I/O threads, -1 = the CPU
+    # count divided by the API processes)
+    IO_POOL_THREADS: int = 16
+    CPU_POOL_PROCESSES: int = -1
+    
+    # Metrics (GET /metrics, Prometheus text format; services/metrics.py)
+    METRICS_ENABLED: bool = True
+    # Where serve.py workers exchange metric snapshots, so /metrics on any of them covers all
+    METRICS_SHARED_DIR: str = "cache/metrics"
+    METRICS_FLUSH_SECONDS: float = 5.0
+    METRICS_MULTIPROCESS: bool = False  # Set by serve.py for its workers
     
     # Logging
     LOG_LEVEL: str = "INFO"
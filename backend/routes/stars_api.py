@@ -2,13 +2,26 @@
 API Routes for Star Queries
 Handles real-time Gaia data requests from frontend
 """
-from fastapi import APIRouter, HTTPException, Query
-from typing import List, Dict, Optional
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from typing import Any, Awaitable, List, Dict, Iterable, Iterator, Optional
 from pydantic import BaseModel, Field
 from loguru import logger
+import asyncio
+import json
+import time
 
 from services.local_catalog_service import local_catalog_service
+from services.gaia_service import gaia_service
 from services.cache_service import cache_service
+from services.single_flight import single_flight
+from services.sky_tile_cache import gaia_tile_cache
+from services.bright_catalog_responses import (
+    DEFAULT_MAG_LIMIT, MAX_MAG_LIMIT, MIN_MAG_LIMIT, bright_catalog_responses, mag_limit_bucket
+)
+from services.metrics import current_endpoint, metrics
+from catalog.packed_format import PACKED_MEDIA_TYPE, pack_star_records, packed_count
+from catalog.lod import LOD_MAX_ORDER, level_for_budget
 from config import settings
 
 
@@ -22,6 +35,7 @@ class StarResponse(BaseModel):
     stars: List[Dict]
     cached: bool = False
     query_time_ms: Optional[float] = None
+    lod_level: Optional[int] = None
 
 
 class BrightCatalogResponse(BaseModel):
@@ -33,57 +47,208 @@ class BrightCatalogResponse(BaseModel):
     query_time_ms: Optional[float] = None
 
 
+# Response formats: json (default), bin (packed Float32 buffers), ndjson (streamed, one star per line)
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+FORMAT_QUERY = Query(None, pattern="^(json|bin|ndjson)$", description="Response format: json (default), bin (packed Float32 buffers) or ndjson (streamed)")
+
+
+def negotiate_format(request: Request, format: Optional[str]) -> str:
+    """Pick the response format from ?format= or the Accept header"""
+    if format is not None:
+        return format
+    accept = request.headers.get("accept", "")
+    if PACKED_MEDIA_TYPE in accept:
+        return "bin"
+    if NDJSON_MEDIA_TYPE in accept:
+        return "ndjson"
+    return "json"
+
+
+def lod_headers(lod_level: Optional[int]) -> Dict[str, str]:
+    return {} if lod_level is None else {"X-LOD-Level": str(lod_level)}
+
+
+def packed_response(body: bytes, query_time_ms: float, cached: bool = False, lod_level: Optional[int] = None) -> Response:
+    """Wrap a packed payload; metadata that JSON carries in the body goes in headers"""
+    return Response(
+        content=body,
+        media_type=PACKED_MEDIA_TYPE,
+        headers={
+            "X-Star-Count": str(packed_count(body)),
+            "X-Query-Time-Ms": f"{query_time_ms:.2f}",
+            "X-Cached": "true" if cached else "false",
+            **lod_headers(lod_level)
+        }
+    )
+
+
+def json_response(body: BaseModel, backend: str) -> JSONResponse:
+    """
+    Serialize a response model as FastAPI would for response_model routes
+    
+    Done here so the serialization stage is timed (backend: where the stars
+    came from, local or remote).
+    """
+    with metrics.stage("serialization", backend):
+        return JSONResponse(content=body.model_dump(mode="json"))
+
+
+def ndjson_response(batches: Iterable[List[Dict]], backend: str, cached: bool = False, lod_level: Optional[int] = None) -> StreamingResponse:
+    """
+    Stream star batches as NDJSON
+    
+    Each batch is serialized and sent as it is produced, so time-to-first-byte
+    and peak memory depend on the batch size rather than the result size.
+    """
+    endpoint = current_endpoint.get()
+    
+    def lines():
+        serializing = 0.0
+        try:
+            for batch in batches:
+                start = time.perf_counter()
+                text = "".join(json.dumps(star) + "\n" for star in batch)
+                serializing += time.perf_counter() - start
+                yield text
+        finally:
+            metrics.observe_stage("serialization", backend, serializing, endpoint)
+    
+    return StreamingResponse(
+        lines(),
+        media_type=NDJSON_MEDIA_TYPE,
+        headers={"X-Cached": "true" if cached else "false", **lod_headers(lod_level)}
+    )
+
+
+BUDGET_DESCRIPTION = (
+    "Star budget for the view (level of detail): returns the LOD level whose even sky density "
+    "fills the cone with about this many stars; zooming in (smaller radius) reaches deeper levels"
+)
+
+
+def choose_lod_level(budget: Optional[int], radius_deg: float) -> Optional[int]:
+    """LOD level for a star budget over a cone (None = no thinning: no budget, LOD_ENABLED off or full depth fits)"""
+    if budget is None or not settings.LOD_ENABLED:
+        return None
+    level = level_for_budget(budget, radius_deg)
+    return level if level <= LOD_MAX_ORDER else None
+
+
+# Status logged for requests abandoned by the client (nginx convention; never delivered)
+CLIENT_CLOSED_REQUEST = 499
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+class ClientDisconnected(Exception):
+    """The client went away before its query finished"""
+
+
+async def cancel_on_disconnect(request: Request, awaitable: Awaitable[Any]) -> Any:
+    """
+    Await a query, cancelling it if the client disconnects first
+    
+    Cancellation reaches the remote Gaia query (see SingleFlight.do for
+    queries shared with other clients) and frees its concurrency slot.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        task.cancel()
+
+
+def list_batches(stars: List[Dict]) -> Iterator[List[Dict]]:
+    """Split an already materialized result into streaming batches"""
+    batch_size = settings.STREAM_BATCH_SIZE
+    for start in range(0, len(stars), batch_size):
+        yield stars[start:start + batch_size]
+
+
 # Simple GET endpoint for frontend compatibility
 @router.get("/region", response_model=StarResponse)
 async def query_region(
+    request: Request,
     ra: float = Query(..., ge=0, le=360, description="Right ascension in degrees"),
     dec: float = Query(..., ge=-90, le=90, description="Declination in degrees"),
     radius: float = Query(5.0, gt=0, le=30, description="Search radius in degrees"),
-    limit: int = Query(5000, ge=1, le=50000, description="Maximum stars to return")
+    limit: int = Query(5000, ge=1, le=50000, description="Maximum stars to return"),
+    budget: Optional[int] = Query(None, ge=1, le=50000, description=BUDGET_DESCRIPTION),
+    format: Optional[str] = FORMAT_QUERY
 ):
     """
     Query stars in a region from LOCAL CATALOG (GET endpoint for frontend)
     
     Example: /api/stars/region?ra=266.4&dec=-29.0&radius=5.0&limit=1000
+    Binary:  /api/stars/region?ra=266.4&dec=-29.0&radius=5.0&limit=1000&format=bin
+    Stream:  /api/stars/region?ra=266.4&dec=-29.0&radius=5.0&limit=1000&format=ndjson
+    LOD:     /api/stars/region?ra=266.4&dec=-29.0&radius=15.0&limit=50000&budget=5000
     """
     try:
         import time
         start_time = time.time()
         
-        # Check cache
-        cache_key = f"stars:region:{ra:.2f}:{dec:.2f}:{radius:.2f}:{limit}"
-        
-        cached_result = await cache_service.get(cache_key)
-        if cached_result:
-            return StarResponse(
-                count=len(cached_result),
-                stars=cached_result,
-                cached=True,
-                query_time_ms=0
+        response_format = negotiate_format(request, format)
+        lod_level = choose_lod_level(budget, radius)
+        
+        if response_format == "ndjson":
+            # Batches come straight from the catalog query, no full result list
+            return ndjson_response(metrics.timed_batches(local_catalog_service.iter_cone_batches(
+                ra=ra,
+                dec=dec,
+                radius_deg=radius,
+                max_stars=limit,
+                mag_limit=12.0,
+                batch_size=settings.STREAM_BATCH_SIZE,
+                lod_level=lod_level
+            ), "catalog_query", "local"), "local", lod_level=lod_level)
+        
+        if response_format == "bin":
+            # Identical concurrent requests share one packed query
+            body = await single_flight.do(
+                f"region:bin:{ra}:{dec}:{radius}:{limit}:{lod_level}",
+                lambda: local_catalog_service.query_cone_packed_async(
+                    ra=ra,
+                    dec=dec,
+                    radius_deg=radius,
+                    max_stars=limit,
+                    mag_limit=12.0,
+                    lod_level=lod_level
+                )
+            )
+            return packed_response(body, (time.time() - start_time) * 1000, lod_level=lod_level)
+        
+        # Check cache; concurrent misses for the same key run one query
+        cache_key = f"stars:region:{ra:.2f}:{dec:.2f}:{radius:.2f}:{limit}:{lod_level}"
+        
+        # Query LOCAL CATALOG (HEALPix-indexed cone search, no network calls)
+        stars, cached = await cache_service.get_or_compute(
+            cache_key,
+            lambda: local_catalog_service.query_cone_async(
+                ra=ra,
+                dec=dec,
+                radius_deg=radius,
+                max_stars=limit,
+                mag_limit=12.0,  # Show dimmer stars in zoomed regions
+                lod_level=lod_level
             )
-        
-        # Query LOCAL CATALOG (fast SQLite query, no network calls)
-        stars = await local_catalog_service.query_nearby_stars_async(
-            camera_x=0,  # Will implement proper camera position later
-            camera_y=0,
-            camera_z=0,
-            max_distance=1000.0,  # parsecs
-            mag_limit=12.0  # Show dimmer stars in zoomed regions
         )
-        
-        # Cache result
-        await cache_service.set(cache_key, stars)
-        
         query_time = (time.time() - start_time) * 1000
         
-        logger.info(f"Region query returned {len(stars)} stars in {query_time:.2f}ms (RA={ra:.2f}, Dec={dec:.2f}, R={radius:.2f}°)")
+        if not cached:
+            logger.info(f"Region query returned {len(stars)} stars in {query_time:.2f}ms (RA={ra:.2f}, Dec={dec:.2f}, R={radius:.2f}°, LOD={lod_level})")
         
-        return StarResponse(
+        return json_response(StarResponse(
             count=len(stars),
             stars=stars,
-            cached=False,
-            query_time_ms=query_time
-        )
+            cached=cached,
+            query_time_ms=query_time,
+            lod_level=lod_level
+        ), "local")
         
     except Exception as e:
         logger.error(f"Region query failed: {e}")
@@ -92,13 +257,19 @@ async def query_region(
 
 @router.get("/bright-catalog", response_model=BrightCatalogResponse)
 async def get_bright_catalog(
-    mag_limit: float = Query(7.0, ge=1.0, le=10.0, description="Magnitude limit (brighter = lower number)")
+    request: Request,
+    mag_limit: float = Query(DEFAULT_MAG_LIMIT, ge=MIN_MAG_LIMIT, le=MAX_MAG_LIMIT, description="Magnitude limit (brighter = lower number)"),
+    format: Optional[str] = FORMAT_QUERY
 ):
     """
     Get full-sky catalog of bright stars from LOCAL DATABASE
     This is the base layer for planetarium view - loads once at startup
     
-    Default mag_limit=7.0 returns ~20,000 stars from local Gaia catalog
+    Default mag_limit=7.0 returns ~20,000 stars from local Gaia catalog.
+    mag_limit is rounded up to its bucket (BRIGHT_CATALOG_MAG_STEP), reported
+    as magnitude_limit / X-Magnitude-Limit. JSON and binary bodies are
+    serialized and compressed once per bucket and sent with an ETag, so
+    revalidation (If-None-Match) returns 304.
     
     Example: /api/stars/bright-catalog?mag_limit=7.0
     """
@@ -106,40 +277,31 @@ async def get_bright_catalog(
         import time
         start_time = time.time()
         
-        # Cache key for bright catalog
-        cache_key = f"stars:bright_catalog:{mag_limit}"
+        response_format = negotiate_format(request, format)
         
-        cached_result = await cache_service.get(cache_key)
-        if cached_result:
-            logger.info(f"Returning cached bright catalog ({len(cached_result)} stars, mag<{mag_limit})")
-            return BrightCatalogResponse(
-                count=len(cached_result),
-                stars=cached_result,
-                magnitude_limit=mag_limit,
-                cached=True,
-                query_time_ms=0
-            )
+        if response_format != "ndjson":
+            entry, cached = await bright_catalog_responses.get(mag_limit, response_format)
+            headers = {
+                "X-Query-Time-Ms": f"{(time.time() - start_time) * 1000:.2f}",
+                "X-Cached": "true" if cached else "false"
+            }
+            return entry.respond(request, headers)
         
         # Query all bright stars from LOCAL CATALOG
-        logger.info(f"Querying local catalog for bright stars (mag < {mag_limit})...")
-        
-        # Use local catalog service (no network calls!)
-        stars = await local_catalog_service.query_all_bright_stars_async(mag_limit=mag_limit)
+        # The service keeps one magnitude-sorted buffer and returns a prefix of it,
+        # so every mag_limit shares the same star records (no per-limit cache copies).
+        # A burst of viewers loading at once shares a single query.
+        bucket = mag_limit_bucket(mag_limit)
+        stars = await single_flight.do(
+            f"bright:{bucket}",
+            lambda: local_catalog_service.query_all_bright_stars_async(mag_limit=bucket)
+        )
         
-        # Cache permanently (bright stars don't change)
-        await cache_service.set(cache_key, stars)
+        logger.success(f"Bright catalog query returned {len(stars)} stars in {(time.time() - start_time) * 1000:.2f}ms (mag<{bucket})")
         
-        query_time = (time.time() - start_time) * 1000
-        
-        logger.success(f"Bright catalog query returned {len(stars)} stars in {query_time:.2f}ms (mag<{mag_limit})")
-        
-        return BrightCatalogResponse(
-            count=len(stars),
-            stars=stars,
-            magnitude_limit=mag_limit,
-            cached=False,
-            query_time_ms=query_time
-        )
+        response = ndjson_response(list_batches(stars), "local")
+        response.headers["X-Magnitude-Limit"] = repr(bucket)
+        return response
         
     except Exception as e:
         logger.error(f"Bright catalog query failed: {e}")
@@ -153,6 +315,7 @@ class ConeQueryParams(BaseModel):
     radius: float = Field(..., gt=0, le=10, description="Search radius in degrees")
     max_stars: int = Field(10000, ge=1, le=100000, description="Maximum stars to return")
     min_magnitude: float = Field(20.0, ge=0, le=25, description="Faintest magnitude")
+    budget: Optional[int] = Field(None, ge=1, le=100000, description=BUDGET_DESCRIPTION)
 
 
 class FrustumQueryParams(BaseModel):
@@ -166,10 +329,15 @@ class FrustumQueryParams(BaseModel):
     fov: float = Field(50.0, ge=1, le=120, description="Field of view in degrees")
     max_distance: float = Field(1000.0, ge=1, description="Max query distance (parsecs)")
     max_stars: int = Field(50000, ge=1, le=100000, description="Maximum stars")
+    budget: Optional[int] = Field(None, ge=1, le=100000, description=BUDGET_DESCRIPTION)
 
 
 @router.post("/cone", response_model=StarResponse)
-async def query_cone(params: ConeQueryParams):
+async def query_cone(
+    params: ConeQueryParams,
+    request: Request,
+    format: Optional[str] = FORMAT_QUERY
+):
     """
     Query stars in a cone around specified sky coordinates
     
@@ -183,59 +351,58 @@ async def query_cone(params: ConeQueryParams):
         "min_magnitude": 18.0
     }
     ```
+    Add `"budget": 5000` to thin the result to the matching level of detail.
     """
     try:
         import time
         start_time = time.time()
         
-        # Check cache
-        cache_key = {
-            "type": "cone",
-            "ra": round(params.ra, 4),
-            "dec": round(params.dec, 4),
-            "radius": round(params.radius, 4),
-            "max_stars": params.max_stars,
-            "min_mag": params.min_magnitude
-        }
-        
-        cached_result = await cache_service.get(cache_key)
-        if cached_result:
-            return StarResponse(
-                count=len(cached_result),
-                stars=cached_result,
-                cached=True
-            )
+        response_format = negotiate_format(request, format)
+        lod_level = choose_lod_level(params.budget, params.radius)
         
-        # Query Gaia
-        stars = await gaia_service.query_cone_async(
+        # Assemble from cached HEALPix tiles, querying Gaia only for missing ones
+        stars, cached = await cancel_on_disconnect(request, gaia_tile_cache.query_cone(
             ra=params.ra,
             dec=params.dec,
             radius_deg=params.radius,
             max_stars=params.max_stars,
-            min_magnitude=params.min_magnitude
-        )
-        
-        # Cache result
-        await cache_service.set(cache_key, stars)
+            mag_limit=params.min_magnitude,
+            lod_level=lod_level
+        ))
         
         query_time = (time.time() - start_time) * 1000
         
-        logger.info(f"Cone query returned {len(stars)} stars in {query_time:.2f}ms")
+        logger.info(f"Cone query returned {len(stars)} stars in {query_time:.2f}ms (tiles cached: {cached})")
         
-        return StarResponse(
+        if response_format == "bin":
+            with metrics.stage("serialization", "remote"):
+                body = pack_star_records(stars)
+            return packed_response(body, query_time, cached=cached, lod_level=lod_level)
+        if response_format == "ndjson":
+            return ndjson_response(list_batches(stars), "remote", cached=cached, lod_level=lod_level)
+        
+        return json_response(StarResponse(
             count=len(stars),
             stars=stars,
-            cached=False,
-            query_time_ms=query_time
-        )
-        
+            cached=cached,
+            query_time_ms=query_time,
+            lod_level=lod_level
+        ), "remote")
+        
+    except ClientDisconnected:
+        logger.info("Cone query cancelled: client disconnected")
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
     except Exception as e:
         logger.error(f"Cone query failed: {e}")
         raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
 
 
 @router.post("/frustum", response_model=StarResponse)
-async def query_frustum(params: FrustumQueryParams):
+async def query_frustum(
+    params: FrustumQueryParams,
+    request: Request,
+    format: Optional[str] = FORMAT_QUERY
+):
     """
     Query stars visible in camera frustum (optimized for viewer)
     
@@ -258,55 +425,47 @@ async def query_frustum(params: FrustumQueryParams):
         import time
         start_time = time.time()
         
-        # Check cache
-        cache_key = {
-            "type": "frustum",
-            "cam": [
-                round(params.camera_x, 2),
-                round(params.camera_y, 2),
-                round(params.camera_z, 2)
-            ],
-            "dir": [
-                round(params.direction_x, 3),
-                round(params.direction_y, 3),
-                round(params.direction_z, 3)
-            ],
-            "fov": round(params.fov, 1),
-            "dist": round(params.max_distance, 1),
-            "max": params.max_stars
-        }
-        
-        cached_result = await cache_service.get(cache_key)
-        if cached_result:
-            return StarResponse(
-                count=len(cached_result),
-                stars=cached_result,
-                cached=True
-            )
+        response_format = negotiate_format(request, format)
         
-        # Query Gaia based on view frustum
-        stars = await gaia_service.query_frustum_async(
-            camera_position=(params.camera_x, params.camera_y, params.camera_z),
+        # The frustum is covered by a cone around the view direction, assembled
+        # from cached HEALPix tiles (Gaia is queried only for missing ones)
+        ra, dec, radius_deg, mag_limit = gaia_service.frustum_to_cone(
             camera_direction=(params.direction_x, params.direction_y, params.direction_z),
             fov_deg=params.fov,
-            max_distance=params.max_distance,
-            max_stars=params.max_stars
+            max_distance=params.max_distance
         )
-        
-        # Cache result
-        await cache_service.set(cache_key, stars)
+        lod_level = choose_lod_level(params.budget, radius_deg)
+        stars, cached = await cancel_on_disconnect(request, gaia_tile_cache.query_cone(
+            ra=ra,
+            dec=dec,
+            radius_deg=radius_deg,
+            max_stars=params.max_stars,
+            mag_limit=mag_limit,
+            lod_level=lod_level
+        ))
         
         query_time = (time.time() - start_time) * 1000
         
-        logger.info(f"Frustum query returned {len(stars)} stars in {query_time:.2f}ms")
+        logger.info(f"Frustum query returned {len(stars)} stars in {query_time:.2f}ms (tiles cached: {cached})")
+        
+        if response_format == "bin":
+            with metrics.stage("serialization", "remote"):
+                body = pack_star_records(stars)
+            return packed_response(body, query_time, cached=cached, lod_level=lod_level)
+        if response_format == "ndjson":
+            return ndjson_response(list_batches(stars), "remote", cached=cached, lod_level=lod_level)
         
-        return StarResponse(
+        return json_response(StarResponse(
             count=len(stars),
             stars=stars,
-            cached=False,
-            query_time_ms=query_time
-        )
-        
+            cached=cached,
+            query_time_ms=query_time,
+            lod_level=lod_level
+        ), "remote")
+        
+    except ClientDisconnected:
+        logger.info("Frustum query cancelled: client disconnected")
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
     except Exception as e:
         logger.error(f"Frustum query failed: {e}")
         raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
@@ -314,8 +473,11 @@ async def query_frustum(params: FrustumQueryParams):
 
 @router.get("/galactic-center")
 async def query_galactic_center(
+    request: Request,
     radius: float = Query(5.0, ge=0.1, le=20.0, description="Radius in degrees"),
-    max_stars: int = Query(50000, ge=100, le=100000)
+    max_stars: int = Query(50000, ge=100, le=100000),
+    budget: Optional[int] = Query(None, ge=1, le=100000, description=BUDGET_DESCRIPTION),
+    format: Optional[str] = FORMAT_QUERY
 ):
     """
     Quick query for Galactic Center region (Sagittarius A*)
@@ -327,5 +489,6 @@ async def query_galactic_center(
         dec=-29.0,
         radius=radius,
         max_stars=max_stars,
-        min_magnitude=18.0
-    ))
+        min_magnitude=18.0,
+        budget=budget
+    ), request=request, format=format)
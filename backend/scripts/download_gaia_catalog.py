@@ -3,36 +3,62 @@
 Download Gaia DR3 bright star catalog to local SQLite database.
 
 Cross-platform script for Windows and Linux.
-Supports resumable downloads with progress tracking.
+The sky is split into HEALPix shards (Gaia source_id ranges) fetched in
+parallel; finished shards are checkpointed in <output>.download.db, so a
+rerun only fetches the missing ones.
+With --incremental an existing catalog is extended (or trimmed) in place:
+only stars between its recorded magnitude limit and the new one are
+downloaded and merged.
+Also writes a memory-mappable binary copy (same name, .bin) for the API's
+in-memory catalog engine.
 
 Usage:
   python download_gaia_catalog.py --mag-limit 7.0 --output ../data/gaia_catalog.db
   python download_gaia_catalog.py --mag-limit 6.5 --output /path/to/gaia_catalog.db
+  python download_gaia_catalog.py --mag-limit 12 --shard-order 3 --workers 8 --output ../data/gaia_catalog.db
+  python download_gaia_catalog.py --mag-limit 8.0 --incremental --output ../data/gaia_catalog.db
 
 Requirements:
-  pip install astroquery astropy pandas
+  pip install httpx pandas numpy
 """
 
 import sys
-import os
 import sqlite3
 import argparse
-import json
+import queue
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, List, Dict
+from typing import Callable, Optional, List, Dict, Iterable, Iterator, Sequence, Tuple
 from datetime import datetime
 import logging
 
 try:
-    from astroquery.gaia import Gaia
-    from astropy import units as u
+    import httpx
     import pandas as pd
     import numpy as np
 except ImportError as e:
-    print(f"❌ Error: Missing required package. Run: pip install astroquery astropy pandas numpy")
+    print("❌ Error: Missing required package. Run: pip install httpx pandas numpy")
     print(f"   Details: {e}")
     sys.exit(1)
 
+# Shared catalog helpers live in backend/catalog
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from catalog.healpix import HEALPIX_ORDER, ang2pix_nest, source_id_range
+from catalog.star_records import gaia_columns
+from catalog.catalog_db import (
+    STAR_ROW_COLUMNS, build_catalog_db, column_rows, read_catalog_meta, update_catalog_db
+)
+from catalog.binary_format import export_binary_catalog
+from catalog.colors import COLOR_MODES
+from catalog.tap_stream import DEFAULT_CHUNK_ROWS, iter_csv_chunks
+
+GAIA_TAP_URL = "https://gea.esac.esa.int/tap-server/tap"
+
+# Longest wait for one TAP job to finish before it is aborted
+TAP_JOB_MAX_WAIT_SECONDS = 3600.0
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -48,33 +74,114 @@ logger = logging.getLogger(__name__)
 class GaiaCatalogDownloader:
     """Download and process Gaia DR3 bright star catalog"""
     
-    def __init__(self, output_path: str, mag_limit: float = 7.0):
+    def __init__(
+        self,
+        output_path: str,
+        mag_limit: float = 7.0,
+        color_mode: str = "bp_rp",
+        tap_url: str = GAIA_TAP_URL,
+        chunk_rows: int = DEFAULT_CHUNK_ROWS,
+        shard_order: int = 1,
+        workers: int = 4,
+        executor: Optional[Executor] = None,
+        tap_source: Optional[Callable[[str], Iterable[bytes]]] = None,
+        job_timeout: float = TAP_JOB_MAX_WAIT_SECONDS
+    ):
         """
         Initialize downloader
         
         Args:
             output_path: Path to save SQLite database
             mag_limit: Magnitude limit (lower = brighter stars)
+            color_mode: Star color mapping baked into the catalog (bp_rp or temperature)
+            tap_url: TAP service root
+            chunk_rows: Rows parsed, converted and inserted at a time
+            shard_order: HEALPix order of the shards (12 * 4**order shards)
+            workers: Shards fetched concurrently (default thread pool)
+            executor: Thread pool running shard fetches instead of the default one
+                      (fetches hand their rows to this thread through a queue)
+            tap_source: ADQL query -> CSV byte stream (default: an async TAP job
+                        against tap_url); replace with a local fake for tests
+            job_timeout: Seconds a TAP job may take to finish before it is aborted
         """
         self.output_path = Path(output_path).resolve()
         self.mag_limit = mag_limit
-        self.db_conn = None
+        self.color_mode = color_mode
+        self.tap_url = tap_url.rstrip("/")
+        self.chunk_rows = chunk_rows
+        self.shard_order = shard_order
+        self.workers = workers
+        self.executor = executor
+        self.tap_source = tap_source or self.stream_tap_job
+        self.job_timeout = job_timeout
+        # Bright edge of the downloaded range (set for incremental refreshes)
+        self.mag_min: Optional[float] = None
+        # Checkpoint: downloaded rows (tagged with their shard) plus the manifest of finished shards
+        self.work_path = self.output_path.with_suffix(".download.db")
         
         # Ensure output directory exists
         self.output_path.parent.mkdir(parents=True, exist_ok=True)
-        logger.info(f"🌟 Gaia DR3 Catalog Downloader")
+        logger.info("🌟 Gaia DR3 Catalog Downloader")
         logger.info(f"   Output: {self.output_path}")
         logger.info(f"   Magnitude limit: < {mag_limit}")
-        
-        # Setup Gaia
-        Gaia.MAIN_GAIA_TABLE = "gaiadr3.gaia_source"
-        Gaia.ROW_LIMIT = -1  # No limit (will paginate)
+        logger.info(f"   Shards: {12 * 4 ** shard_order} (HEALPix order {shard_order})")
     
-    def query_bright_stars(self) -> pd.DataFrame:
-        """Query Gaia DR3 for bright stars"""
-        logger.info(f"📡 Querying Gaia DR3 for stars with mag < {self.mag_limit}...")
+    def stream_tap_job(self, query: str) -> Iterator[bytes]:
+        """
+        Run an asynchronous TAP (UWS) job and stream its CSV result
         
-        query = f"""
+        Long queries would time out on the sync endpoint; the job runs
+        server-side and its result is downloaded as a byte stream. A job
+        still running after job_timeout seconds is aborted (TimeoutError),
+        and every job is deleted from the server once its stream ends.
+        """
+        with httpx.Client(timeout=httpx.Timeout(60.0)) as client:
+            response = client.post(f"{self.tap_url}/async", data={
+                "REQUEST": "doQuery",
+                "LANG": "ADQL",
+                "FORMAT": "csv",
+                "PHASE": "RUN",
+                "QUERY": query
+            })
+            if response.status_code != 303:
+                response.raise_for_status()
+            job_url = response.headers["location"]
+            logger.info(f"   TAP job: {job_url}")
+            
+            try:
+                deadline = time.monotonic() + self.job_timeout
+                delay = 1.0
+                while True:
+                    phase = client.get(f"{job_url}/phase").text.strip()
+                    if phase == "COMPLETED":
+                        break
+                    if phase in ("ERROR", "ABORTED"):
+                        error = client.get(f"{job_url}/error", follow_redirects=True).text
+                        raise RuntimeError(f"TAP job {phase}: {error.strip()[:500]}")
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        try:
+                            client.post(f"{job_url}/phase", data={"PHASE": "ABORT"})
+                        except httpx.HTTPError as e:
+                            logger.warning(f"   Could not abort TAP job {job_url}: {e}")
+                        raise TimeoutError(f"TAP job still {phase} after {self.job_timeout:.0f}s: {job_url}")
+                    time.sleep(min(delay, remaining))
+                    delay = min(delay * 1.5, 10.0)
+                
+                with client.stream("GET", f"{job_url}/results/result", follow_redirects=True) as result:
+                    result.raise_for_status()
+                    yield from result.iter_bytes()
+            finally:
+                # Jobs and their results otherwise stay on the server until it expires them
+                try:
+                    client.delete(job_url)
+                except httpx.HTTPError as e:
+                    logger.warning(f"   Could not delete TAP job {job_url}: {e}")
+    
+    def shard_query(self, pixel: int) -> str:
+        """ADQL for the stars of one shard (a contiguous Gaia source_id range)"""
+        start, end = source_id_range(self.shard_order, pixel)
+        return f"""
         SELECT
             source_id,
             ra, dec,
@@ -87,218 +194,277 @@ class GaiaCatalogDownloader:
             radial_velocity,
             teff_gspphot AS temperature
         FROM gaiadr3.gaia_source
-        WHERE phot_g_mean_mag < {self.mag_limit}
-        ORDER BY phot_g_mean_mag ASC
+        WHERE source_id >= {start} AND source_id < {end}
+        AND phot_g_mean_mag < {self.mag_limit}
+        {f"AND phot_g_mean_mag >= {self.mag_min}" if self.mag_min is not None else ""}
         """
-        
-        try:
-            logger.info("   Starting async TAP query (this may take 1-5 minutes for mag < 7.0)...")
-            job = Gaia.launch_job_async(query, dump_to_file=False, verbose=False)
-            result_table = job.get_results()
-            df = result_table.to_pandas()
-            df.columns = [str(c).lower() for c in df.columns]
-            
-            logger.info(f"✅ Retrieved {len(df)} stars from Gaia DR3")
-            return df
-            
-        except Exception as e:
-            logger.error(f"❌ Query failed: {e}")
-            raise
     
-    @staticmethod
-    def _parallax_to_distance(parallax_mas: Optional[float]) -> float:
-        """Convert parallax (mas) to distance (parsecs)"""
-        if parallax_mas is None or parallax_mas <= 0:
-            return 1000.0
-        distance = 1000.0 / parallax_mas
-        return max(0.1, min(distance, 100000.0))
+    def shard_batches(self, pixel: int) -> Iterator[List[tuple]]:
+        """Download one shard as batches of STAR_ROW_COLUMNS tuples, chunk_rows at a time"""
+        for chunk in iter_csv_chunks(self.tap_source(self.shard_query(pixel)), self.chunk_rows):
+            yield list(column_rows(self.process_dataframe(pd.DataFrame(chunk, copy=False))))
     
-    @staticmethod
-    def _equatorial_to_cartesian(ra_deg: float, dec_deg: float, distance_pc: float):
-        """Convert RA/Dec/distance to Cartesian X/Y/Z"""
-        ra_rad = np.radians(ra_deg)
-        dec_rad = np.radians(dec_deg)
-        
-        x = distance_pc * np.cos(dec_rad) * np.cos(ra_rad)
-        y = distance_pc * np.cos(dec_rad) * np.sin(ra_rad)
-        z = distance_pc * np.sin(dec_rad)
-        
-        return (float(x), float(y), float(z))
-    
-    @staticmethod
-    def _bp_rp_to_rgb(bp_rp: float):
-        """Convert BP-RP color index to RGB"""
-        normalized = (bp_rp + 0.5) / 4.5
-        normalized = max(0.0, min(1.0, normalized))
+    def fetch_shard(self, pixel: int, results: queue.Queue, stop: threading.Event):
+        """
+        Hand one shard's batches to download_shards() as they arrive (runs on the executor)
         
-        if normalized < 0.2:
-            r = 0.6 + normalized * 2.0
-            g = 0.7 + normalized * 1.5
-            b = 1.0
-        elif normalized < 0.5:
-            r = 1.0
-            g = 1.0
-            b = 1.0 - (normalized - 0.2) * 2.0
-        elif normalized < 0.7:
-            r = 1.0
-            g = 1.0 - (normalized - 0.5) * 1.5
-            b = 0.4
-        else:
-            r = 1.0
-            g = 0.6 - (normalized - 0.7) * 1.0
-            b = 0.3
+        Puts ("rows", pixel, rows) per batch, then ("done", pixel, count) or
+        ("failed", pixel, error). The queue is bounded, so a fetch waits while
+        the writer catches up; stop ends it early.
+        """
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
         
-        return (float(r), float(g), float(b))
+        count = 0
+        try:
+            for rows in self.shard_batches(pixel):
+                if not put(("rows", pixel, rows)):
+                    return
+                count += len(rows)
+        except Exception as e:
+            put(("failed", pixel, e))
+            return
+        put(("done", pixel, count))
     
-    def process_dataframe(self, df: pd.DataFrame) -> List[Dict]:
-        """Process Gaia dataframe to star records"""
-        logger.info(f"🔄 Processing {len(df)} stars...")
+    def open_checkpoint(self, restart: bool = False) -> sqlite3.Connection:
+        """
+        Open the checkpoint database, discarding it if it was made with other settings
         
-        stars = []
-        for idx, row in df.iterrows():
+        Rows are inserted as they arrive and a shard's manifest entry is
+        committed with its last rows. Rows of shards an interrupted run did
+        not finish are deleted here, so they are fetched again in full.
+        """
+        params = {
+            'mag_min': repr(self.mag_min),
+            'mag_limit': repr(self.mag_limit),
+            'shard_order': str(self.shard_order),
+            'color_mode': self.color_mode,
+            'layout': '2'
+        }
+        if self.work_path.exists():
+            conn = sqlite3.connect(str(self.work_path))
             try:
-                # Extract safe values
-                ra = float(row['ra'])
-                dec = float(row['dec'])
-                
-                parallax_val = row.get('parallax')
-                parallax_val = float(parallax_val) if pd.notna(parallax_val) else None
-                
-                # Distance calculation
-                if parallax_val and parallax_val > 0:
-                    distance_pc = self._parallax_to_distance(parallax_val)
-                else:
-                    mag = float(row['phot_g_mean_mag'])
-                    distance_pc = 10 ** ((mag - 5) / 5 + 1)
-                
-                # Cartesian coordinates
-                x, y, z = self._equatorial_to_cartesian(ra, dec, distance_pc)
-                
-                # Color
-                bp_rp_val = row.get('bp_rp')
-                bp_rp_val = float(bp_rp_val) if pd.notna(bp_rp_val) else 0.0
-                r, g, b = self._bp_rp_to_rgb(bp_rp_val)
-                
-                # Safe property extraction
-                pmra_val = float(row.get('pmra', 0.0)) if pd.notna(row.get('pmra')) else 0.0
-                pmdec_val = float(row.get('pmdec', 0.0)) if pd.notna(row.get('pmdec')) else 0.0
-                rv_val = float(row.get('radial_velocity')) if pd.notna(row.get('radial_velocity')) else None
-                temp_val = float(row.get('temperature')) if pd.notna(row.get('temperature')) else None
-                
-                star = {
-                    'source_id': str(int(row['source_id'])),
-                    'ra': ra,
-                    'dec': dec,
-                    'x': x,
-                    'y': y,
-                    'z': z,
-                    'parallax': float(parallax_val) if parallax_val else None,
-                    'distance_pc': distance_pc,
-                    'magnitude': float(row['phot_g_mean_mag']),
-                    'bp_rp': bp_rp_val,
-                    'r': r,
-                    'g': g,
-                    'b': b,
-                    'pmra': pmra_val,
-                    'pmdec': pmdec_val,
-                    'radial_velocity': rv_val,
-                    'temperature': temp_val,
-                }
-                stars.append(star)
-                
-                if (idx + 1) % 1000 == 0:
-                    print(f"   Processed {idx + 1}/{len(df)} stars...", end='\r')
-                    
-            except Exception as e:
-                logger.warning(f"   Skipping row {idx}: {e}")
-                continue
+                saved = dict(conn.execute("SELECT key, value FROM download_meta").fetchall())
+            except sqlite3.Error:
+                saved = {}
+            conn.close()
+            if restart or saved != params:
+                logger.info("   Discarding checkpoint from a different download")
+                self.work_path.unlink()
         
-        print(f"   Processed {len(df)} stars. ✅")
-        return stars
+        conn = sqlite3.connect(str(self.work_path))
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS stars (
+            source_id TEXT PRIMARY KEY,
+            {", ".join(f"{name} {'INTEGER' if name in ('rgb', 'hpx') else 'REAL'}" for name in STAR_ROW_COLUMNS[1:])},
+            shard INTEGER NOT NULL
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS shards (
+            pixel INTEGER PRIMARY KEY,
+            rows INTEGER NOT NULL,
+            completed_at TEXT NOT NULL
+        )
+        """)
+        conn.execute("CREATE TABLE IF NOT EXISTS download_meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.executemany("INSERT OR REPLACE INTO download_meta (key, value) VALUES (?, ?)", params.items())
+        conn.execute("DELETE FROM stars WHERE shard NOT IN (SELECT pixel FROM shards)")
+        conn.commit()
+        return conn
     
-    def create_database(self, stars: List[Dict]):
-        """Create and populate SQLite database"""
-        logger.info(f"💾 Creating SQLite database: {self.output_path}")
-        
-        # Remove existing if present
-        if self.output_path.exists():
-            logger.info(f"   Overwriting existing database")
-            self.output_path.unlink()
-        
-        # Create connection
-        self.db_conn = sqlite3.connect(str(self.output_path))
-        cursor = self.db_conn.cursor()
+    def download_shards(self, restart: bool = False) -> bool:
+        """Fetch every shard not yet in the checkpoint; True once all are done"""
+        conn = self.open_checkpoint(restart)
+        total = 12 * 4 ** self.shard_order
+        done = {row[0] for row in conn.execute("SELECT pixel FROM shards")}
+        missing = [pixel for pixel in range(total) if pixel not in done]
+        if done:
+            logger.info(f"   Resuming: {len(done)}/{total} shards already downloaded")
         
-        # Create table
-        cursor.execute("""
-        CREATE TABLE stars (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            source_id TEXT UNIQUE NOT NULL,
-            ra REAL NOT NULL,
-            dec REAL NOT NULL,
-            x REAL NOT NULL,
-            y REAL NOT NULL,
-            z REAL NOT NULL,
-            parallax REAL,
-            distance_pc REAL,
-            magnitude REAL NOT NULL,
-            bp_rp REAL,
-            r REAL,
-            g REAL,
-            b REAL,
-            pmra REAL,
-            pmdec REAL,
-            radial_velocity REAL,
-            temperature REAL,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        insert = (
+            f"INSERT OR REPLACE INTO stars ({', '.join(STAR_ROW_COLUMNS)}, shard) "
+            f"VALUES ({', '.join('?' * (len(STAR_ROW_COLUMNS) + 1))})"
         )
-        """)
+        executor = self.executor or ThreadPoolExecutor(max_workers=self.workers)
+        # A few batches per fetch in flight: memory stays bounded by chunk_rows
+        results: "queue.Queue[Tuple[str, int, object]]" = queue.Queue(maxsize=2 * max(self.workers, 1))
+        stop = threading.Event()
+        failed = 0
+        pending = len(missing)
+        try:
+            for pixel in missing:
+                executor.submit(self.fetch_shard, pixel, results, stop)
+            while pending:
+                kind, pixel, value = results.get()
+                if kind == "rows":
+                    conn.executemany(insert, (row + (pixel,) for row in value))
+                    continue
+                pending -= 1
+                if kind == "failed":
+                    failed += 1
+                    logger.error(f"❌ Shard {pixel} failed: {value}")
+                    continue
+                conn.execute(
+                    "INSERT INTO shards (pixel, rows, completed_at) VALUES (?, ?, ?)",
+                    (pixel, value, datetime.now().isoformat())
+                )
+                conn.commit()
+                done.add(pixel)
+                logger.info(f"   Shard {pixel}: {value} stars ({len(done)}/{total} shards)")
+        finally:
+            stop.set()
+            if self.executor is None:
+                executor.shutdown(wait=True, cancel_futures=True)
+            # Uncommitted rows of unfinished shards are rolled back
+            conn.close()
         
-        # Create indexes for fast queries
-        cursor.execute("CREATE INDEX idx_magnitude ON stars(magnitude)")
-        cursor.execute("CREATE INDEX idx_distance ON stars(distance_pc)")
-        cursor.execute("CREATE INDEX idx_position ON stars(x, y, z)")
+        if failed:
+            logger.error(f"❌ {failed} shards failed; rerun to fetch only the missing ones")
+            return False
+        return True
+    
+    def checkpoint_batches(self) -> Iterator[List[tuple]]:
+        """Downloaded star rows (STAR_ROW_COLUMNS tuples) in magnitude order, chunk_rows at a time"""
+        conn = sqlite3.connect(str(self.work_path))
+        try:
+            cursor = conn.execute(
+                f"SELECT {', '.join(STAR_ROW_COLUMNS)} FROM stars ORDER BY magnitude ASC"
+            )
+            while True:
+                rows = cursor.fetchmany(self.chunk_rows)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+    
+    def process_dataframe(self, df: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """Process Gaia dataframe to catalog columns (STAR_ROW_COLUMNS, NaN = NULL)"""
+        # Unknown parallax -> magnitude-based distance; DB stores unknown BP-RP as 0
+        # and zero parallax as NULL
+        columns = gaia_columns(df, magnitude_distance=True, color_mode=self.color_mode)
+        columns['bp_rp'] = np.nan_to_num(columns['bp_rp'], nan=0.0)
+        columns['parallax'] = np.where(columns['parallax'] == 0, np.nan, columns['parallax'])
+        keep = np.array([source_id is not None for source_id in columns['source_id']], dtype=bool)
+        columns = {name: columns[name][keep] for name in STAR_ROW_COLUMNS if name != 'hpx'}
         
-        logger.info("   Inserting star records...")
+        # HEALPix pixel ids (nested) for cone searches
+        columns['hpx'] = ang2pix_nest(HEALPIX_ORDER, columns['ra'], columns['dec'])
+        return columns
+    
+    def create_database(self, batches: Iterable[Sequence[tuple]]):
+        """
+        Bulk-load the SQLite database from batches of STAR_ROW_COLUMNS tuples
         
-        # Batch insert
-        batch_size = 500
-        for i in range(0, len(stars), batch_size):
-            batch = stars[i:i+batch_size]
-            cursor.executemany("""
-            INSERT INTO stars (
-                source_id, ra, dec, x, y, z, parallax, distance_pc, magnitude,
-                bp_rp, r, g, b, pmra, pmdec, radial_velocity, temperature
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, [
-                (
-                    s['source_id'], s['ra'], s['dec'], s['x'], s['y'], s['z'],
-                    s['parallax'], s['distance_pc'], s['magnitude'],
-                    s['bp_rp'], s['r'], s['g'], s['b'], s['pmra'], s['pmdec'],
-                    s['radial_velocity'], s['temperature']
-                )
-                for s in batch
-            ])
-            
-            if (i + batch_size) % 5000 == 0:
-                print(f"   Inserted {min(i + batch_size, len(stars))}/{len(stars)} records...", end='\r')
+        Batches should come in magnitude order, which keeps bright-catalog
+        reads a rowid prefix. The database is built next to the output and
+        renamed over it when complete.
+        """
+        logger.info(f"💾 Creating SQLite database: {self.output_path}")
+        started = time.time()
+        count, in_order = build_catalog_db(self.output_path, batches, self.catalog_meta())
+        if not in_order:
+            logger.warning("   Rows were not in magnitude order; skipped the mag_offsets table")
+        logger.info(f"✅ Database created: {count} stars in {time.time() - started:.1f}s")
+    
+    def catalog_meta(self) -> Dict[str, str]:
+        """Build parameters recorded in the catalog (read back by --incremental)"""
+        return {
+            'mag_limit': repr(self.mag_limit),
+            'color_mode': self.color_mode,
+            'updated_at': datetime.now().isoformat()
+        }
+    
+    def existing_catalog(self) -> Optional[Dict[str, str]]:
+        """Build parameters of the catalog at output_path; None if it cannot be refreshed in place"""
+        if not self.output_path.exists():
+            return None
+        conn = sqlite3.connect(str(self.output_path))
+        try:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(stars)")}
+            if not set(STAR_ROW_COLUMNS) <= columns:
+                return None
+            meta = read_catalog_meta(conn)
+            if 'mag_limit' not in meta:
+                # Catalogs built before catalog_meta: the faintest star bounds the
+                # range (upserting by source_id absorbs the overlap)
+                faintest = conn.execute("SELECT MAX(magnitude) FROM stars").fetchone()[0]
+                if faintest is None:
+                    return None
+                meta = {'mag_limit': repr(faintest), 'color_mode': self.color_mode}
+            return meta
+        finally:
+            conn.close()
+    
+    def refresh(self, meta: Dict[str, str], restart: bool = False) -> bool:
+        """Bring an existing catalog to mag_limit by fetching and merging only the delta"""
+        if meta.get('color_mode', self.color_mode) != self.color_mode:
+            logger.error(f"❌ Catalog colors are {meta['color_mode']}; a new --color-mode needs a full download")
+            return False
+        current = float(meta['mag_limit'])
+        if current == self.mag_limit:
+            logger.info(f"✅ Catalog already holds stars with mag < {self.mag_limit}")
+            return True
         
-        self.db_conn.commit()
-        print(f"   Inserted {len(stars)} star records. ✅")
+        batches: Iterable[Sequence[tuple]] = []
+        if self.mag_limit > current:
+            self.mag_min = current
+            logger.info(f"📡 Querying Gaia DR3 for stars with {current} <= mag < {self.mag_limit}...")
+            if not self.download_shards(restart):
+                return False
+            batches = self.checkpoint_batches()
         
-        # Verify
-        cursor.execute("SELECT COUNT(*) FROM stars")
-        count = cursor.fetchone()[0]
-        logger.info(f"✅ Database created: {count} stars")
+        logger.info(f"💾 Updating SQLite database: {self.output_path}")
+        started = time.time()
+        result = update_catalog_db(self.output_path, batches, self.mag_limit, self.catalog_meta())
+        logger.info(
+            f"✅ Database updated in {time.time() - started:.1f}s: {result['inserted']} added, "
+            f"{result['updated']} updated, {result['removed']} removed"
+        )
+        if not result['in_order']:
+            logger.warning("   Updated stars broke magnitude order; dropped mag_offsets (run a full download to restore it)")
+        self.create_binary_catalog()
+        if self.work_path.exists():
+            self.work_path.unlink()
+        return True
+    
+    def create_binary_catalog(self):
+        """
+        Write the memory-mappable binary copy of the catalog next to the database
         
-        self.db_conn.close()
+        Carries precomputed LOD levels and records the catalog content hash
+        in catalog_meta (see export_binary_catalog).
+        """
+        binary_path = self.output_path.with_suffix(".bin")
+        logger.info(f"📦 Writing binary catalog: {binary_path}")
+        count = export_binary_catalog(self.output_path, binary_path, self.color_mode)
+        logger.info(f"✅ Binary catalog written: {count} stars, {binary_path.stat().st_size / 1e6:.1f} MB")
     
-    def download(self):
-        """Execute full download and database creation"""
+    def download(self, restart: bool = False, incremental: bool = False):
+        """Execute full download and database creation (or an in-place refresh)"""
         try:
-            df = self.query_bright_stars()
-            stars = self.process_dataframe(df)
-            self.create_database(stars)
+            if incremental:
+                meta = self.existing_catalog()
+                if meta is not None:
+                    return self.refresh(meta, restart)
+                logger.info("   No catalog to refresh in place; running a full download")
+            
+            logger.info(f"📡 Querying Gaia DR3 for stars with mag < {self.mag_limit}...")
+            if not self.download_shards(restart):
+                return False
+            # The existing database is only replaced once every shard is in
+            self.create_database(self.checkpoint_batches())
+            self.create_binary_catalog()
+            self.work_path.unlink()
             logger.info(f"✅ Complete! Database ready at: {self.output_path}")
             return True
         except Exception as e:
@@ -320,6 +486,9 @@ Examples:
   
   Faster download (brighter stars only):
     python download_gaia_catalog.py --mag-limit 6.5 --output data/gaia_catalog.db
+  
+  Grow an existing catalog from mag 7 to 8 (fetches only 7 <= mag < 8):
+    python download_gaia_catalog.py --mag-limit 8.0 --incremental --output data/gaia_catalog.db
         """
     )
     parser.add_argument(
@@ -328,6 +497,52 @@ Examples:
         default=7.0,
         help="Magnitude limit (lower = brighter; default: 7.0 for ~20k stars)"
     )
+    parser.add_argument(
+        "--color-mode",
+        choices=COLOR_MODES,
+        default="bp_rp",
+        help="Star colors baked into the catalog: bp_rp ramp or blackbody from teff_gspphot (default: bp_rp)"
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=DEFAULT_CHUNK_ROWS,
+        help=f"Rows parsed and inserted at a time; bounds memory use (default: {DEFAULT_CHUNK_ROWS})"
+    )
+    parser.add_argument(
+        "--shard-order",
+        type=int,
+        default=1,
+        help="HEALPix order of the download shards: 12 * 4**order shards (default: 1 = 48; use 3+ for deep catalogs)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Shards downloaded in parallel (default: 4)"
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Ignore the checkpoint of an interrupted run and download everything again"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Extend or trim an existing catalog to --mag-limit, downloading only the missing magnitude range"
+    )
+    parser.add_argument(
+        "--job-timeout",
+        type=float,
+        default=TAP_JOB_MAX_WAIT_SECONDS,
+        help=f"Seconds a TAP job may run before it is aborted (default: {TAP_JOB_MAX_WAIT_SECONDS:.0f})"
+    )
+    parser.add_argument(
+        "--tap-url",
+        type=str,
+        default=GAIA_TAP_URL,
+        help="TAP service root (default: the ESA Gaia archive)"
+    )
     parser.add_argument(
         "--output",
         type=str,
@@ -337,8 +552,13 @@ Examples:
     
     args = parser.parse_args()
     
-    downloader = GaiaCatalogDownloader(args.output, args.mag_limit)
-    success = downloader.download()
+    downloader = GaiaCatalogDownloader(
+        args.output, args.mag_limit, args.color_mode,
+        tap_url=args.tap_url, chunk_rows=args.chunk_rows,
+        shard_order=args.shard_order, workers=args.workers,
+        job_timeout=args.job_timeout
+    )
+    success = downloader.download(restart=args.restart, incremental=args.incremental)
     
     sys.exit(0 if success else 1)
 
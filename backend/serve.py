@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Production launcher: WORKER_COUNT uvicorn worker processes
+
+The catalog is prepared once in this process before any worker starts
+(migrations of older databases, and the shared memory-mapped binary copy for
+CATALOG_ENGINE=memory), so workers only map it. Workers coordinate bright
+catalog warming through BRIGHT_CATALOG_SHARED_DIR and share the SQLite
+result cache, so each result is built by one of them. They exchange metric
+snapshots through METRICS_SHARED_DIR, so /metrics reports all of them.
+
+Usage:
+  python serve.py
+  python serve.py --workers 8 --port 5000
+"""
+import argparse
+import os
+import shutil
+
+import uvicorn
+from loguru import logger
+
+from config import settings
+from services.local_catalog_service import local_catalog_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Space Catalog API with several worker processes")
+    parser.add_argument("--host", default=settings.API_HOST, help=f"Bind address (default: {settings.API_HOST})")
+    parser.add_argument("--port", type=int, default=settings.API_PORT, help=f"Port (default: {settings.API_PORT})")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.WORKER_COUNT,
+        help=f"Worker processes (default: WORKER_COUNT = {settings.WORKER_COUNT})"
+    )
+    args = parser.parse_args()
+
+    local_catalog_service.prepare_shared_catalog()
+
+    # Workers inherit the environment: size their CPU pools for the whole set
+    os.environ["API_PROCESSES"] = str(max(args.workers, 1))
+
+    if args.workers > 1 and settings.METRICS_ENABLED and settings.METRICS_SHARED_DIR:
+        # Workers inherit the environment; start from no snapshots of an earlier run
+        shutil.rmtree(settings.METRICS_SHARED_DIR, ignore_errors=True)
+        os.environ["METRICS_MULTIPROCESS"] = "true"
+
+    logger.info(f"Starting {args.workers} API workers on {args.host}:{args.port}")
+    uvicorn.run(
+        "app:app",
+        host=args.host,
+        port=args.port,
+        workers=max(args.workers, 1),
+        log_level=settings.LOG_LEVEL.lower()
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+Precompressed bright catalog responses
+The bright catalog only changes when the catalog is rebuilt. mag_limit is
+rounded up to a bucket (a multiple of BRIGHT_CATALOG_MAG_STEP), so there is a
+small fixed set of bodies: each (bucket, format) body is serialized and
+compressed once, kept in a small LRU and served with an ETag derived from the
+catalog content hash. Repeat requests are answered from bytes (or with 304
+Not Modified) without touching the star records again, and arbitrary limits
+cannot make the service rebuild bodies.
+
+With several API workers (serve.py) the first worker to build a body writes
+it to BRIGHT_CATALOG_SHARED_DIR under a file lock; the others wait for it and
+load the bytes instead of rebuilding them.
+"""
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+import gzip
+import hashlib
+import json
+import math
+import os
+import shutil
+import time
+from pathlib import Path
+
+from fastapi import Request
+from fastapi.responses import Response
+from loguru import logger
+
+from config import settings
+from catalog.packed_format import PACKED_MEDIA_TYPE, packed_count
+from services.executors import executors
+from services.file_lock import acquire
+from services.local_catalog_service import local_catalog_service
+from services.metrics import metrics
+from services.single_flight import single_flight
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+
+# Content codings in order of preference (identity is always available)
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+# mag_limit range and default of /api/stars/bright-catalog (the viewer's limit)
+MIN_MAG_LIMIT = 1.0
+MAX_MAG_LIMIT = 10.0
+DEFAULT_MAG_LIMIT = 7.0
+
+# Bumped when the body layout changes, so bodies shared on disk are rebuilt
+BODY_VERSION = "2"
+
+
+def mag_limit_bucket(mag_limit: float, step: float = settings.BRIGHT_CATALOG_MAG_STEP) -> float:
+    """The bucket a mag_limit is served from: the next multiple of step at or above it"""
+    bucket = math.ceil(round(mag_limit / step, 6)) * step
+    return round(min(max(bucket, MIN_MAG_LIMIT), MAX_MAG_LIMIT), 6)
+
+
+def mag_limit_buckets(step: float = settings.BRIGHT_CATALOG_MAG_STEP) -> List[float]:
+    """Every bucket of the accepted mag_limit range, brightest first"""
+    return sorted({mag_limit_bucket(MIN_MAG_LIMIT + i * step, step)
+                   for i in range(int(round((MAX_MAG_LIMIT - MIN_MAG_LIMIT) / step)) + 1)})
+
+
+def prebuild_limits() -> List[float]:
+    """
+    Buckets to build at startup (BRIGHT_CATALOG_PREBUILD), the default one last
+
+    The LRU keeps the most recently built bodies, so the default bucket (what most
+    viewers request) is still in memory when more buckets are built than it holds.
+    """
+    if settings.BRIGHT_CATALOG_PREBUILD.strip().lower() == "all":
+        buckets = mag_limit_buckets()
+    else:
+        buckets = sorted({
+            mag_limit_bucket(float(limit))
+            for limit in settings.BRIGHT_CATALOG_PREBUILD.split(",") if limit.strip()
+        })
+    return sorted(buckets, key=lambda bucket: bucket == mag_limit_bucket(DEFAULT_MAG_LIMIT))
+
+
+def _compress(encoding: str, body: bytes) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=9)
+    # mtime=0 keeps the bytes (and their ETag) identical across restarts
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+
+def accepted_encoding(accept_encoding: str, available: Tuple[str, ...] = ENCODINGS) -> str:
+    """Preferred available coding allowed by an Accept-Encoding header ("identity" if none)"""
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    for encoding in available:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match check (weak comparison, as RFC 9110 specifies for it)"""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+class PrecompressedBody:
+    """One serialized response in every content coding, plus its validators"""
+
+    def __init__(
+        self,
+        body: bytes,
+        media_type: str,
+        etag: str,
+        headers: Dict[str, str],
+        compressed: Optional[Dict[str, bytes]] = None
+    ):
+        """compressed: already compressed bodies by coding (the rest are compressed here)"""
+        self.media_type = media_type
+        self.etag = etag
+        self.headers = headers
+        # Set when this process rendered the body (None: loaded from another worker's copy)
+        self.rendered_at: Optional[float] = None
+        self.bodies = {"identity": body}
+        for encoding in ENCODINGS:
+            if compressed and encoding in compressed:
+                self.bodies[encoding] = compressed[encoding]
+            else:
+                self.bodies[encoding] = _compress(encoding, body)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(body) for body in self.bodies.values())
+
+    def respond(self, request: Request, headers: Optional[Dict[str, str]] = None) -> Response:
+        """200 with the best encoding the client accepts, or 304 if its copy is current"""
+        encoding = accepted_encoding(request.headers.get("accept-encoding", ""))
+        # Each coding is a different representation, so it gets its own strong ETag
+        etag = self.etag if encoding == "identity" else f'{self.etag[:-1]}-{encoding}"'
+        common = {
+            "ETag": etag,
+            "Cache-Control": f"public, max-age={settings.BRIGHT_CATALOG_MAX_AGE_SECONDS}",
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=common)
+
+        if encoding != "identity":
+            common["Content-Encoding"] = encoding
+        return Response(
+            content=self.bodies[encoding],
+            media_type=self.media_type,
+            headers={**common, **self.headers, **(headers or {})}
+        )
+
+
+class BrightCatalogResponses:
+    """LRU of precompressed bright catalog bodies keyed by (mag_limit bucket, format)"""
+
+    def __init__(self, max_entries: int = 8):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[float, str], PrecompressedBody]" = OrderedDict()
+        self.hits = 0
+        self.builds = 0
+        # Bodies another worker built (BRIGHT_CATALOG_SHARED_DIR)
+        self.shared_loads = 0
+
+    def etag(self, bucket: float, response_format: str) -> str:
+        """Strong ETag for a body: catalog content hash, bucket and serialization settings"""
+        key = ":".join([
+            local_catalog_service.catalog_version(),
+            repr(float(bucket)),
+            response_format,
+            settings.STAR_COLOR_MODE,
+            settings.API_VERSION,
+            BODY_VERSION
+        ])
+        return f'"{hashlib.sha1(key.encode()).hexdigest()[:24]}"'
+
+    async def get(self, mag_limit: float, response_format: str) -> Tuple[PrecompressedBody, bool]:
+        """
+        Body of mag_limit's bucket in a format ("json" or "bin"), built on first use
+
+        Returns (body, cached): cached is False when this call rendered the body.
+        """
+        key = (mag_limit_bucket(mag_limit), response_format)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry, True
+
+        # Concurrent first requests share one build
+        start_time = time.time()
+        entry = await single_flight.do(
+            f"bright:precompressed:{response_format}:{key[0]}",
+            lambda: self._build(key[0], response_format)
+        )
+        if int(entry.headers.get("X-Star-Count", "0")) > 0:
+            # Empty results usually mean the catalog is missing; keep retrying those
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry, entry.rendered_at is None or entry.rendered_at < start_time
+
+    async def _build(self, mag_limit: float, response_format: str) -> PrecompressedBody:
+        """Load the body from the shared directory, or render it there under the workers' lock"""
+        etag = self.etag(mag_limit, response_format)
+        if not settings.BRIGHT_CATALOG_SHARED_DIR:
+            return await self._render(mag_limit, response_format, etag)
+        
+        directory = Path(settings.BRIGHT_CATALOG_SHARED_DIR) / local_catalog_service.catalog_version()
+        name = etag.strip('"')
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            lock = open(directory / f"{name}.lock", "wb")
+        except OSError as e:
+            logger.warning(f"Shared bright catalog directory unusable: {e}")
+            return await self._render(mag_limit, response_format, etag)
+        
+        try:
+            await acquire(lock)
+            entry = await executors.run_io(self._load_shared, directory, name, etag)
+            if entry is not None:
+                self.shared_loads += 1
+                logger.info(f"Bright catalog {response_format} body for mag<{mag_limit} loaded from {directory}")
+                return entry
+            entry = await self._render(mag_limit, response_format, etag)
+            if int(entry.headers["X-Star-Count"]) > 0:
+                await executors.run_io(self._save_shared, directory, name, entry)
+            return entry
+        finally:
+            # Closing the file releases the lock
+            lock.close()
+    
+    @staticmethod
+    def _load_shared(directory: Path, name: str, etag: str) -> Optional[PrecompressedBody]:
+        try:
+            # The manifest is written last, so its presence means the bodies are complete
+            manifest = json.loads((directory / f"{name}.json").read_text())
+            body = (directory / f"{name}.identity").read_bytes()
+            compressed = {
+                encoding: (directory / f"{name}.{encoding}").read_bytes()
+                for encoding in manifest["encodings"]
+            }
+        except (OSError, ValueError, KeyError):
+            return None
+        return PrecompressedBody(body, manifest["media_type"], etag, manifest["headers"], compressed)
+    
+    @staticmethod
+    def _save_shared(directory: Path, name: str, entry: PrecompressedBody):
+        try:
+            for encoding, body in entry.bodies.items():
+                tmp_path = directory / f"{name}.{encoding}.tmp"
+                tmp_path.write_bytes(body)
+                os.replace(tmp_path, directory / f"{name}.{encoding}")
+            manifest = {
+                "media_type": entry.media_type,
+                "headers": entry.headers,
+                "encodings": [encoding for encoding in entry.bodies if encoding != "identity"]
+            }
+            tmp_path = directory / f"{name}.json.tmp"
+            tmp_path.write_text(json.dumps(manifest))
+            os.replace(tmp_path, directory / f"{name}.json")
+        except OSError as e:
+            logger.warning(f"Could not share bright catalog body with other workers: {e}")
+            return
+        # Bodies of earlier catalogs are never served again
+        for stale in directory.parent.iterdir():
+            if stale.is_dir() and stale != directory:
+                shutil.rmtree(stale, ignore_errors=True)
+    
+    async def _render(self, mag_limit: float, response_format: str, etag: str) -> PrecompressedBody:
+        start_time = time.time()
+        if response_format == "bin":
+            body = await local_catalog_service.query_all_bright_stars_packed_async(mag_limit=mag_limit)
+            media_type = PACKED_MEDIA_TYPE
+            count = packed_count(body)
+        else:
+            stars = await local_catalog_service.query_all_bright_stars_async(mag_limit=mag_limit)
+            with metrics.stage("serialization", "local"):
+                body = await executors.run_io(self._serialize, stars, mag_limit)
+            media_type = "application/json"
+            count = len(stars)
+
+        # Compression is CPU work; keep it off the event loop
+        with metrics.stage("compression", "local"):
+            entry = await executors.run_io(
+                PrecompressedBody,
+                body, media_type, etag, {"X-Star-Count": str(count), "X-Magnitude-Limit": repr(mag_limit)}
+            )
+        entry.rendered_at = time.time()
+        self.builds += 1
+        logger.info(
+            f"Bright catalog {response_format} body built for mag<{mag_limit}: {count} stars, "
+            f"{len(body) / 1e6:.2f} MB -> {len(entry.bodies[ENCODINGS[0]]) / 1e6:.2f} MB {ENCODINGS[0]} "
+            f"in {(time.time() - start_time) * 1000:.0f}ms"
+        )
+        return entry
+
+    @staticmethod
+    def _serialize(stars: List[Dict], mag_limit: float) -> bytes:
+        """
+        BrightCatalogResponse JSON, encoded the way FastAPI's JSONResponse does
+
+        The per-request fields (cached, query_time_ms) are left out of the
+        shared body; they are sent as the X-Cached and X-Query-Time-Ms headers.
+        """
+        return json.dumps(
+            {
+                "count": len(stars),
+                "stars": stars,
+                "magnitude_limit": mag_limit
+            },
+            ensure_ascii=False,
+            allow_nan=False,
+            separators=(",", ":")
+        ).encode("utf-8")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'entries': len(self._entries),
+            'bytes': sum(entry.nbytes for entry in self._entries.values()),
+            'hits': self.hits,
+            'builds': self.builds,
+            'shared_loads': self.shared_loads
+        }
+
+
+# Global instance
+bright_catalog_responses = BrightCatalogResponses(max_entries=settings.BRIGHT_CATALOG_CACHE_ENTRIES)
@@ -2,27 +2,157 @@
 In-memory and SQLite caching service
 Caches Gaia query results to reduce API load
 """
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Awaitable, Callable, Tuple
+from collections import OrderedDict
 import json
 import hashlib
+import sys
 import time
 from pathlib import Path
 from loguru import logger
+import asyncio
 import aiosqlite
 
 from config import settings
+from services.metrics import metrics
+from services.single_flight import single_flight
+from catalog.record_codec import encode_value, decode_value, available_compression
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Approximate in-memory size of a cached result in bytes
+    
+    Results are lists of flat star dicts, so one sampled record is sized
+    and scaled by the list length instead of walking every object. Dict
+    values (e.g. truncated sky tiles) are sized from their members.
+    """
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(member) for member in value.values())
+    if isinstance(value, list):
+        if not value:
+            return sys.getsizeof(value)
+        sample = value[0]
+        if isinstance(sample, dict):
+            record = sys.getsizeof(sample) + sum(
+                sys.getsizeof(k) + sys.getsizeof(v) for k, v in sample.items()
+            )
+        else:
+            record = sys.getsizeof(sample)
+        return sys.getsizeof(value) + record * len(value)
+    return sys.getsizeof(value)
+
+
+class MemoryLRU:
+    """Least-recently-used dict bounded by entry count and approximate byte size"""
+    
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.total_bytes = 0
+        self.evictions = 0
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the entry and mark it most recently used"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+    
+    def set(self, key: str, value: Any, timestamp: float):
+        """Insert an entry, evicting least recently used ones to stay within bounds"""
+        size = estimate_size(value)
+        self.pop(key)
+        if size > self.max_bytes:
+            # Larger than the whole budget: keep it in SQLite only
+            return
+        self.entries[key] = {'value': value, 'timestamp': timestamp, 'size': size}
+        self.total_bytes += size
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= evicted['size']
+            self.evictions += 1
+    
+    def pop(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry['size']
+    
+    def items(self):
+        return list(self.entries.items())
+    
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+
+# Pragmas for the long-lived cache connection: WAL lets readers proceed during
+# writes, NORMAL sync is durable enough for a cache, mmap/cache cut read syscalls
+CACHE_DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Bumped whenever the stored value encoding changes; rows with another
+# version are treated as misses and overwritten
+CACHE_SCHEMA_VERSION = 2
+
+# Keys per SQLite lookup in get_many (below SQLite's default bound-variable limit)
+SQLITE_LOOKUP_BATCH = 500
 
 
 class CacheService:
     """Simple caching service with TTL support"""
     
     def __init__(self):
-        self.memory_cache: Dict[str, Dict[str, Any]] = {}
+        self.memory_cache = MemoryLRU(
+            max_entries=settings.CACHE_MEMORY_MAX_ENTRIES,
+            max_bytes=settings.CACHE_MEMORY_MAX_MB * 1024 * 1024
+        )
+        # Hit/miss counters, reported by stats() and /health
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
         # Database path for SQLite cache
         self.db_path = getattr(settings, "CACHE_DB_PATH", "cache.db")
         self.enabled = settings.CACHE_ENABLED
         self.ttl = settings.CACHE_TTL_SECONDS
+        # Stored value encoding (see catalog/record_codec.py)
+        self.columnar = settings.CACHE_CODEC == "columnar"
+        self.compression = available_compression(settings.CACHE_COMPRESSION)
+        # One long-lived connection (opened in initialize, closed in close);
+        # sqlite3's statement cache keeps the fixed queries below prepared
+        self.db: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
         
+    async def _get_db(self) -> aiosqlite.Connection:
+        """Return the shared connection, opening it on first use"""
+        if self.db is not None:
+            return self.db
+        async with self._connect_lock:
+            if self.db is None:
+                db = await aiosqlite.connect(self.db_path)
+                for pragma in CACHE_DB_PRAGMAS:
+                    await db.execute(pragma)
+                self.db = db
+        return self.db
+    
+    async def close(self):
+        """Close the shared connection (lifespan shutdown)"""
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
+    
     async def initialize(self):
         """Initialize SQLite cache database"""
         if not self.enabled:
@@ -34,21 +164,29 @@ class CacheService:
         except Exception:
             pass
 
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS query_cache (
-                    key TEXT PRIMARY KEY,
-                    value TEXT NOT NULL,
-                    timestamp REAL NOT NULL
-                )
-            """)
-            await db.execute("""
-                CREATE INDEX IF NOT EXISTS idx_timestamp 
-                ON query_cache(timestamp)
-            """)
-            await db.commit()
+        db = await self._get_db()
+        # Tables from before the binary codec stored JSON text without a
+        # version column; cached results are disposable, so start over
+        async with db.execute("PRAGMA table_info(query_cache)") as cursor:
+            columns = [row[1] for row in await cursor.fetchall()]
+        if columns and 'version' not in columns:
+            logger.info("Dropping pre-versioned query cache table")
+            await db.execute("DROP TABLE query_cache")
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS query_cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                timestamp REAL NOT NULL,
+                version INTEGER NOT NULL
+            )
+        """)
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_timestamp 
+            ON query_cache(timestamp)
+        """)
+        await db.commit()
         
-        logger.info("Cache service initialized")
+        logger.info(f"Cache service initialized (codec: {settings.CACHE_CODEC}, compression: {self.compression})")
     
     def _generate_key(self, query_params: Dict) -> str:
         """Generate cache key from query parameters"""
@@ -56,58 +194,87 @@ class CacheService:
         sorted_params = json.dumps(query_params, sort_keys=True)
         return hashlib.sha256(sorted_params.encode()).hexdigest()
     
-    async def get(self, query_params: Dict) -> Optional[List[Dict]]:
+    async def get(self, query_params: Dict) -> Optional[Any]:
         """Get cached query result"""
+        return (await self.get_many([query_params]))[0]
+    
+    async def get_many(self, query_params_list: List[Dict]) -> List[Optional[Any]]:
+        """
+        Get several cached results at once (None for each miss)
+        
+        Keys missing from memory are read from SQLite together, so a request
+        assembling hundreds of sky tiles makes one query instead of one per tile.
+        """
         if not self.enabled:
-            return None
+            return [None] * len(query_params_list)
         
-        key = self._generate_key(query_params)
+        keys = [self._generate_key(query_params) for query_params in query_params_list]
+        values: List[Optional[Any]] = [None] * len(keys)
         current_time = time.time()
         
         # Check memory cache first
-        if key in self.memory_cache:
-            cached = self.memory_cache[key]
-            if current_time - cached['timestamp'] < self.ttl:
-                logger.debug(f"Cache HIT (memory): {key[:16]}...")
-                return cached['value']
-            else:
+        lookup_start = time.perf_counter()
+        pending: Dict[str, List[int]] = {}
+        for i, key in enumerate(keys):
+            cached = self.memory_cache.get(key)
+            if cached is not None:
+                if current_time - cached['timestamp'] < self.ttl:
+                    values[i] = cached['value']
+                    continue
                 # Expired
-                del self.memory_cache[key]
+                self.memory_cache.pop(key)
+            pending.setdefault(key, []).append(i)
+        memory_hits = len(keys) - sum(len(indices) for indices in pending.values())
+        self.memory_hits += memory_hits
+        metrics.observe_stage("cache_lookup", "memory", time.perf_counter() - lookup_start)
+        metrics.cache_lookup("memory_hit", memory_hits)
+        if not pending:
+            logger.debug(f"Cache HIT (memory): {len(keys)} keys")
+            return values
         
         # Check SQLite cache
+        lookup_start = time.perf_counter()
+        db_hits = 0
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            db = await self._get_db()
+            stale = []
+            pending_keys = list(pending)
+            for start in range(0, len(pending_keys), SQLITE_LOOKUP_BATCH):
+                batch = pending_keys[start:start + SQLITE_LOOKUP_BATCH]
                 async with db.execute(
-                    "SELECT value, timestamp FROM query_cache WHERE key = ?",
-                    (key,)
+                    f"SELECT key, value, timestamp, version FROM query_cache WHERE key IN ({', '.join('?' * len(batch))})",
+                    batch
                 ) as cursor:
-                    row = await cursor.fetchone()
-                    
-                    if row:
-                        value_json, timestamp = row
-                        if current_time - timestamp < self.ttl:
-                            value = json.loads(value_json)
-                            # Promote to memory cache
-                            self.memory_cache[key] = {
-                                'value': value,
-                                'timestamp': timestamp
-                            }
-                            logger.debug(f"Cache HIT (db): {key[:16]}...")
-                            return value
-                        else:
-                            # Expired - delete
-                            await db.execute(
-                                "DELETE FROM query_cache WHERE key = ?",
-                                (key,)
-                            )
-                            await db.commit()
+                    rows = await cursor.fetchall()
+                
+                for key, blob, timestamp, version in rows:
+                    if current_time - timestamp < self.ttl and version == CACHE_SCHEMA_VERSION:
+                        value = decode_value(blob)
+                        # Promote to memory cache
+                        self.memory_cache.set(key, value, timestamp)
+                        for i in pending.pop(key):
+                            values[i] = value
+                            db_hits += 1
+                    else:
+                        stale.append(key)
+            
+            if stale:
+                # Expired or written by another schema version - delete
+                await db.executemany("DELETE FROM query_cache WHERE key = ?", [(key,) for key in stale])
+                await db.commit()
         except Exception as e:
             logger.warning(f"Cache read error: {e}")
         
-        logger.debug(f"Cache MISS: {key[:16]}...")
-        return None
+        misses = sum(len(indices) for indices in pending.values())
+        self.db_hits += db_hits
+        self.misses += misses
+        metrics.observe_stage("cache_lookup", "sqlite", time.perf_counter() - lookup_start)
+        metrics.cache_lookup("sqlite_hit", db_hits)
+        metrics.cache_lookup("miss", misses)
+        logger.debug(f"Cache lookup: {memory_hits} memory hits, {db_hits} db hits, {misses} misses")
+        return values
     
-    async def set(self, query_params: Dict, value: List[Dict]):
+    async def set(self, query_params: Dict, value: Any):
         """Store query result in cache"""
         if not self.enabled:
             return
@@ -116,25 +283,45 @@ class CacheService:
         timestamp = time.time()
         
         # Store in memory
-        self.memory_cache[key] = {
-            'value': value,
-            'timestamp': timestamp
-        }
+        self.memory_cache.set(key, value, timestamp)
         
         # Store in SQLite
         try:
-            value_json = json.dumps(value)
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute(
-                    "INSERT OR REPLACE INTO query_cache (key, value, timestamp) VALUES (?, ?, ?)",
-                    (key, value_json, timestamp)
-                )
-                await db.commit()
+            blob = encode_value(value, self.compression, self.columnar)
+            db = await self._get_db()
+            await db.execute(
+                "INSERT OR REPLACE INTO query_cache (key, value, timestamp, version) VALUES (?, ?, ?, ?)",
+                (key, blob, timestamp, CACHE_SCHEMA_VERSION)
+            )
+            await db.commit()
             
             logger.debug(f"Cached query result: {key[:16]}... ({len(value)} stars)")
         except Exception as e:
             logger.warning(f"Cache write error: {e}")
     
+    async def get_or_compute(
+        self,
+        query_params: Dict,
+        compute: Callable[[], Awaitable[List[Dict]]]
+    ) -> Tuple[List[Dict], bool]:
+        """
+        Return (result, cached), running compute() on a miss
+        
+        Concurrent misses for the same key share one compute() call, and the
+        result is cached once by whichever request started it.
+        """
+        cached = await self.get(query_params)
+        if cached:
+            return cached, True
+        
+        async def fill() -> List[Dict]:
+            value = await compute()
+            await self.set(query_params, value)
+            return value
+        
+        key = f"cache:{self._generate_key(query_params)}"
+        return await single_flight.do(key, fill), False
+    
     async def clear_expired(self):
         """Remove expired cache entries"""
         if not self.enabled:
@@ -149,39 +336,51 @@ class CacheService:
             if v['timestamp'] < cutoff
         ]
         for key in expired_keys:
-            del self.memory_cache[key]
+            self.memory_cache.pop(key)
         
         # Clear SQLite cache
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                result = await db.execute(
-                    "DELETE FROM query_cache WHERE timestamp < ?",
-                    (cutoff,)
-                )
-                await db.commit()
-                deleted = result.rowcount
-                
-                if deleted > 0:
-                    logger.info(f"Cleared {deleted} expired cache entries")
+            db = await self._get_db()
+            result = await db.execute(
+                "DELETE FROM query_cache WHERE timestamp < ?",
+                (cutoff,)
+            )
+            await db.commit()
+            deleted = result.rowcount
+            
+            if deleted > 0:
+                logger.info(f"Cleared {deleted} expired cache entries")
         except Exception as e:
             logger.warning(f"Cache cleanup error: {e}")
     
     async def stats(self) -> Dict[str, Any]:
         """Get cache statistics"""
+        lookups = self.memory_hits + self.db_hits + self.misses
         stats = {
             'enabled': self.enabled,
             'memory_entries': len(self.memory_cache),
+            'memory_bytes': self.memory_cache.total_bytes,
+            'memory_max_entries': self.memory_cache.max_entries,
+            'memory_max_bytes': self.memory_cache.max_bytes,
+            'memory_hits': self.memory_hits,
+            'db_hits': self.db_hits,
+            'misses': self.misses,
+            'evictions': self.memory_cache.evictions,
+            'hit_ratio': round((self.memory_hits + self.db_hits) / lookups, 4) if lookups else 0.0,
             'db_entries': 0,
-            'ttl_seconds': self.ttl
+            'ttl_seconds': self.ttl,
+            'codec': settings.CACHE_CODEC,
+            'compression': self.compression
         }
         
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
+        if self.enabled:
+            try:
+                db = await self._get_db()
                 async with db.execute("SELECT COUNT(*) FROM query_cache") as cursor:
                     row = await cursor.fetchone()
                     stats['db_entries'] = row[0] if row else 0
-        except:
-            pass
+            except Exception:
+                pass
         
         return stats
 
@@ -189,9 +388,9 @@ class CacheService:
         """Completely clear cache (memory + db)."""
         self.memory_cache.clear()
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute("DELETE FROM query_cache")
-                await db.commit()
+            db = await self._get_db()
+            await db.execute("DELETE FROM query_cache")
+            await db.commit()
         except Exception as e:
             logger.warning(f"Cache clear_all error: {e}")
 
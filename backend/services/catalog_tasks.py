@@ -0,0 +1,81 @@
+"""
+Catalog scans run in the CPU pool's worker processes (see services.executors)
+Each worker opens the catalog files itself - the memory-mapped binary catalog
+or its own read-only SQLite connections, which never migrate the database
+(serve.py and the API process do that) - and returns the selected rows as shared NumPy
+columns: row indices into the binary catalog, or API star columns
+(catalog_row_columns) for SQLite catalogs.
+"""
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict
+
+import numpy as np
+
+from catalog.packed_format import pack_arrays
+from catalog.star_records import catalog_row_columns
+from config import settings
+from services.columnar_catalog import ColumnarCatalog
+from services.executors import SharedArrays, share_arrays
+
+if TYPE_CHECKING:
+    from services.local_catalog_service import LocalCatalogService
+
+
+# Per-process catalogs, opened on first use
+_engines: Dict[str, ColumnarCatalog] = {}
+_services: Dict[str, "LocalCatalogService"] = {}
+
+
+def _engine(binary_path: str) -> ColumnarCatalog:
+    if binary_path not in _engines:
+        _engines[binary_path] = ColumnarCatalog.from_binary(Path(binary_path))
+    return _engines[binary_path]
+
+
+def _service(db_path: str) -> "LocalCatalogService":
+    # Imported here: local_catalog_service imports this module
+    from services.local_catalog_service import LocalCatalogService
+    if db_path not in _services:
+        _services[db_path] = LocalCatalogService(db_path, read_only=True)
+    return _services[db_path]
+
+
+def _payload(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    positions = np.stack([columns['x'], columns['y'], columns['z']], axis=1).astype(np.float32)
+    colors = np.stack([columns['r'], columns['g'], columns['b']], axis=1).astype(np.float32)
+    body = pack_arrays(positions, colors, columns['magnitude'].astype(np.float32), columns['source_id'])
+    return {'payload': np.frombuffer(body, dtype=np.uint8)}
+
+
+def engine_cone(binary_path: str, *args) -> SharedArrays:
+    """ColumnarCatalog.cone_indices() of a binary catalog"""
+    return share_arrays({'idx': _engine(binary_path).cone_indices(*args)})
+
+
+def engine_nearby(binary_path: str, *args) -> SharedArrays:
+    """ColumnarCatalog.nearby_indices() of a binary catalog"""
+    return share_arrays({'idx': _engine(binary_path).nearby_indices(*args)})
+
+
+def engine_cone_packed(binary_path: str, *args) -> SharedArrays:
+    """Packed payload of a binary catalog cone, as a uint8 `payload` column"""
+    engine = _engine(binary_path)
+    return share_arrays({'payload': np.frombuffer(engine.to_packed(engine.cone_indices(*args)), dtype=np.uint8)})
+
+
+def sqlite_cone(db_path: str, *args) -> SharedArrays:
+    """API star columns of a SQLite catalog cone (LocalCatalogService._select_cone_rows)"""
+    rows = _service(db_path)._select_cone_rows(*args)
+    return share_arrays(catalog_row_columns(rows, settings.STAR_COLOR_MODE))
+
+
+def sqlite_nearby(db_path: str, *args) -> SharedArrays:
+    """API star columns of SQLite catalog stars near a camera (LocalCatalogService._select_nearby_rows)"""
+    rows = _service(db_path)._select_nearby_rows(*args)
+    return share_arrays(catalog_row_columns(rows, settings.STAR_COLOR_MODE))
+
+
+def sqlite_cone_packed(db_path: str, *args) -> SharedArrays:
+    """Packed payload of a SQLite catalog cone, as a uint8 `payload` column"""
+    rows = _service(db_path)._select_cone_rows(*args)
+    return share_arrays(_payload(catalog_row_columns(rows, settings.STAR_COLOR_MODE)))
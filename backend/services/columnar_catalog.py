@@ -0,0 +1,218 @@
+"""
+In-memory columnar star catalog
+Loads the local catalog once into contiguous NumPy arrays and answers
+magnitude, cone and nearby queries with vectorized masks
+"""
+import math
+from pathlib import Path
+from typing import List, Dict, Optional
+
+import numpy as np
+from loguru import logger
+
+from catalog.binary_format import open_binary_catalog
+from catalog.healpix import HEALPIX_ORDER, ang2pix_nest
+from catalog.lod import lod_levels
+from catalog.packed_format import pack_arrays
+from catalog.star_columns import read_sqlite_columns
+
+
+class ColumnarCatalog:
+    """Struct-of-arrays view of the `stars` table, sorted by magnitude"""
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.source_id = columns['source_id']
+        self.ra = columns['ra']
+        self.dec = columns['dec']
+        self.x = columns['x']
+        self.y = columns['y']
+        self.z = columns['z']
+        self.parallax = columns['parallax']
+        self.distance_pc = columns['distance_pc']
+        self.magnitude = columns['magnitude']
+        self.bp_rp = columns['bp_rp']
+        self.rgb = columns['rgb']
+        self.pmra = columns['pmra']
+        self.pmdec = columns['pmdec']
+        self.radial_velocity = columns['radial_velocity']
+        self.temperature = columns['temperature']
+        # Unit vectors on the sky for cone searches (float64 keeps sub-arcsecond precision)
+        self.unit = columns['unit']
+        # LOD level per star (catalog.lod); mapped from binary catalogs that carry it, else computed on first use
+        self._lod: Optional[np.ndarray] = columns.get('lod')
+
+    def __len__(self) -> int:
+        return len(self.magnitude)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate resident size of all columns"""
+        return sum(column.nbytes for column in self._columns())
+
+    def _columns(self) -> List[np.ndarray]:
+        return [
+            getattr(self, name) for name in (
+                'source_id', 'ra', 'dec', 'x', 'y', 'z', 'parallax', 'distance_pc',
+                'magnitude', 'bp_rp', 'rgb', 'pmra', 'pmdec', 'radial_velocity',
+                'temperature', 'unit'
+            )
+        ]
+
+    def preload(self) -> int:
+        """
+        Fault every page of the columns in and compute the LOD levels
+
+        Memory-mapped catalogs are otherwise read from disk by the first
+        queries. Returns the bytes covered.
+        """
+        for column in self._columns() + [self.lod]:
+            if len(column):
+                # One byte per 4 KiB page is enough to read it in
+                int(np.ascontiguousarray(column).reshape(-1).view(np.uint8)[::4096].sum())
+        return self.nbytes
+
+    @classmethod
+    def from_sqlite(cls, db_path: Path, color_mode: str = "bp_rp") -> "ColumnarCatalog":
+        """Load the whole `stars` table into process memory"""
+        catalog = cls(read_sqlite_columns(db_path, color_mode))
+        logger.info(f"Columnar catalog loaded: {len(catalog)} stars, {catalog.nbytes / 1e6:.1f} MB")
+        return catalog
+
+    @classmethod
+    def from_binary(cls, path: Path) -> "ColumnarCatalog":
+        """Memory-map a binary catalog written by download_gaia_catalog.py"""
+        catalog = cls(open_binary_catalog(path))
+        logger.info(f"Columnar catalog mapped: {len(catalog)} stars, {catalog.nbytes / 1e6:.1f} MB from {path}")
+        return catalog
+
+    @property
+    def lod(self) -> np.ndarray:
+        """LOD level of each star (rows are in magnitude order, as lod_levels expects)"""
+        if self._lod is None:
+            self._lod = lod_levels(ang2pix_nest(HEALPIX_ORDER, self.ra, self.dec), HEALPIX_ORDER)
+        return self._lod
+
+    def bright_indices(self, mag_limit: float) -> np.ndarray:
+        """Indices of stars brighter than mag_limit, brightest first (a prefix)"""
+        return np.arange(np.searchsorted(self.magnitude, mag_limit, side='left'))
+
+    def cone_indices(
+        self,
+        ra: float,
+        dec: float,
+        radius_deg: float,
+        max_stars: int,
+        mag_limit: float,
+        lod_level: Optional[int] = None
+    ) -> np.ndarray:
+        """Indices of the brightest max_stars stars within radius_deg of (ra, dec), up to an optional LOD level"""
+        ra_rad = math.radians(ra)
+        dec_rad = math.radians(dec)
+        center = np.array([
+            math.cos(dec_rad) * math.cos(ra_rad),
+            math.cos(dec_rad) * math.sin(ra_rad),
+            math.sin(dec_rad)
+        ])
+        mask = self.unit @ center >= math.cos(math.radians(radius_deg))
+        mask &= self.magnitude < mag_limit
+        if lod_level is not None:
+            mask &= self.lod <= lod_level
+        idx = np.flatnonzero(mask)
+        return self._smallest(idx, self.magnitude[idx], max_stars)
+
+    def nearby_indices(
+        self,
+        camera_x: float,
+        camera_y: float,
+        camera_z: float,
+        max_distance: float,
+        max_stars: int,
+        mag_limit: float
+    ) -> np.ndarray:
+        """Indices of stars within max_distance of the camera, nearest first"""
+        dx = self.x - np.float32(camera_x)
+        dy = self.y - np.float32(camera_y)
+        dz = self.z - np.float32(camera_z)
+        distance_sq = dx * dx + dy * dy + dz * dz
+        mask = distance_sq < np.float32(max_distance * max_distance)
+        mask &= self.magnitude < mag_limit
+        idx = np.flatnonzero(mask)
+
+        keys = distance_sq[idx]
+        if len(idx) > max_stars:
+            part = np.argpartition(keys, max_stars - 1)[:max_stars]
+            idx, keys = idx[part], keys[part]
+        # Same ordering as the SQL path: distance, then magnitude
+        return idx[np.lexsort((self.magnitude[idx], keys))]
+
+    @staticmethod
+    def _smallest(idx: np.ndarray, keys: np.ndarray, count: int) -> np.ndarray:
+        """Return idx ordered by keys, keeping only the `count` smallest"""
+        if len(idx) > count:
+            part = np.argpartition(keys, count - 1)[:count]
+            idx, keys = idx[part], keys[part]
+        return idx[np.argsort(keys, kind='stable')]
+
+    def to_packed(self, idx: np.ndarray) -> bytes:
+        """Packed binary payload for the selected rows, without per-star objects"""
+        positions = np.stack([self.x[idx], self.y[idx], self.z[idx]], axis=1)
+        colors = self.rgb[idx].astype(np.float32) / np.float32(255.0)
+        return pack_arrays(positions, colors, self.magnitude[idx], self.source_id[idx])
+
+    def to_records(self, idx: np.ndarray) -> List[Dict]:
+        """Build API star dictionaries for the selected rows"""
+        if len(idx) == 0:
+            return []
+
+        def floats(values: np.ndarray, null_if_zero: bool = False) -> List:
+            # NaN (and optionally 0) -> None, matching the SQLite row conversion
+            values = values[idx].astype(np.float64)
+            null = np.isnan(values)
+            if null_if_zero:
+                null |= values == 0
+            out = values.tolist()
+            for i in np.flatnonzero(null).tolist():
+                out[i] = None
+            return out
+
+        rgb = (self.rgb[idx].astype(np.float64) / 255.0).tolist()
+        return [
+            {
+                'source_id': str(source_id),
+                'ra': ra,
+                'dec': dec,
+                'x': x,
+                'y': y,
+                'z': z,
+                'parallax': parallax,
+                'distance_pc': distance_pc,
+                'magnitude': magnitude,
+                'color_bp_rp': bp_rp,
+                'r': color[0],
+                'g': color[1],
+                'b': color[2],
+                'pm_ra': pm_ra,
+                'pm_dec': pm_dec,
+                'radial_velocity': radial_velocity,
+                'temperature': temperature,
+            }
+            for (source_id, ra, dec, x, y, z, parallax, distance_pc, magnitude, bp_rp,
+                 color, pm_ra, pm_dec, radial_velocity, temperature) in zip(
+                self.source_id[idx].tolist(),
+                self.ra[idx].tolist(),
+                self.dec[idx].tolist(),
+                self.x[idx].astype(np.float64).tolist(),
+                self.y[idx].astype(np.float64).tolist(),
+                self.z[idx].astype(np.float64).tolist(),
+                floats(self.parallax, null_if_zero=True),
+                self.distance_pc[idx].astype(np.float64).tolist(),
+                self.magnitude[idx].astype(np.float64).tolist(),
+                np.nan_to_num(self.bp_rp[idx].astype(np.float64), nan=0.0).tolist(),
+                rgb,
+                np.nan_to_num(self.pmra[idx].astype(np.float64), nan=0.0).tolist(),
+                np.nan_to_num(self.pmdec[idx].astype(np.float64), nan=0.0).tolist(),
+                floats(self.radial_velocity, null_if_zero=True),
+                floats(self.temperature, null_if_zero=True),
+            )
+        ]
+
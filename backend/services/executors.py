@@ -0,0 +1,222 @@
+"""
+Executor pools for blocking work
+Blocking calls run on two bounded pools instead of the event loop's default
+executor:
+- io: threads for SQLite reads, TAP result parsing, compression and file access
+- cpu: worker processes for CPU-bound catalog scans and row conversion, so
+  they do not contend for the API process's GIL. Their results come back as
+  NumPy columns in shared memory (share_arrays / take_arrays) rather than as
+  pickled lists of dicts.
+With CPU_POOL_PROCESSES=0 the CPU work runs on the io threads; the default
+(-1) splits the machine's cores among the API processes.
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import importlib
+import os
+
+import numpy as np
+from loguru import logger
+
+from config import settings
+
+
+# Shared-memory block name and (column, dtype, shape, offset) of each array in it
+SharedArrays = Tuple[str, List[Tuple[str, str, Tuple[int, ...], int]]]
+
+
+def share_arrays(arrays: Dict[str, np.ndarray]) -> SharedArrays:
+    """
+    Copy arrays into one new shared-memory block (worker process side)
+
+    The block is handed over to the receiving process, which must free it
+    with take_arrays() or release_arrays().
+    """
+    layout = []
+    offset = 0
+    for name, array in arrays.items():
+        offset = (offset + 63) // 64 * 64
+        layout.append((name, array.dtype.str, array.shape, offset))
+        offset += array.nbytes
+    shm = SharedMemory(create=True, size=max(offset, 1))
+    try:
+        for (name, dtype, shape, start), array in zip(layout, arrays.values()):
+            np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)[...] = array
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    # Spawned workers share the API process's resource tracker, so the block
+    # outlives this worker and is unregistered when the receiver unlinks it
+    shm.close()
+    return shm.name, layout
+
+
+def take_arrays(shared: SharedArrays) -> Dict[str, np.ndarray]:
+    """Copy the arrays out of a block from share_arrays() and free it"""
+    name, layout = shared
+    shm = SharedMemory(name=name)
+    try:
+        return {
+            column: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start).copy()
+            for column, dtype, shape, start in layout
+        }
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def release_arrays(shared: SharedArrays):
+    """Free a block from share_arrays() without reading it"""
+    shm = SharedMemory(name=shared[0])
+    shm.close()
+    shm.unlink()
+
+
+def _warm():
+    """No-op run once per worker process at startup (imports happen then, not on the first query)"""
+    importlib.import_module("services.local_catalog_service")
+
+
+def cpu_pool_size(processes: int, api_processes: int) -> int:
+    """CPU_POOL_PROCESSES, or for -1 this API process's share of the cores"""
+    if processes >= 0:
+        return processes
+    return (os.cpu_count() or 1) // max(api_processes, 1)
+
+
+class PoolStats:
+    """Task counters for one pool"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    def finished(self, future: asyncio.Future):
+        if future.cancelled() or future.exception() is not None:
+            self.failed += 1
+        else:
+            self.completed += 1
+
+    def as_dict(self) -> Dict[str, int]:
+        pending = self.submitted - self.completed - self.failed
+        return {
+            'workers': self.workers,
+            # Tasks waiting for a free worker: the pool's queue depth
+            'queued': max(pending - self.workers, 0),
+            'running': min(pending, self.workers),
+            'completed': self.completed,
+            'failed': self.failed
+        }
+
+
+class ExecutorPools:
+    """Bounded thread pool for I/O and process pool for CPU-bound catalog work"""
+
+    def __init__(self, io_threads: int, cpu_processes: int):
+        self.io_threads = max(io_threads, 1)
+        self.cpu_processes = max(cpu_processes, 0)
+        self._io: Optional[ThreadPoolExecutor] = None
+        self._cpu: Optional[ProcessPoolExecutor] = None
+        self.io_stats = PoolStats(self.io_threads)
+        self.cpu_stats = PoolStats(self.cpu_processes)
+
+    @property
+    def cpu_enabled(self) -> bool:
+        return self.cpu_processes > 0
+
+    @property
+    def io(self) -> ThreadPoolExecutor:
+        if self._io is None:
+            self._io = ThreadPoolExecutor(max_workers=self.io_threads, thread_name_prefix="io")
+        return self._io
+
+    @property
+    def cpu(self) -> ProcessPoolExecutor:
+        if self._cpu is None:
+            # Spawned, not forked: the API process has running threads and open connections
+            self._cpu = ProcessPoolExecutor(max_workers=self.cpu_processes, mp_context=get_context("spawn"))
+        return self._cpu
+
+    async def start(self):
+        """Start the worker processes now rather than on the first CPU task"""
+        if not self.cpu_enabled:
+            return
+        loop = asyncio.get_event_loop()
+        try:
+            await asyncio.gather(*(
+                loop.run_in_executor(self.cpu, _warm) for _ in range(self.cpu_processes)
+            ))
+        except Exception as e:
+            logger.warning(f"CPU pool unavailable, catalog scans will run on I/O threads: {e!r}")
+            self.shutdown_cpu()
+            self.cpu_processes = 0
+            return
+        logger.info(f"CPU pool ready: {self.cpu_processes} processes")
+
+    async def _run(self, executor: Executor, stats: PoolStats, fn: Callable, *args) -> Any:
+        future = asyncio.get_event_loop().run_in_executor(executor, fn, *args)
+        stats.submitted += 1
+        future.add_done_callback(stats.finished)
+        return await future
+
+    async def run_io(self, fn: Callable, *args) -> Any:
+        """Run a blocking call on the I/O threads"""
+        return await self._run(self.io, self.io_stats, fn, *args)
+
+    async def run_cpu(self, fn: Callable, *args) -> Any:
+        """
+        Run a CPU-bound call in the process pool (on the I/O threads if it is disabled)
+
+        fn must be a picklable module-level function. A pool broken by a
+        crashed worker is replaced for later calls.
+        """
+        if not self.cpu_enabled:
+            return await self.run_io(fn, *args)
+        try:
+            return await self._run(self.cpu, self.cpu_stats, fn, *args)
+        except BrokenProcessPool:
+            logger.error("CPU pool worker died, restarting the pool")
+            self._cpu = None
+            raise
+
+    async def run_cpu_arrays(self, fn: Callable, *args) -> Dict[str, np.ndarray]:
+        """run_cpu() for tasks returning share_arrays() blocks; returns the arrays"""
+        future = asyncio.ensure_future(self.run_cpu(fn, *args))
+        try:
+            shared = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The worker still finishes; free its block when it does
+            future.add_done_callback(
+                lambda done: release_arrays(done.result())
+                if not done.cancelled() and done.exception() is None else None
+            )
+            raise
+        return take_arrays(shared)
+
+    def shutdown_cpu(self):
+        if self._cpu is not None:
+            self._cpu.shutdown(wait=False, cancel_futures=True)
+            self._cpu = None
+
+    def shutdown(self):
+        self.shutdown_cpu()
+        if self._io is not None:
+            self._io.shutdown(wait=False, cancel_futures=True)
+            self._io = None
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {'io': self.io_stats.as_dict(), 'cpu': self.cpu_stats.as_dict()}
+
+
+# Global pools
+executors = ExecutorPools(
+    settings.IO_POOL_THREADS,
+    cpu_pool_size(settings.CPU_POOL_PROCESSES, settings.API_PROCESSES)
+)
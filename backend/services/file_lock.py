@@ -0,0 +1,33 @@
+"""
+Cross-process file locks
+serve.py workers coordinate one-off work (building a shared bright catalog
+body, the startup warmup) with an exclusive flock on a lock file. Without
+fcntl (Windows) every lock is granted at once and each worker does the work
+itself.
+"""
+import asyncio
+
+try:
+    import fcntl
+except ImportError:  # Windows: workers run independently
+    fcntl = None
+
+
+POLL_SECONDS = 0.05
+
+
+def try_lock(lock) -> bool:
+    """Take the exclusive lock on an open file if no other process holds it"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+async def acquire(lock):
+    """Take the exclusive lock without blocking the event loop (cancellable while waiting)"""
+    while not try_lock(lock):
+        await asyncio.sleep(POLL_SECONDS)
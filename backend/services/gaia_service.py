@@ -2,18 +2,40 @@
 ESA Gaia DR3 Archive Service
 Handles real-time queries to Gaia TAP+ service for astronomical data
 """
-from typing import List, Dict, Optional, Tuple
-from astroquery.gaia import Gaia
-from astropy.coordinates import SkyCoord
-from astropy import units as u
+from typing import Callable, List, Dict, Optional, Tuple
+from contextlib import aclosing
 import numpy as np
 import pandas as pd
 from loguru import logger
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    retry_if_not_exception_type,
+    stop_after_attempt,
+    stop_after_delay,
+    wait_exponential,
+)
 import asyncio
-from functools import partial
+import time
 
 from config import settings
+from catalog.healpix import SOURCE_ID_HEALPIX_ORDER, SOURCE_ID_HEALPIX_SHIFT, pixel_ranges
+from catalog.star_records import API_FIELDS, columns_to_records, dataframe_to_stars, gaia_columns
+from services.executors import executors
+from services.metrics import metrics
+from services.tap_client import TapError, tap_client
+
+
+# Transient failures (network errors, 5xx answers) are retried while the first
+# attempt's GAIA_TIMEOUT_SECONDS have not run out. A query that hit its deadline
+# (asyncio.TimeoutError), ADQL errors and cancellation (asyncio.CancelledError
+# is not an Exception) are not retried.
+GAIA_RETRY = dict(
+    stop=stop_after_attempt(3) | stop_after_delay(settings.GAIA_TIMEOUT_SECONDS),
+    wait=wait_exponential(multiplier=1, min=2, max=10),
+    retry=retry_if_exception_type(Exception) & retry_if_not_exception_type((TapError, asyncio.TimeoutError)),
+    reraise=True
+)
 
 
 class GaiaService:
@@ -21,15 +43,10 @@ class GaiaService:
     
     def __init__(self):
         """Initialize Gaia service with TAP+ endpoint"""
-        Gaia.MAIN_GAIA_TABLE = "gaiadr3.gaia_source"
-        Gaia.ROW_LIMIT = settings.GAIA_MAX_ROWS
+        self.tap = tap_client
         logger.info(f"Gaia service initialized with TAP URL: {settings.GAIA_TAP_URL}")
     
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        reraise=True
-    )
+    @retry(**GAIA_RETRY)
     async def query_cone_async(
         self,
         ra: float,
@@ -53,25 +70,6 @@ class GaiaService:
         """
         logger.info(f"Querying Gaia: RA={ra:.2f}, DEC={dec:.2f}, radius={radius_deg:.4f}deg, limit={max_stars}")
         
-        # Run blocking astroquery call in executor to avoid blocking async loop
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None,
-            partial(self._query_cone_sync, ra, dec, radius_deg, max_stars, min_magnitude)
-        )
-        
-        return result
-    
-    def _query_cone_sync(
-        self,
-        ra: float,
-        dec: float,
-        radius_deg: float,
-        max_stars: int,
-        min_magnitude: float
-    ) -> List[Dict]:
-        """Synchronous cone query (runs in thread pool)"""
-        
         # Build ADQL query for Gaia DR3
         query = f"""
         SELECT TOP {max_stars}
@@ -94,82 +92,108 @@ class GaiaService:
         ORDER BY phot_g_mean_mag ASC
         """
         
+        return await self._run_star_query(query)
+    
+    async def _run_star_query(
+        self,
+        query: str,
+        convert: Optional[Callable[[pd.DataFrame], List[Dict]]] = None
+    ) -> List[Dict]:
+        """
+        Run an ADQL query with the cone query's SELECT list and convert rows to star dicts
+        
+        Rows are converted chunk by chunk as the result streams in, so only
+        one chunk of raw columns is held next to the star dicts. The query
+        and the conversion are timed as the gaia_tap and to_dicts stages.
+        """
+        convert = convert or self._star_records
+        stars: List[Dict] = []
+        start = time.perf_counter()
+        converting = 0.0
         try:
-            # Execute query
-            job = Gaia.launch_job_async(query, dump_to_file=False)
-            result_table = job.get_results()
-            
-            # Convert astropy table to Python list of dicts
-            # Using .to_pandas() for easier data access
-            import pandas as pd
-            df = result_table.to_pandas()
-            # Normalize pandas columns to lowercase to avoid case-sensitivity issues
-            df.columns = [str(c).lower() for c in df.columns]
-            
-            logger.info(f"Retrieved {len(df)} rows from Gaia DR3")
-            
-            stars = []
-            for idx, row in df.iterrows():
-                try:
-                    # Safely extract values with proper null checking (using normalized lowercase columns)
-                    parallax_val = row['parallax'] if 'parallax' in row.index and pd.notna(row['parallax']) else None
-                    bp_rp_val = row['bp_rp'] if 'bp_rp' in row.index and pd.notna(row['bp_rp']) else None
-                    
-                    # Convert equatorial (RA/DEC) to Cartesian (X/Y/Z)
-                    distance_pc = self._parallax_to_distance(parallax_val)
-                    x, y, z = self._equatorial_to_cartesian(
-                        float(row['ra']), float(row['dec']), distance_pc
-                    )
-                    
-                    # Calculate color from B-V photometry
-                    color_rgb = self._bp_rp_to_rgb(bp_rp_val if bp_rp_val is not None else 0.0)
-                    
-                    # Safely get proper motion values
-                    pmra_val = row['pmra'] if 'pmra' in row.index and pd.notna(row['pmra']) else 0.0
-                    pmdec_val = row['pmdec'] if 'pmdec' in row.index and pd.notna(row['pmdec']) else 0.0
-                    rv_val = row['radial_velocity'] if 'radial_velocity' in row.index and pd.notna(row['radial_velocity']) else None
-                    # Try temperature column (aliased in SQL)
-                    temp_val = None
-                    if 'temperature' in row.index and pd.notna(row['temperature']):
-                        temp_val = row['temperature']
-                    
-                    star = {
-                        'source_id': str(int(row['source_id'])) if 'source_id' in row.index and pd.notna(row['source_id']) else None,
-                        'ra': float(row['ra']),
-                        'dec': float(row['dec']),
-                        'x': x,
-                        'y': y,
-                        'z': z,
-                        'parallax': float(parallax_val) if parallax_val is not None else None,
-                        'distance_pc': distance_pc,
-                        'magnitude': float(row['phot_g_mean_mag']),
-                        'color_bp_rp': float(bp_rp_val) if bp_rp_val is not None else None,
-                        'r': color_rgb[0],
-                        'g': color_rgb[1],
-                        'b': color_rgb[2],
-                        'pm_ra': float(pmra_val),
-                        'pm_dec': float(pmdec_val),
-                        'radial_velocity': float(rv_val) if rv_val is not None else None,
-                        'temperature': float(temp_val) if temp_val is not None else None,
-                    }
-                    stars.append(star)
-                except Exception as row_error:
-                    # Skip problematic rows but log them with details
-                    logger.warning(f"Skipping row {idx} due to error: {row_error}. Available columns: {list(row.index)[:10]}")
-                    continue
-            
-            logger.success(f"Retrieved {len(stars)} stars from Gaia DR3")
-            return stars
-            
+            async with aclosing(self.tap.stream(query)) as chunks:
+                async for df in chunks:
+                    convert_start = time.perf_counter()
+                    stars.extend(await executors.run_io(convert, df))
+                    converting += time.perf_counter() - convert_start
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            logger.error(f"Gaia query failed: {e}")
+            logger.error(f"Gaia query failed: {e!r}")
             raise
+        finally:
+            metrics.observe_stage("gaia_tap", "remote", time.perf_counter() - start - converting)
+            metrics.observe_stage("to_dicts", "remote", converting)
+        
+        logger.success(f"Retrieved {len(stars)} stars from Gaia DR3")
+        return stars
+    
+    @staticmethod
+    def _star_records(df: pd.DataFrame) -> List[Dict]:
+        """Cone/tile result rows -> star dicts"""
+        return dataframe_to_stars(df, color_mode=settings.STAR_COLOR_MODE)
     
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        reraise=True
-    )
+    @retry(**GAIA_RETRY)
+    async def query_tiles_async(
+        self,
+        order: int,
+        pixels: List[int],
+        mag_min: Optional[float],
+        mag_max: Optional[float],
+        max_rows: int
+    ) -> List[Dict]:
+        """
+        Query every star in a set of HEALPix tiles and magnitude band (async wrapper)
+        
+        Args:
+            order: HEALPix order of the tiles (at most 12)
+            pixels: Nested pixel indices at that order
+            mag_min: Inclusive bright edge of the band (None = no limit)
+            mag_max: Exclusive faint edge of the band (None = no limit)
+            max_rows: Row cap; a result of exactly max_rows rows may be truncated
+        
+        Returns:
+            Stars sorted by magnitude, brightest first
+        """
+        logger.info(f"Querying Gaia tiles: order={order}, tiles={len(pixels)}, mag=[{mag_min}, {mag_max})")
+        
+        # Tiles map to source_id ranges, which the archive serves from its primary key
+        ranges = " OR ".join(
+            f"(source_id >= {start << SOURCE_ID_HEALPIX_SHIFT} AND source_id < {end << SOURCE_ID_HEALPIX_SHIFT})"
+            for start, end in pixel_ranges(order, np.asarray(pixels, dtype=np.int64), SOURCE_ID_HEALPIX_ORDER)
+        )
+        conditions = [f"({ranges})"]
+        if mag_min is not None:
+            conditions.append(f"phot_g_mean_mag >= {mag_min}")
+        if mag_max is not None:
+            conditions.append(f"phot_g_mean_mag < {mag_max}")
+        
+        query = f"""
+        SELECT TOP {max_rows}
+            source_id,
+            ra, dec,
+            parallax, parallax_error,
+            pmra, pmdec,
+            phot_g_mean_mag,
+            phot_bp_mean_mag,
+            phot_rp_mean_mag,
+            bp_rp,
+            radial_velocity,
+            teff_gspphot AS temperature
+        FROM gaiadr3.gaia_source
+        WHERE {" AND ".join(conditions)}
+        ORDER BY phot_g_mean_mag ASC
+        """
+        
+        return await self._run_star_query(query)
+    
+    @staticmethod
+    def source_id_pixels(stars: List[Dict], order: int) -> np.ndarray:
+        """HEALPix tile (nested, at `order`) of each star, decoded from its source_id"""
+        shift = SOURCE_ID_HEALPIX_SHIFT + 2 * (SOURCE_ID_HEALPIX_ORDER - order)
+        return np.array([int(star['source_id']) >> shift for star in stars], dtype=np.int64)
+    
+    @retry(**GAIA_RETRY)
     async def query_bright_stars_async(
         self,
         mag_limit: float = 6.5
@@ -186,18 +210,6 @@ class GaiaService:
         """
         logger.info(f"Querying full-sky bright star catalog (mag < {mag_limit})...")
         
-        # Run blocking query in executor
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None,
-            partial(self._query_bright_stars_sync, mag_limit)
-        )
-        
-        return result
-    
-    def _query_bright_stars_sync(self, mag_limit: float) -> List[Dict]:
-        """Synchronous full-sky bright star query"""
-        
         # Query ALL bright stars - no spatial constraint
         query = f"""
         SELECT
@@ -216,93 +228,17 @@ class GaiaService:
         ORDER BY phot_g_mean_mag ASC
         """
         
-        try:
-            # Execute query
-            logger.info(f"Executing full-sky query for mag < {mag_limit}...")
-            job = Gaia.launch_job_async(query, dump_to_file=False)
-            result_table = job.get_results()
-            
-            logger.info(f"Query finished. Retrieved {len(result_table)} rows from Gaia DR3")
-            
-            # Convert to pandas for easier handling
-            df = result_table.to_pandas()
-            
-            # Normalize column names to lowercase
-            df.columns = [str(c).lower() for c in df.columns]
-            
-            stars = []
-            for idx, row in df.iterrows():
-                try:
-                    # Extract fields safely
-                    source_id = str(row['source_id']) if 'source_id' in row.index else None
-                    ra = float(row['ra']) if 'ra' in row.index else None
-                    dec = float(row['dec']) if 'dec' in row.index else None
-                    
-                    if ra is None or dec is None:
-                        continue
-                    
-                    # Parallax and distance
-                    parallax_val = row.get('parallax')
-                    parallax_val = float(parallax_val) if pd.notna(parallax_val) else None
-                    
-                    if parallax_val and parallax_val > 0:
-                        distance_pc = self._parallax_to_distance(parallax_val)
-                    else:
-                        # Use magnitude-based distance estimate
-                        mag = float(row['phot_g_mean_mag'])
-                        distance_pc = 10 ** ((mag - 5) / 5 + 1)  # Rough estimate
-                    
-                    # Convert RA/Dec to Cartesian (for 3D positioning)
-                    x, y, z = self._equatorial_to_cartesian(ra, dec, distance_pc)
-                    
-                    # Colors and magnitude
-                    bp_rp_val = row.get('bp_rp')
-                    bp_rp_val = float(bp_rp_val) if pd.notna(bp_rp_val) else 0.0
-                    color_rgb = self._bp_rp_to_rgb(bp_rp_val)
-                    
-                    # Proper motion
-                    pmra_val = row.get('pmra', 0.0)
-                    pmra_val = float(pmra_val) if pd.notna(pmra_val) else 0.0
-                    pmdec_val = row.get('pmdec', 0.0)
-                    pmdec_val = float(pmdec_val) if pd.notna(pmdec_val) else 0.0
-                    
-                    # Radial velocity and temperature
-                    rv_val = row.get('radial_velocity')
-                    rv_val = float(rv_val) if pd.notna(rv_val) else None
-                    temp_val = row.get('temperature')
-                    temp_val = float(temp_val) if pd.notna(temp_val) else None
-                    
-                    star = {
-                        'source_id': source_id,
-                        'ra': ra,
-                        'dec': dec,
-                        'x': x,
-                        'y': y,
-                        'z': z,
-                        'parallax': parallax_val,
-                        'distance_pc': distance_pc,
-                        'magnitude': float(row['phot_g_mean_mag']),
-                        'color_bp_rp': bp_rp_val,
-                        'r': color_rgb[0],
-                        'g': color_rgb[1],
-                        'b': color_rgb[2],
-                        'pm_ra': pmra_val,
-                        'pm_dec': pmdec_val,
-                        'radial_velocity': rv_val,
-                        'temperature': temp_val,
-                    }
-                    stars.append(star)
-                    
-                except Exception as row_error:
-                    logger.warning(f"Skipping row {idx}: {row_error}")
-                    continue
-            
-            logger.success(f"Retrieved {len(stars)} bright stars from full sky")
-            return stars
-            
-        except Exception as e:
-            logger.error(f"Bright star catalog query failed: {e}")
-            raise
+        stars = await self._run_star_query(query, self._bright_records)
+        logger.success(f"Retrieved {len(stars)} bright stars from full sky")
+        return stars
+    
+    @staticmethod
+    def _bright_records(df: pd.DataFrame) -> List[Dict]:
+        """Bright catalog rows -> star dicts"""
+        # Unknown parallax -> magnitude-based distance; unknown BP-RP is reported as 0
+        columns = gaia_columns(df, magnitude_distance=True, color_mode=settings.STAR_COLOR_MODE)
+        columns['bp_rp'] = np.nan_to_num(columns['bp_rp'], nan=0.0)
+        return columns_to_records(columns, API_FIELDS)
     
     async def query_frustum_async(
         self,
@@ -325,6 +261,21 @@ class GaiaService:
         Returns:
             List of visible stars
         """
+        ra, dec, radius_deg, mag_limit = self.frustum_to_cone(
+            camera_direction, fov_deg, max_distance
+        )
+        
+        return await self.query_cone_async(
+            ra, dec, radius_deg, max_stars, mag_limit
+        )
+    
+    def frustum_to_cone(
+        self,
+        camera_direction: Tuple[float, float, float],
+        fov_deg: float,
+        max_distance: float
+    ) -> Tuple[float, float, float, float]:
+        """Cone (ra, dec, radius_deg, mag_limit) that covers a camera frustum"""
         # Convert camera direction to RA/DEC
         ra, dec = self._cartesian_to_equatorial(
             camera_direction[0],
@@ -339,44 +290,7 @@ class GaiaService:
         # Adjust magnitude limit based on distance (closer = see fainter stars)
         mag_limit = min(20.0, 15.0 + np.log10(max_distance / 100.0))
         
-        return await self.query_cone_async(
-            ra, dec, radius_deg, max_stars, mag_limit
-        )
-    
-    @staticmethod
-    def _parallax_to_distance(parallax_mas: Optional[float]) -> float:
-        """Convert parallax (milliarcseconds) to distance (parsecs)"""
-        if parallax_mas is None or parallax_mas <= 0:
-            return 1000.0  # Default far distance for stars without parallax
-        
-        # Distance (pc) = 1000 / parallax (mas)
-        distance = 1000.0 / parallax_mas
-        
-        # Clamp to reasonable range
-        return max(0.1, min(distance, 100000.0))
-    
-    @staticmethod
-    def _equatorial_to_cartesian(
-        ra_deg: float,
-        dec_deg: float,
-        distance_pc: float
-    ) -> Tuple[float, float, float]:
-        """
-        Convert equatorial coordinates (RA/DEC) to Cartesian (X/Y/Z)
-        
-        Uses right-handed coordinate system:
-        - X points to RA=0, DEC=0 (vernal equinox)
-        - Y points to RA=90, DEC=0
-        - Z points to DEC=90 (north celestial pole)
-        """
-        ra_rad = np.radians(ra_deg)
-        dec_rad = np.radians(dec_deg)
-        
-        x = distance_pc * np.cos(dec_rad) * np.cos(ra_rad)
-        y = distance_pc * np.cos(dec_rad) * np.sin(ra_rad)
-        z = distance_pc * np.sin(dec_rad)
-        
-        return (float(x), float(y), float(z))
+        return ra, dec, radius_deg, float(mag_limit)
     
     @staticmethod
     def _cartesian_to_equatorial(x: float, y: float, z: float) -> Tuple[float, float]:
@@ -395,43 +309,6 @@ class GaiaService:
         dec_deg = np.degrees(dec_rad)
         
         return (float(ra_deg), float(dec_deg))
-    
-    @staticmethod
-    def _bp_rp_to_rgb(bp_rp: float) -> Tuple[float, float, float]:
-        """
-        Convert Gaia BP-RP color index to RGB color
-        
-        BP-RP ranges from ~-0.5 (hot blue stars) to ~4.0 (cool red stars)
-        Reference: https://www.cosmos.esa.int/web/gaia/dr3-extinction
-        """
-        # Normalize BP-RP to 0-1 range
-        # Typical range: -0.5 (blue) to 4.0 (red)
-        normalized = (bp_rp + 0.5) / 4.5
-        normalized = max(0.0, min(1.0, normalized))
-        
-        # Color temperature mapping
-        if normalized < 0.2:
-            # Hot blue stars (O, B type)
-            r = 0.6 + normalized * 2.0
-            g = 0.7 + normalized * 1.5
-            b = 1.0
-        elif normalized < 0.5:
-            # White stars (A, F type)
-            r = 1.0
-            g = 1.0
-            b = 1.0 - (normalized - 0.2) * 2.0
-        elif normalized < 0.7:
-            # Yellow stars (G, K type)
-            r = 1.0
-            g = 1.0 - (normalized - 0.5) * 1.5
-            b = 0.4
-        else:
-            # Red stars (M type)
-            r = 1.0
-            g = 0.6 - (normalized - 0.7) * 1.0
-            b = 0.3
-        
-        return (float(r), float(g), float(b))
 
 
 # Global service instance
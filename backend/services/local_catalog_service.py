@@ -5,20 +5,69 @@ Queries local SQLite database instead of remote TAP API
 import sqlite3
 import json
 from math import radians, cos, sin
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Iterator, Optional
 from pathlib import Path
-import asyncio
+import threading
+from bisect import bisect_left
 from loguru import logger
 import math
 
+import numpy as np
+
 from config import settings
+from services.columnar_catalog import ColumnarCatalog
+from services.executors import executors
+from services.metrics import metrics
+from services import catalog_tasks
+from catalog.packed_format import pack_star_records
+from catalog.colors import colors_for_mode, pack_rgb8, packed_to_float, rgb8_to_float
+from catalog.binary_format import export_binary_catalog, open_binary_catalog
+from catalog.catalog_db import read_catalog_meta
+from catalog.lod import LOD_MAX_ORDER, thin_to_level, update_lod_column
+from catalog.star_records import catalog_records
+from catalog.healpix import (
+    HEALPIX_ORDER,
+    ang2pix_nest,
+    angular_separation_mask,
+    order_for_radius,
+    pixel_ranges,
+    query_disc_nest,
+)
+
+
+# Columns returned by star queries, in the order _row_to_star expects
+STAR_COLUMNS = """
+                source_id,
+                ra, dec,
+                x, y, z,
+                parallax,
+                distance_pc,
+                magnitude,
+                bp_rp,
+                pmra, pmdec,
+                radial_velocity,
+                temperature"""
+
+# Smallest rowid slice read by magnitude-ordered cone walks
+CONE_SLICE_MIN_ROWS = 4096
+
+# Read size when preloading the database file into the page cache
+PRELOAD_CHUNK_BYTES = 16 * 1024 * 1024
+
+# Stars per UPDATE batch when baking colors into an older catalog
+COLOR_BACKFILL_BATCH = 50000
 
 
 class LocalCatalogService:
     """Service for querying local Gaia catalog SQLite database"""
     
-    def __init__(self, db_path: str = "data/gaia_catalog.db"):
-        """Initialize with database path. Resolve relative path to repo root."""
+    def __init__(self, db_path: str = "data/gaia_catalog.db", read_only: bool = False):
+        """
+        Initialize with database path. Resolve relative path to repo root.
+        
+        A read_only service (CPU pool workers) opens the database with
+        mode=ro and never migrates it: indexes that are missing are not built.
+        """
         initial_path = Path(db_path)
         resolved_path = initial_path
         if not initial_path.is_absolute():
@@ -30,12 +79,197 @@ class LocalCatalogService:
                 if candidate.exists():
                     resolved_path = candidate
         self.db_path = resolved_path
+        # Memory-mappable copy written next to the DB by download_gaia_catalog.py
+        self.binary_path = self.db_path.with_suffix(".bin")
+        self.read_only = read_only
+        self._healpix_ready = False
+        self._rtree_ready = False
+        self._color_ready = False
+        self._lod_ready = False
+        self._catalog_version: Optional[str] = None
+        self._index_lock = threading.Lock()
+        # Shared magnitude-sorted bright star buffer, see _bright_prefix()
+        self._bright_stars: Optional[List[Dict]] = None
+        self._bright_magnitudes: List[float] = []
+        self._bright_limit = -math.inf
+        self._bright_lock = threading.Lock()
+        # Optional in-memory engine (CATALOG_ENGINE=memory), loaded in initialize()
+        self.engine: Optional[ColumnarCatalog] = None
+        # Whether the engine maps binary_path, which CPU pool workers can map too
+        self._engine_mapped = False
         if not self.db_path.exists():
             logger.warning(f"Catalog database not found: {self.db_path}")
             logger.warning("Run: python scripts/download_gaia_catalog.py --mag-limit 7.0 --output d:\\space\\data\\gaia_catalog.db")
         else:
             logger.info(f"Local catalog ready: {self.db_path}")
     
+    async def initialize(self):
+        """Load the in-memory columnar engine when CATALOG_ENGINE=memory"""
+        if settings.CATALOG_ENGINE != "memory" or self.engine is not None:
+            return
+        
+        self.engine = await executors.run_io(self._load_engine)
+    
+    def _load_engine(self) -> Optional[ColumnarCatalog]:
+        """Map the binary catalog if it is current, else load columns from SQLite"""
+        if self.db_path.exists():
+            # Baking colors into an older DB makes its binary copy stale (mtime)
+            conn = sqlite3.connect(self.db_path)
+            try:
+                self._ensure_color_column(conn)
+            finally:
+                conn.close()
+        
+        if self.binary_path.exists():
+            if self._binary_stale():
+                logger.warning(f"Binary catalog is older than {self.db_path}, loading from SQLite")
+            else:
+                try:
+                    # Read-only mapping: workers share the OS page cache
+                    engine = ColumnarCatalog.from_binary(self.binary_path)
+                    self._engine_mapped = True
+                    return engine
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Binary catalog unusable, loading from SQLite: {e}")
+        
+        if self.db_path.exists():
+            return ColumnarCatalog.from_sqlite(self.db_path, settings.STAR_COLOR_MODE)
+        
+        logger.warning("Columnar engine requested but catalog database is missing, using fallback")
+        return None
+    
+    async def _offload(self, engine_task, sqlite_task, *args) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Run a catalog scan in the CPU pool (services.catalog_tasks)
+        
+        engine_task scans a mapped binary catalog, sqlite_task the database.
+        Returns None when the scan has to run in this process instead: the
+        pool is disabled, the engine was loaded from SQLite, or the task failed.
+        """
+        if not executors.cpu_enabled:
+            return None
+        if self.engine is not None:
+            if not self._engine_mapped:
+                return None
+            task, source = engine_task, self.binary_path
+        elif self.db_path.exists():
+            task, source = sqlite_task, self.db_path
+        else:
+            return None
+        try:
+            return await executors.run_cpu_arrays(task, str(source), *args)
+        except Exception as e:
+            logger.warning(f"CPU pool query failed, running it in process: {e!r}")
+            return None
+    
+    def _offloaded_records(self, columns: Dict[str, np.ndarray]) -> List[Dict]:
+        """Star dictionaries for the columns an _offload() task returned"""
+        if self.engine is not None:
+            return self.engine.to_records(columns['idx'])
+        return catalog_records(columns)
+    
+    def _source_name(self) -> str:
+        return "columnar catalog" if self.engine is not None else "local catalog"
+    
+    def _binary_stale(self) -> bool:
+        """Whether the database changed after its binary copy was written"""
+        return (
+            self.db_path.exists()
+            and self.binary_path.stat().st_mtime < self.db_path.stat().st_mtime
+        )
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Connection for star queries (read-only for read_only services)"""
+        if self.read_only:
+            return sqlite3.connect(f"{self.db_path.resolve().as_uri()}?mode=ro", uri=True)
+        return sqlite3.connect(self.db_path)
+    
+    def prepare_shared_catalog(self):
+        """
+        One-time catalog preparation before API workers start (serve.py)
+        
+        Runs the in-place migrations of older databases once instead of in
+        every worker and, for CATALOG_ENGINE=memory, writes a current binary
+        copy (with LOD levels) so workers map one shared file rather than each
+        loading the database into its own memory.
+        """
+        if not self.db_path.exists():
+            return
+        
+        conn = sqlite3.connect(self.db_path)
+        try:
+            self._ensure_color_column(conn)
+            if self._ensure_healpix_index(conn):
+                self._ensure_lod_column(conn)
+            self._ensure_rtree_index(conn)
+        finally:
+            conn.close()
+        
+        if settings.CATALOG_ENGINE != "memory":
+            return
+        try:
+            if self.binary_path.exists() and not self._binary_stale():
+                if 'lod' in open_binary_catalog(self.binary_path):
+                    return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Binary catalog unusable, rewriting it: {e}")
+        try:
+            logger.info(f"Writing shared binary catalog: {self.binary_path}")
+            count = export_binary_catalog(self.db_path, self.binary_path, settings.STAR_COLOR_MODE)
+            # export_binary_catalog records a new content hash
+            self._catalog_version = None
+            logger.success(f"Shared binary catalog written: {count} stars")
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Binary catalog not written, each worker will load the database: {e}")
+    
+    def preload(self) -> int:
+        """
+        Bring the catalog into memory ahead of the first query (startup warmup)
+        
+        Pages in the columnar engine, or reads the database file once so the
+        OS page cache holds it. Returns the bytes read.
+        """
+        if self.engine is not None:
+            return self.engine.preload()
+        if not self.db_path.exists():
+            return 0
+        total = 0
+        with open(self.db_path, "rb") as fh:
+            while True:
+                chunk = fh.read(PRELOAD_CHUNK_BYTES)
+                if not chunk:
+                    return total
+                total += len(chunk)
+    
+    def catalog_version(self) -> str:
+        """
+        Identifier of the catalog contents, for HTTP validators
+        
+        The content hash recorded by download_gaia_catalog.py; catalogs
+        without one (and the JSON fallback) use their file size and mtime.
+        Fixed for the life of the process, like the loaded catalog.
+        """
+        if self._catalog_version is None:
+            version = None
+            source = self.db_path
+            if self.db_path.exists():
+                try:
+                    conn = sqlite3.connect(self.db_path)
+                    try:
+                        version = read_catalog_meta(conn).get('content_hash')
+                    finally:
+                        conn.close()
+                except sqlite3.Error as e:
+                    logger.warning(f"Catalog metadata unreadable: {e}")
+            else:
+                source = Path(__file__).resolve().parents[2] / "data" / "bright_catalog.json"
+            if version is None:
+                stat = source.stat() if source.exists() else None
+                version = f"{stat.st_size}-{stat.st_mtime_ns}" if stat else "empty"
+            self._catalog_version = version
+        return self._catalog_version
+    
+    @metrics.timed("catalog_query", "local")
     async def query_nearby_stars_async(
         self,
         camera_x: float,
@@ -57,12 +291,13 @@ class LocalCatalogService:
         Returns:
             List of star dictionaries
         """
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,
-            self._query_nearby_stars_sync,
-            camera_x, camera_y, camera_z, max_distance, max_stars, mag_limit
-        )
+        args = (camera_x, camera_y, camera_z, max_distance, max_stars, mag_limit)
+        columns = await self._offload(catalog_tasks.engine_nearby, catalog_tasks.sqlite_nearby, *args)
+        if columns is not None:
+            stars = self._offloaded_records(columns)
+            logger.info(f"Retrieved {len(stars)} stars from {self._source_name()} (camera distance < {max_distance:.1f} pc)")
+            return stars
+        return await executors.run_io(self._query_nearby_stars_sync, *args)
     
     def _query_nearby_stars_sync(
         self,
@@ -75,73 +310,20 @@ class LocalCatalogService:
     ) -> List[Dict]:
         """Synchronous nearby star query"""
         
+        if self.engine is not None:
+            stars = self.engine.to_records(self.engine.nearby_indices(
+                camera_x, camera_y, camera_z, max_distance, max_stars, mag_limit
+            ))
+            logger.info(f"Retrieved {len(stars)} stars from columnar catalog (camera distance < {max_distance:.1f} pc)")
+            return stars
+        
         if not self.db_path.exists():
             logger.error("Catalog database not found")
             return []
         
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            
-            # Calculate distance in SQL and filter
-            query = f"""
-            SELECT 
-                source_id,
-                ra, dec,
-                x, y, z,
-                parallax,
-                distance_pc,
-                magnitude,
-                bp_rp,
-                pmra, pmdec,
-                radial_velocity,
-                temperature,
-                SQRT(
-                    (x - ?) * (x - ?) + 
-                    (y - ?) * (y - ?) + 
-                    (z - ?) * (z - ?)
-                ) AS distance_from_camera
-            FROM stars
-            WHERE magnitude < ?
-            HAVING distance_from_camera < ?
-            ORDER BY distance_from_camera ASC, magnitude ASC
-            LIMIT ?
-            """
-            
-            cursor = conn.execute(
-                query,
-                (camera_x, camera_x, camera_y, camera_y, camera_z, camera_z,
-                 mag_limit, max_distance, max_stars)
-            )
-            
-            stars = []
-            for row in cursor:
-                # Convert bp_rp to RGB
-                bp_rp = row['bp_rp'] if row['bp_rp'] is not None else 0.0
-                rgb = self._bp_rp_to_rgb(bp_rp)
-                
-                star = {
-                    'source_id': str(row['source_id']),
-                    'ra': float(row['ra']),
-                    'dec': float(row['dec']),
-                    'x': float(row['x']),
-                    'y': float(row['y']),
-                    'z': float(row['z']),
-                    'parallax': float(row['parallax']) if row['parallax'] else None,
-                    'distance_pc': float(row['distance_pc']),
-                    'magnitude': float(row['magnitude']),
-                    'color_bp_rp': bp_rp,
-                    'r': rgb[0],
-                    'g': rgb[1],
-                    'b': rgb[2],
-                    'pm_ra': float(row['pmra']) if row['pmra'] else 0.0,
-                    'pm_dec': float(row['pmdec']) if row['pmdec'] else 0.0,
-                    'radial_velocity': float(row['radial_velocity']) if row['radial_velocity'] else None,
-                    'temperature': float(row['temperature']) if row['temperature'] else None,
-                }
-                stars.append(star)
-            
-            conn.close()
+            rows = self._select_nearby_rows(camera_x, camera_y, camera_z, max_distance, max_stars, mag_limit)
+            stars = [self._row_to_star(row) for row in rows]
             
             logger.info(f"Retrieved {len(stars)} stars from local catalog (camera distance < {max_distance:.1f} pc)")
             return stars
@@ -150,19 +332,70 @@ class LocalCatalogService:
             logger.error(f"Local catalog query failed: {e}")
             return []
     
+    def _select_nearby_rows(
+        self,
+        camera_x: float,
+        camera_y: float,
+        camera_z: float,
+        max_distance: float,
+        max_stars: int,
+        mag_limit: float
+    ) -> List[sqlite3.Row]:
+        """Rows within max_distance of the camera, nearest first, via the R*Tree"""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            # Squared distance from the camera; exact sphere test on top of the box prefilter
+            distance_sql = "(x - ?) * (x - ?) + (y - ?) * (y - ?) + (z - ?) * (z - ?)"
+            distance_params = [camera_x, camera_x, camera_y, camera_y, camera_z, camera_z]
+            columns = self._star_columns(conn)
+            
+            if self._ensure_rtree_index(conn):
+                # R*Tree returns only stars whose box overlaps the query cube
+                query = f"""
+                SELECT {columns},
+                    {distance_sql} AS distance_sq
+                FROM stars_rtree
+                JOIN stars ON stars.id = stars_rtree.id
+                WHERE stars_rtree.max_x >= ? AND stars_rtree.min_x <= ?
+                  AND stars_rtree.max_y >= ? AND stars_rtree.min_y <= ?
+                  AND stars_rtree.max_z >= ? AND stars_rtree.min_z <= ?
+                  AND +magnitude < ?
+                  AND distance_sq < ?
+                ORDER BY distance_sq ASC, magnitude ASC
+                LIMIT ?
+                """
+                params = distance_params + [
+                    camera_x - max_distance, camera_x + max_distance,
+                    camera_y - max_distance, camera_y + max_distance,
+                    camera_z - max_distance, camera_z + max_distance,
+                    mag_limit, max_distance * max_distance, max_stars
+                ]
+            else:
+                query = f"""
+                SELECT {columns},
+                    {distance_sql} AS distance_sq
+                FROM stars
+                WHERE magnitude < ?
+                  AND distance_sq < ?
+                ORDER BY distance_sq ASC, magnitude ASC
+                LIMIT ?
+                """
+                params = distance_params + [mag_limit, max_distance * max_distance, max_stars]
+            
+            return conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+    
+    @metrics.timed("catalog_query", "local")
     async def query_all_bright_stars_async(self, mag_limit: float = 6.5) -> List[Dict]:
         """Get all stars brighter than magnitude limit"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,
-            self._query_all_bright_stars_sync,
-            mag_limit
-        )
+        return await executors.run_io(self._query_all_bright_stars_sync, mag_limit)
     
     def _query_all_bright_stars_sync(self, mag_limit: float) -> List[Dict]:
         """Get all bright stars from catalog"""
         # If local SQLite DB is not present, fall back to the packaged bright_catalog.json
-        if not self.db_path.exists():
+        if self.engine is None and not self.db_path.exists():
             logger.error("Catalog database not found, falling back to data/bright_catalog.json if available")
             try:
                 # Resolve bright_catalog.json relative to the repository root so
@@ -209,7 +442,6 @@ class LocalCatalogService:
                         z = r * sin(dec_rad)
 
                     bp_rp = item.get("bp_rp") if item.get("bp_rp") is not None else 0.0
-                    rgb = self._bp_rp_to_rgb(bp_rp)
 
                     star = {
                         'source_id': str(item.get('source_id', '')),
@@ -222,9 +454,6 @@ class LocalCatalogService:
                         'distance_pc': float(distance_pc) if distance_pc else None,
                         'magnitude': float(mag),
                         'color_bp_rp': bp_rp,
-                        'r': rgb[0],
-                        'g': rgb[1],
-                        'b': rgb[2],
                         'pm_ra': float(item.get('pmra_mas_yr') or item.get('pmra') or 0.0),
                         'pm_dec': float(item.get('pmdec_mas_yr') or item.get('pmdec') or 0.0),
                         'radial_velocity': item.get('radial_velocity'),
@@ -232,79 +461,621 @@ class LocalCatalogService:
                     }
                     stars.append(star)
 
+                # One lookup for the whole list
+                rgb = rgb8_to_float(colors_for_mode(
+                    [star['color_bp_rp'] for star in stars],
+                    [star['temperature'] for star in stars],
+                    settings.STAR_COLOR_MODE
+                )).tolist()
+                for star, (r, g, b) in zip(stars, rgb):
+                    star['r'], star['g'], star['b'] = r, g, b
+
                 logger.success(f"Retrieved {len(stars)} bright stars from fallback JSON (mag < {mag_limit})")
                 return stars
             except Exception as e:
                 logger.error(f"Fallback bright catalog load failed: {e}")
                 return []
         
+        stars = self._bright_prefix(mag_limit)
+        logger.success(f"Retrieved {len(stars)} bright stars (mag < {mag_limit})")
+        return stars
+    
+    def _bright_prefix(self, mag_limit: float) -> List[Dict]:
+        """
+        Stars brighter than mag_limit as a prefix of one shared, magnitude-sorted buffer
+        
+        The buffer is loaded up to the next whole magnitude, so nearby limits
+        (7.0, 7.05, 7.1) are served by slicing instead of separate queries.
+        """
+        with self._bright_lock:
+            if self._bright_stars is None or mag_limit >= self._bright_limit:
+                load_limit = float(math.floor(mag_limit) + 1)
+                stars = self._load_bright_stars(load_limit)
+                if stars is None:
+                    return []
+                self._bright_stars = stars
+                self._bright_magnitudes = [star['magnitude'] for star in stars]
+                self._bright_limit = load_limit
+            
+            count = bisect_left(self._bright_magnitudes, mag_limit)
+            return self._bright_stars[:count]
+    
+    def _load_bright_stars(self, mag_limit: float) -> Optional[List[Dict]]:
+        """Read all stars brighter than mag_limit in magnitude order (None on failure)"""
+        if self.engine is not None:
+            return self.engine.to_records(self.engine.bright_indices(mag_limit))
+        
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             conn.row_factory = sqlite3.Row
             
-            query = """
-            SELECT *
-            FROM stars
-            WHERE magnitude < ?
-            ORDER BY magnitude ASC
-            """
+            columns = self._star_columns(conn)
+            prefix = self._magnitude_prefix_count(conn, mag_limit)
+            if prefix is not None:
+                # Rows are stored in magnitude order: a rowid range scan, no sort
+                query = f"""
+                SELECT {columns}
+                FROM stars
+                WHERE id <= ? AND +magnitude < ?
+                ORDER BY id ASC
+                """
+                params = (prefix, mag_limit)
+            else:
+                query = f"""
+                SELECT {columns}
+                FROM stars
+                WHERE magnitude < ?
+                ORDER BY magnitude ASC
+                """
+                params = (mag_limit,)
             
-            cursor = conn.execute(query, (mag_limit,))
+            cursor = conn.execute(query, params)
             
-            stars = []
-            for row in cursor:
-                bp_rp = row['bp_rp'] if row['bp_rp'] is not None else 0.0
-                rgb = self._bp_rp_to_rgb(bp_rp)
-                
-                star = {
-                    'source_id': str(row['source_id']),
-                    'ra': float(row['ra']),
-                    'dec': float(row['dec']),
-                    'x': float(row['x']),
-                    'y': float(row['y']),
-                    'z': float(row['z']),
-                    'parallax': float(row['parallax']) if row['parallax'] else None,
-                    'distance_pc': float(row['distance_pc']),
-                    'magnitude': float(row['magnitude']),
-                    'color_bp_rp': bp_rp,
-                    'r': rgb[0],
-                    'g': rgb[1],
-                    'b': rgb[2],
-                    'pm_ra': float(row['pmra']) if row['pmra'] else 0.0,
-                    'pm_dec': float(row['pmdec']) if row['pmdec'] else 0.0,
-                    'radial_velocity': float(row['radial_velocity']) if row['radial_velocity'] else None,
-                    'temperature': float(row['temperature']) if row['temperature'] else None,
-                }
-                stars.append(star)
+            stars = [self._row_to_star(row) for row in cursor]
             
             conn.close()
-            
-            logger.success(f"Retrieved {len(stars)} bright stars (mag < {mag_limit})")
             return stars
             
         except Exception as e:
             logger.error(f"Bright stars query failed: {e}")
+            return None
+    
+    @staticmethod
+    def _magnitude_prefix_count(conn: sqlite3.Connection, mag_limit: float) -> Optional[int]:
+        """
+        Upper bound on the number of leading rows brighter than mag_limit
+        
+        Uses the mag_offsets table written by the catalog builder; returns None
+        for catalogs that are not stored in magnitude order.
+        """
+        has_offsets = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'mag_offsets'"
+        ).fetchone()
+        if not has_offsets:
+            return None
+        
+        row = conn.execute(
+            "SELECT row_count FROM mag_offsets WHERE magnitude >= ? ORDER BY magnitude ASC LIMIT 1",
+            (mag_limit,)
+        ).fetchone()
+        if row is None:
+            # Limit is fainter than every star
+            row = conn.execute("SELECT MAX(row_count) FROM mag_offsets").fetchone()
+        return row[0]
+    
+    @metrics.timed("catalog_query", "local")
+    async def query_cone_async(
+        self,
+        ra: float,
+        dec: float,
+        radius_deg: float,
+        max_stars: int = 10000,
+        mag_limit: float = 12.0,
+        lod_level: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Query stars within an angular radius of a sky position (async wrapper)
+        
+        Args:
+            ra, dec: Cone center in degrees
+            radius_deg: Search radius in degrees
+            max_stars: Maximum stars to return (brightest first)
+            mag_limit: Faintest magnitude to include
+            lod_level: Only stars up to this LOD level (see catalog.lod; None = all)
+        
+        Returns:
+            List of star dictionaries
+        """
+        args = (ra, dec, radius_deg, max_stars, mag_limit, lod_level)
+        columns = await self._offload(catalog_tasks.engine_cone, catalog_tasks.sqlite_cone, *args)
+        if columns is not None:
+            stars = self._offloaded_records(columns)
+            logger.info(f"Retrieved {len(stars)} stars from {self._source_name()} cone (RA={ra:.2f}, Dec={dec:.2f}, R={radius_deg:.2f}°)")
+            return stars
+        return await executors.run_io(self._query_cone_sync, *args)
+    
+    def _query_cone_sync(
+        self,
+        ra: float,
+        dec: float,
+        radius_deg: float,
+        max_stars: int,
+        mag_limit: float,
+        lod_level: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Synchronous cone search backed by the HEALPix pixel index
+        
+        Candidate pixels covering the disc are turned into `hpx` range scans,
+        then an exact angular filter runs only on the rows those ranges return.
+        """
+        if self.engine is not None:
+            stars = self.engine.to_records(self.engine.cone_indices(
+                ra, dec, radius_deg, max_stars, mag_limit, lod_level
+            ))
+            logger.info(f"Retrieved {len(stars)} stars from columnar catalog cone (RA={ra:.2f}, Dec={dec:.2f}, R={radius_deg:.2f}°)")
+            return stars
+        
+        if not self.db_path.exists():
+            logger.error("Catalog database not found")
+            return []
+        
+        try:
+            rows = self._select_cone_rows(ra, dec, radius_deg, max_stars, mag_limit, lod_level)
+            stars = [self._row_to_star(row) for row in rows]
+            
+            logger.info(f"Retrieved {len(stars)} stars from local catalog cone (RA={ra:.2f}, Dec={dec:.2f}, R={radius_deg:.2f}°)")
+            return stars
+            
+        except Exception as e:
+            logger.error(f"Local cone query failed: {e}")
             return []
     
-    def _bp_rp_to_rgb(self, bp_rp: float) -> tuple:
-        """Convert BP-RP color to RGB (simple temperature-based mapping)"""
-        # BP-RP ranges from ~-0.5 (blue/hot) to ~4.0 (red/cool)
-        # Clamp and normalize
-        bp_rp = max(-0.5, min(4.0, bp_rp))
-        
-        # Map to temperature-like colors
-        if bp_rp < 0:  # Very blue (hot stars)
-            return (0.6, 0.7, 1.0)
-        elif bp_rp < 0.5:  # Blue-white
-            return (0.8, 0.9, 1.0)
-        elif bp_rp < 1.0:  # White
-            return (1.0, 1.0, 1.0)
-        elif bp_rp < 1.5:  # Yellow-white
-            return (1.0, 0.95, 0.7)
-        elif bp_rp < 2.5:  # Orange
-            return (1.0, 0.8, 0.5)
-        else:  # Red (cool stars)
-            return (1.0, 0.6, 0.4)
+    def _select_cone_rows(
+        self,
+        ra: float,
+        dec: float,
+        radius_deg: float,
+        max_stars: int,
+        mag_limit: float,
+        lod_level: Optional[int] = None
+    ) -> List[sqlite3.Row]:
+        """
+        Rows inside the cone, brightest first, via the HEALPix index
+        
+        Catalogs stored in magnitude order (with mag_offsets) are read as rowid
+        slices, brightest first, until max_stars stars survive, so a wide cone
+        reads about max_stars rows instead of every star it contains (see
+        _walk_cone_slices).
+        
+        Without the lod column (or without any index) the LOD filter runs
+        here: the query reads whole tiles of level lod_level, so ranking
+        their stars by magnitude reproduces the catalog's levels exactly.
+        """
+        # Levels past the pyramid keep every star
+        thin_level = lod_level if lod_level is not None and lod_level <= LOD_MAX_ORDER else None
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            columns = self._star_columns(conn)
+            prefix = self._magnitude_prefix_count(conn, mag_limit)
+            if self._ensure_healpix_index(conn):
+                order = order_for_radius(radius_deg)
+                lod_indexed = thin_level is not None and self._ensure_lod_column(conn)
+                if lod_indexed:
+                    thin_level = None
+                elif thin_level is not None:
+                    order = min(order, thin_level)
+                pixels = query_disc_nest(order, ra, dec, radius_deg)
+                ranges = pixel_ranges(order, pixels, HEALPIX_ORDER)
+                if not ranges:
+                    return []
+                
+                def range_sql(unary: str) -> str:
+                    term = f"({unary}hpx >= ? AND {unary}hpx < ?)"
+                    if lod_indexed:
+                        # One idx_lod_hpx lookup per level and range: only the kept stars are read
+                        levels = ", ".join(str(level) for level in range(lod_level + 1))
+                        term = f"({unary}lod IN ({levels}) AND {unary}hpx >= ? AND {unary}hpx < ?)"
+                    return " OR ".join([term] * len(ranges))
+                
+                params = [mag_limit] + [bound for r in ranges for bound in r]
+                # Unary + keeps the planner on idx_hpx instead of idx_magnitude
+                query = f"""
+                SELECT {columns}
+                FROM stars
+                WHERE +magnitude < ? AND ({range_sql("")})
+                """
+                # Slices scan rowid ranges; the cone terms only filter them
+                slice_query = f"""
+                SELECT {columns}
+                FROM stars
+                WHERE id > ? AND id <= ? AND +magnitude < ? AND ({range_sql("+")})
+                """
+                # Rows the HEALPix query reads (the covered share of the sky)
+                covered = sum(end - start for start, end in ranges) / (12 << (2 * HEALPIX_ORDER))
+            else:
+                # Index unavailable (e.g. read-only DB): exact filter over all rows,
+                # which also holds every star the LOD ranking needs
+                params = [mag_limit]
+                query = f"""
+                SELECT {columns}
+                FROM stars
+                WHERE magnitude < ?
+                """
+                slice_query = f"""
+                SELECT {columns}
+                FROM stars
+                WHERE id > ? AND id <= ? AND +magnitude < ?
+                """
+                covered = 1.0
+            
+            if prefix is None:
+                rows = conn.execute(query, params).fetchall()
+            else:
+                rows = self._walk_cone_slices(
+                    conn, query, slice_query, params, prefix, covered, max_stars,
+                    lambda rows: self._cone_survivors(rows, ra, dec, radius_deg, thin_level)
+                )
+        finally:
+            conn.close()
+        
+        if not rows:
+            return []
+        return [rows[i] for i in self._cone_survivors(rows, ra, dec, radius_deg, thin_level)[:max_stars]]
+    
+    @staticmethod
+    def _walk_cone_slices(
+        conn: sqlite3.Connection,
+        query: str,
+        slice_query: str,
+        params: List,
+        prefix: int,
+        covered: float,
+        max_stars: int,
+        survivors: Callable[[List[sqlite3.Row]], np.ndarray]
+    ) -> List[sqlite3.Row]:
+        """
+        Cone candidates read as rowid slices of the magnitude-ordered table
+        
+        Rows 1..prefix hold every star brighter than the limit, brightest
+        first, so once max_stars candidates of the slices read survive, no
+        fainter row can displace them. Slices start at the rows a uniform sky
+        would need for max_stars and double. When the slices would read more
+        rows than the HEALPix query (the covered share of prefix), the rest
+        comes from that query instead, so the walk costs at most twice the
+        plain query.
+        """
+        budget = max(covered * prefix, CONE_SLICE_MIN_ROWS)
+        window = max(int(max_stars / max(covered, 1e-9)), CONE_SLICE_MIN_ROWS)
+        rows: List[sqlite3.Row] = []
+        read = 0
+        while read < prefix:
+            if read + window > budget and covered < 1.0:
+                rows += conn.execute(f"{query} AND +id > ?", params + [read]).fetchall()
+                break
+            end = min(prefix, read + window)
+            rows += conn.execute(slice_query, [read, end] + params).fetchall()
+            read = end
+            if len(survivors(rows)) >= max_stars:
+                break
+            window *= 2
+        return rows
+    
+    @staticmethod
+    def _cone_survivors(
+        rows: List[sqlite3.Row],
+        ra: float,
+        dec: float,
+        radius_deg: float,
+        thin_level: Optional[int]
+    ) -> np.ndarray:
+        """Indices of the rows inside the cone (and kept at thin_level), brightest first"""
+        if not rows:
+            return np.zeros(0, dtype=np.int64)
+        ras = np.fromiter((row['ra'] for row in rows), dtype=np.float64, count=len(rows))
+        decs = np.fromiter((row['dec'] for row in rows), dtype=np.float64, count=len(rows))
+        mags = np.fromiter((row['magnitude'] for row in rows), dtype=np.float64, count=len(rows))
+        inside = angular_separation_mask(ras, decs, ra, dec, radius_deg)
+        if thin_level is not None:
+            by_magnitude = np.argsort(mags, kind="stable")
+            pixels = ang2pix_nest(HEALPIX_ORDER, ras[by_magnitude], decs[by_magnitude])
+            kept = np.zeros(len(rows), dtype=bool)
+            kept[by_magnitude] = thin_to_level(pixels, HEALPIX_ORDER, thin_level)
+            inside &= kept
+        inside = np.flatnonzero(inside)
+        return inside[np.argsort(mags[inside], kind="stable")]
+    
+    def iter_cone_batches(
+        self,
+        ra: float,
+        dec: float,
+        radius_deg: float,
+        max_stars: int = 10000,
+        mag_limit: float = 12.0,
+        batch_size: int = 1000,
+        lod_level: Optional[int] = None
+    ) -> Iterator[List[Dict]]:
+        """
+        Cone search yielding star dictionaries in batches
+        
+        Synchronous generator meant for StreamingResponse (which iterates it in
+        a worker thread); only one batch of dictionaries is alive at a time.
+        """
+        if self.engine is not None:
+            idx = self.engine.cone_indices(ra, dec, radius_deg, max_stars, mag_limit, lod_level)
+            for start in range(0, len(idx), batch_size):
+                yield self.engine.to_records(idx[start:start + batch_size])
+            return
+        
+        if not self.db_path.exists():
+            logger.error("Catalog database not found")
+            return
+        
+        rows = self._select_cone_rows(ra, dec, radius_deg, max_stars, mag_limit, lod_level)
+        for start in range(0, len(rows), batch_size):
+            yield [self._row_to_star(row) for row in rows[start:start + batch_size]]
+    
+    @metrics.timed("catalog_query", "local")
+    async def query_cone_packed_async(
+        self,
+        ra: float,
+        dec: float,
+        radius_deg: float,
+        max_stars: int = 10000,
+        mag_limit: float = 12.0,
+        lod_level: Optional[int] = None
+    ) -> bytes:
+        """Cone search returning the packed binary payload (see catalog.packed_format)"""
+        args = (ra, dec, radius_deg, max_stars, mag_limit, lod_level)
+        columns = await self._offload(catalog_tasks.engine_cone_packed, catalog_tasks.sqlite_cone_packed, *args)
+        if columns is not None:
+            return columns['payload'].tobytes()
+        return await executors.run_io(self._query_cone_packed_sync, *args)
+    
+    def _query_cone_packed_sync(
+        self,
+        ra: float,
+        dec: float,
+        radius_deg: float,
+        max_stars: int,
+        mag_limit: float,
+        lod_level: Optional[int] = None
+    ) -> bytes:
+        """Pack straight from the columnar engine, or from the SQLite star dicts"""
+        if self.engine is not None:
+            return self.engine.to_packed(self.engine.cone_indices(
+                ra, dec, radius_deg, max_stars, mag_limit, lod_level
+            ))
+        return pack_star_records(self._query_cone_sync(ra, dec, radius_deg, max_stars, mag_limit, lod_level))
+    
+    @metrics.timed("catalog_query", "local")
+    async def query_all_bright_stars_packed_async(self, mag_limit: float = 6.5) -> bytes:
+        """Bright star catalog as a packed binary payload"""
+        return await executors.run_io(self._query_all_bright_stars_packed_sync, mag_limit)
+    
+    def _query_all_bright_stars_packed_sync(self, mag_limit: float) -> bytes:
+        """Pack straight from the columnar engine, or from the shared bright buffer"""
+        if self.engine is not None:
+            return self.engine.to_packed(self.engine.bright_indices(mag_limit))
+        return pack_star_records(self._query_all_bright_stars_sync(mag_limit))
+    
+    def _ensure_healpix_index(self, conn: sqlite3.Connection) -> bool:
+        """
+        Make sure the stars table has a populated, indexed `hpx` column
+        
+        Catalogs built by download_gaia_catalog.py already carry it; older
+        databases are migrated in place once. Returns False if the column is
+        missing and the database cannot be written.
+        """
+        if self._healpix_ready:
+            return True
+        if self.read_only:
+            self._healpix_ready = self._schema_has(conn, "hpx", "idx_hpx")
+            return self._healpix_ready
+        
+        with self._index_lock:
+            if self._healpix_ready:
+                return True
+            
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(stars)")}
+            try:
+                if "hpx" not in columns:
+                    logger.info(f"Building HEALPix index (order {HEALPIX_ORDER}) for {self.db_path}...")
+                    conn.execute("ALTER TABLE stars ADD COLUMN hpx INTEGER")
+                
+                missing = conn.execute("SELECT id, ra, dec FROM stars WHERE hpx IS NULL").fetchall()
+                if missing:
+                    ids = [row[0] for row in missing]
+                    pixels = ang2pix_nest(
+                        HEALPIX_ORDER,
+                        np.array([row[1] for row in missing], dtype=np.float64),
+                        np.array([row[2] for row in missing], dtype=np.float64)
+                    )
+                    conn.executemany(
+                        "UPDATE stars SET hpx = ? WHERE id = ?",
+                        zip(pixels.tolist(), ids)
+                    )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_hpx ON stars(hpx)")
+                conn.commit()
+                if missing:
+                    logger.success(f"HEALPix index built for {len(missing)} stars")
+            except sqlite3.Error as e:
+                conn.rollback()
+                logger.warning(f"HEALPix index unavailable, cone search will scan: {e}")
+                return False
+            
+            self._healpix_ready = True
+            return True
+    
+    def _ensure_rtree_index(self, conn: sqlite3.Connection) -> bool:
+        """
+        Make sure the `stars_rtree` R*Tree over x/y/z exists and is populated
+        
+        Returns False when SPATIAL_INDEX_ENABLED is off, SQLite lacks the rtree
+        module, or the database is read-only; callers then fall back to a scan.
+        """
+        if self._rtree_ready:
+            return True
+        if not settings.SPATIAL_INDEX_ENABLED:
+            return False
+        if self.read_only:
+            self._rtree_ready = self._schema_has(conn, None, "stars_rtree")
+            return self._rtree_ready
+        
+        with self._index_lock:
+            if self._rtree_ready:
+                return True
+            
+            try:
+                exists = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stars_rtree'"
+                ).fetchone()
+                if not exists:
+                    logger.info(f"Building R*Tree spatial index for {self.db_path}...")
+                    conn.execute(
+                        "CREATE VIRTUAL TABLE stars_rtree USING rtree(id, min_x, max_x, min_y, max_y, min_z, max_z)"
+                    )
+                    conn.execute(
+                        "INSERT INTO stars_rtree SELECT id, x, x, y, y, z, z FROM stars"
+                    )
+                    conn.commit()
+                    logger.success("R*Tree spatial index built")
+            except sqlite3.Error as e:
+                conn.rollback()
+                logger.warning(f"R*Tree index unavailable, nearby queries will scan: {e}")
+                return False
+            
+            self._rtree_ready = True
+            return True
+    
+    def _ensure_lod_column(self, conn: sqlite3.Connection) -> bool:
+        """
+        Make sure the stars table has a populated `lod` column and idx_lod_hpx
+        
+        Catalogs built by download_gaia_catalog.py already carry them; older
+        databases are leveled in place once (needs the hpx column). Returns
+        False if the database cannot be written; LOD queries then read every
+        star in the cone.
+        """
+        if self._lod_ready:
+            return True
+        if self.read_only:
+            self._lod_ready = self._schema_has(conn, "lod", "idx_lod_hpx")
+            return self._lod_ready
+        
+        with self._index_lock:
+            if self._lod_ready:
+                return True
+            
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(stars)")}
+            try:
+                if "lod" not in columns:
+                    logger.info(f"Building LOD levels for {self.db_path}...")
+                    conn.execute("ALTER TABLE stars ADD COLUMN lod INTEGER")
+                if conn.execute("SELECT 1 FROM stars WHERE lod IS NULL LIMIT 1").fetchone():
+                    written = update_lod_column(conn, HEALPIX_ORDER)
+                    logger.success(f"LOD levels built for {written} stars")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_lod_hpx ON stars(lod, hpx)")
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                logger.warning(f"LOD index unavailable, LOD queries will read whole cones: {e}")
+                return False
+            
+            self._lod_ready = True
+            return True
+    
+    def _star_columns(self, conn: sqlite3.Connection) -> str:
+        """STAR_COLUMNS plus the baked color column (NULL when unavailable)"""
+        rgb = "rgb" if self._ensure_color_column(conn) else "NULL AS rgb"
+        return f"{STAR_COLUMNS},\n                {rgb}"
+    
+    def _ensure_color_column(self, conn: sqlite3.Connection) -> bool:
+        """
+        Make sure the stars table has a populated `rgb` column (packed 0xRRGGBB)
+        
+        Catalogs built by download_gaia_catalog.py already carry it; older
+        databases are colored in place once with STAR_COLOR_MODE. Returns False
+        if the column is missing and the database cannot be written.
+        """
+        if self._color_ready:
+            return True
+        if self.read_only:
+            # Rows still without colors are colored per query by _row_to_star
+            self._color_ready = self._schema_has(conn, "rgb")
+            return self._color_ready
+        
+        with self._index_lock:
+            if self._color_ready:
+                return True
+            
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(stars)")}
+            try:
+                if "rgb" not in columns:
+                    logger.info(f"Baking star colors ({settings.STAR_COLOR_MODE}) into {self.db_path}...")
+                    conn.execute("ALTER TABLE stars ADD COLUMN rgb INTEGER")
+                
+                missing = conn.execute("SELECT id, bp_rp, temperature FROM stars WHERE rgb IS NULL").fetchall()
+                for start in range(0, len(missing), COLOR_BACKFILL_BATCH):
+                    batch = missing[start:start + COLOR_BACKFILL_BATCH]
+                    packed = pack_rgb8(colors_for_mode(
+                        np.array([row[1] for row in batch], dtype=np.float64),
+                        np.array([row[2] for row in batch], dtype=np.float64),
+                        settings.STAR_COLOR_MODE
+                    ))
+                    conn.executemany(
+                        "UPDATE stars SET rgb = ? WHERE id = ?",
+                        zip(packed.tolist(), (row[0] for row in batch))
+                    )
+                conn.commit()
+                if missing:
+                    logger.success(f"Colors baked for {len(missing)} stars")
+            except sqlite3.Error as e:
+                conn.rollback()
+                logger.warning(f"Star colors will be computed per query: {e}")
+                return "rgb" in columns
+            
+            self._color_ready = True
+            return True
+    
+    @staticmethod
+    def _schema_has(conn: sqlite3.Connection, column: Optional[str], name: Optional[str] = None) -> bool:
+        """Whether a migration has run: the stars column and the index (or table) exist"""
+        if column is not None and column not in {row[1] for row in conn.execute("PRAGMA table_info(stars)")}:
+            return False
+        if name is None:
+            return True
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+    
+    def _row_to_star(self, row: sqlite3.Row) -> Dict:
+        """Convert a stars table row into the API star dictionary"""
+        bp_rp = row['bp_rp'] if row['bp_rp'] is not None else 0.0
+        packed = row['rgb']
+        if packed is None:
+            # Catalog without baked colors that could not be migrated
+            packed = int(pack_rgb8(colors_for_mode([bp_rp], [row['temperature']], settings.STAR_COLOR_MODE))[0])
+        rgb = packed_to_float(packed)
+        
+        return {
+            'source_id': str(row['source_id']),
+            'ra': float(row['ra']),
+            'dec': float(row['dec']),
+            'x': float(row['x']),
+            'y': float(row['y']),
+            'z': float(row['z']),
+            'parallax': float(row['parallax']) if row['parallax'] else None,
+            'distance_pc': float(row['distance_pc']),
+            'magnitude': float(row['magnitude']),
+            'color_bp_rp': bp_rp,
+            'r': rgb[0],
+            'g': rgb[1],
+            'b': rgb[2],
+            'pm_ra': float(row['pmra']) if row['pmra'] else 0.0,
+            'pm_dec': float(row['pmdec']) if row['pmdec'] else 0.0,
+            'radial_velocity': float(row['radial_velocity']) if row['radial_velocity'] else None,
+            'temperature': float(row['temperature']) if row['temperature'] else None,
+        }
 
 
 # Global instance
@@ -0,0 +1,417 @@
+"""
+In-process metrics, served in the Prometheus text format by GET /metrics
+Latency histograms for each stage of a request - cache lookups (memory and
+SQLite), local catalog queries, Gaia TAP queries, row-to-dict conversion,
+response serialization and compression - labelled by API endpoint and
+backend, next to per-endpoint request latency, response sizes and cache
+lookups. Service gauges and counters (in-flight queries, executor queue
+depth, ...) are registered with collect() and read when scraped.
+
+Recording a sample is a dictionary update in this process: no I/O and no
+external service. Under serve.py each worker also writes a snapshot to
+METRICS_SHARED_DIR every METRICS_FLUSH_SECONDS and /metrics merges them, so
+a scrape covers every worker whichever one answers it.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+
+from loguru import logger
+from starlette.routing import Match
+
+from config import settings
+from services.executors import executors
+
+
+PREFIX = "space_api_"
+CONTENT_TYPE = "text/plain; version=0.0.4"  # Starlette appends the charset
+
+# Histogram buckets: seconds, and response body bytes
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+# Route template of the request being handled (set by MetricsMiddleware)
+current_endpoint: ContextVar[str] = ContextVar("metrics_endpoint", default="background")
+
+# Set by the startup warmup around its requests: their stage timings are
+# labelled endpoint="warmup" and they are left out of the request metrics
+warmup_traffic: ContextVar[bool] = ContextVar("metrics_warmup", default=False)
+WARMUP_ENDPOINT = "warmup"
+
+Labels = Tuple[str, ...]
+T = TypeVar("T")
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_set(names: Tuple[str, ...], values: Labels, le: Optional[str] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonic counter per label set"""
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def samples(self) -> Dict[Labels, Any]:
+        return dict(self.values)
+
+    def render(self, samples: Dict[Labels, Any], lines: List[str]):
+        for labels, value in sorted(samples.items()):
+            lines.append(f"{PREFIX}{self.name}{_label_set(self.labelnames, labels)} {_number(value)}")
+
+
+class Histogram(Counter):
+    """Bucketed observations per label set: [bucket counts..., +Inf count, sum, count]"""
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...], buckets: Tuple[float, ...]):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+        self.values: Dict[Labels, List[float]] = {}
+
+    def observe(self, labels: Labels, value: float):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0.0] * (len(self.buckets) + 3)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def samples(self) -> Dict[Labels, Any]:
+        return {labels: list(series) for labels, series in self.values.items()}
+
+    def render(self, samples: Dict[Labels, Any], lines: List[str]):
+        name = PREFIX + self.name
+        for labels, series in sorted(samples.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                lines.append(f"{name}_bucket{_label_set(self.labelnames, labels, le)} {_number(cumulative)}")
+            lines.append(f"{name}_sum{_label_set(self.labelnames, labels)} {_number(series[-2])}")
+            lines.append(f"{name}_count{_label_set(self.labelnames, labels)} {_number(series[-1])}")
+
+
+class Collected(Counter):
+    """Gauge or counter read from a service when scraped"""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...],
+        type: str,
+        collect: Callable[[], Dict[Labels, float]]
+    ):
+        super().__init__(name, help, labelnames)
+        self.type = type
+        self.collect = collect
+
+    def samples(self) -> Dict[Labels, Any]:
+        try:
+            return {labels: float(value) for labels, value in self.collect().items()}
+        except Exception as e:
+            logger.warning(f"Metric {self.name} not collected: {e!r}")
+            return {}
+
+
+def _merge(into: Dict[Labels, Any], samples: Dict[Labels, Any]):
+    for labels, value in samples.items():
+        current = into.get(labels)
+        if current is None:
+            into[labels] = list(value) if isinstance(value, list) else value
+        elif isinstance(value, list):
+            into[labels] = [a + b for a, b in zip(current, value)]
+        else:
+            into[labels] = current + value
+
+
+class Metrics:
+    """Metric registry, stage timers and the Prometheus rendering"""
+
+    def __init__(self, enabled: bool = True, shared_dir: Optional[Path] = None, flush_seconds: float = 5.0):
+        """
+        Args:
+            enabled: Record samples (METRICS_ENABLED)
+            shared_dir: Directory where worker processes exchange snapshots (None = this process only)
+            flush_seconds: How often this process writes its snapshot to shared_dir
+        """
+        self.enabled = enabled
+        self.shared_dir = shared_dir
+        self.flush_seconds = flush_seconds
+        self.requests_in_flight = 0
+        self._metrics: List[Counter] = []
+        # Requests are recorded on the event loop, NDJSON streams from threadpool threads
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self.stage_seconds = self.add(Histogram(
+            "stage_seconds",
+            "Time spent in each stage of a request (stage: cache_lookup, catalog_query, gaia_tap, "
+            "to_dicts, serialization, compression; backend: memory, sqlite, local, remote)",
+            ("endpoint", "stage", "backend"),
+            LATENCY_BUCKETS
+        ))
+        self.request_seconds = self.add(Histogram(
+            "request_seconds",
+            "HTTP request latency until the last body byte is sent",
+            ("endpoint", "method", "status"),
+            LATENCY_BUCKETS
+        ))
+        self.response_bytes = self.add(Histogram(
+            "response_bytes",
+            "HTTP response body size as sent (after compression)",
+            ("endpoint",),
+            SIZE_BUCKETS
+        ))
+        self.cache_lookups = self.add(Counter(
+            "cache_lookups_total",
+            "Query cache lookups by result (memory_hit, sqlite_hit, miss)",
+            ("endpoint", "result")
+        ))
+        self.collect("requests_in_flight", "HTTP requests being handled", (), "gauge",
+                     lambda: {(): self.requests_in_flight})
+
+    def add(self, metric: Counter) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def collect(self, name: str, help: str, labelnames: Tuple[str, ...], type: str, collect: Callable[[], Dict[Labels, float]]):
+        """Export a service's own gauge ("gauge") or counter ("counter"), read when scraped"""
+        self.add(Collected(name, help, labelnames, type, collect))
+
+    # Recording
+
+    def observe_stage(self, stage: str, backend: str, seconds: float, endpoint: Optional[str] = None):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.stage_seconds.observe((endpoint or current_endpoint.get(), stage, backend), seconds)
+
+    @contextmanager
+    def stage(self, stage: str, backend: str) -> Iterator[None]:
+        """Time the enclosed block as one stage of the current request"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, backend, time.perf_counter() - start)
+
+    def timed(self, stage: str, backend: str):
+        """Decorator timing each call of an async function as a stage"""
+        def decorate(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with self.stage(stage, backend):
+                    return await fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def timed_batches(self, batches: Iterable[T], stage: str, backend: str) -> Iterator[T]:
+        """Iterate batches, recording the time spent producing them as one stage sample"""
+        endpoint = current_endpoint.get()
+        iterator = iter(batches)
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    batch = next(iterator)
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield batch
+        except StopIteration:
+            return
+        finally:
+            self.observe_stage(stage, backend, elapsed, endpoint)
+
+    def cache_lookup(self, result: str, count: int = 1):
+        """Count query cache lookups of the current request (memory_hit, sqlite_hit or miss)"""
+        if not self.enabled or not count:
+            return
+        with self._lock:
+            self.cache_lookups.inc((current_endpoint.get(), result), count)
+
+    def observe_request(self, endpoint: str, method: str, status: str, seconds: float, size: int):
+        with self._lock:
+            self.request_seconds.observe((endpoint, method, status), seconds)
+            self.response_bytes.observe((endpoint,), size)
+
+    # Snapshots shared between worker processes
+
+    def _snapshot(self) -> Dict[str, Dict[Labels, Any]]:
+        with self._lock:
+            return {metric.name: metric.samples() for metric in self._metrics}
+
+    def flush(self):
+        """Write this process's snapshot for the other workers (blocking)"""
+        self.shared_dir.mkdir(parents=True, exist_ok=True)
+        path = self.shared_dir / f"{os.getpid()}.json"
+        snapshot = {
+            name: [[list(labels), value] for labels, value in samples.items()]
+            for name, samples in self._snapshot().items()
+        }
+        temporary = path.with_suffix(".tmp")
+        temporary.write_text(json.dumps({"time": time.time(), "metrics": snapshot}))
+        os.replace(temporary, path)
+
+    def _load_shared(self) -> List[Tuple[float, Dict[str, Dict[Labels, Any]]]]:
+        """(time, snapshot) written by every other worker"""
+        snapshots = []
+        own = f"{os.getpid()}.json"
+        for path in self.shared_dir.glob("*.json"):
+            if path.name == own:
+                continue
+            try:
+                data = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            snapshots.append((data["time"], {
+                name: {tuple(labels): value for labels, value in samples}
+                for name, samples in data["metrics"].items()
+            }))
+        return snapshots
+
+    def start(self):
+        """Start writing snapshots (workers of serve.py only)"""
+        if self.enabled and self.shared_dir is not None and self._task is None:
+            self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # Keep this worker's final counts in the totals
+        await executors.run_io(self.flush)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await executors.run_io(self.flush)
+            except OSError as e:
+                logger.warning(f"Metrics snapshot not written: {e}")
+
+    # Rendering
+
+    async def render(self) -> str:
+        """All metrics in the Prometheus text format (every worker's under serve.py)"""
+        merged = self._snapshot()
+        if self.shared_dir is not None:
+            # Gauges of workers that stopped writing snapshots are no longer current
+            fresh_after = time.time() - 3 * self.flush_seconds
+            types = {metric.name: metric.type for metric in self._metrics}
+            for written, snapshot in await executors.run_io(self._load_shared):
+                for name, samples in snapshot.items():
+                    if name in merged and (types[name] != "gauge" or written >= fresh_after):
+                        _merge(merged[name], samples)
+
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {PREFIX}{metric.name} {metric.help}")
+            lines.append(f"# TYPE {PREFIX}{metric.name} {metric.type}")
+            metric.render(merged[metric.name], lines)
+
+        # Hit ratio per endpoint, from the merged lookup counters
+        lookups: Dict[str, List[float]] = {}
+        for (endpoint, result), count in merged[self.cache_lookups.name].items():
+            totals = lookups.setdefault(endpoint, [0.0, 0.0])
+            totals[1] += count
+            if result != "miss":
+                totals[0] += count
+        lines.append(f"# HELP {PREFIX}cache_hit_ratio Share of query cache lookups answered from memory or SQLite")
+        lines.append(f"# TYPE {PREFIX}cache_hit_ratio gauge")
+        for endpoint, (hits, total) in sorted(lookups.items()):
+            lines.append(f"{PREFIX}cache_hit_ratio{_label_set(('endpoint',), (endpoint,))} {_number(hits / total if total else 0.0)}")
+        return "\n".join(lines) + "\n"
+
+
+def route_template(scope: Dict[str, Any]) -> str:
+    """Path template of the route (or mount) a request goes to, e.g. /api/stars/region"""
+    router = getattr(scope.get("app"), "router", None)
+    for route in getattr(router, "routes", ()):
+        match, _ = route.matches(scope)
+        if match != Match.NONE:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware: request latency and response size, and the endpoint label of stage timings"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        warmup = warmup_traffic.get()
+        endpoint = WARMUP_ENDPOINT if warmup else route_template(scope)
+        token = current_endpoint.set(endpoint)
+        start = time.perf_counter()
+        status = "500"
+        size = 0
+
+        async def send_counted(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        if warmup:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                current_endpoint.reset(token)
+            return
+
+        metrics.requests_in_flight += 1
+        try:
+            await self.app(scope, receive, send_counted)
+        finally:
+            metrics.requests_in_flight -= 1
+            current_endpoint.reset(token)
+            metrics.observe_request(endpoint, scope["method"], status, time.perf_counter() - start, size)
+
+
+# Global registry
+metrics = Metrics(
+    enabled=settings.METRICS_ENABLED,
+    shared_dir=Path(settings.METRICS_SHARED_DIR) if settings.METRICS_MULTIPROCESS and settings.METRICS_SHARED_DIR else None,
+    flush_seconds=settings.METRICS_FLUSH_SECONDS
+)
@@ -0,0 +1,69 @@
+"""
+Single-flight request coalescing
+Concurrent identical queries share one in-flight computation instead of each
+running its own (e.g. a burst of viewers loading the bright catalog after a
+deploy or a cache flush)
+"""
+from typing import Any, Awaitable, Callable, Dict
+import asyncio
+from loguru import logger
+
+
+class SingleFlight:
+    """Registry of in-flight queries keyed by cache key"""
+
+    def __init__(self):
+        self.calls: Dict[str, asyncio.Task] = {}
+        # Callers currently awaiting each task
+        self.waiters: Dict[asyncio.Task, int] = {}
+        # Requests that joined an existing flight instead of querying
+        self.coalesced = 0
+
+    async def do(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run compute() once per key at a time and share its result
+
+        The computation runs as its own task, so a caller that disconnects
+        (and is cancelled) does not cancel it for the callers still waiting;
+        it is cancelled once every caller has gone. Errors are propagated to
+        every waiter.
+        """
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+            logger.debug(f"Joined in-flight query: {key[:32]}...")
+        self.waiters[task] = self.waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self.waiters[task] -= 1
+            if not self.waiters[task]:
+                del self.waiters[task]
+                if not task.done():
+                    logger.debug(f"Cancelling abandoned query: {key[:32]}...")
+                    task.cancel()
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        # Mark the exception retrieved in case every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.calls)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'in_flight': self.in_flight,
+            'coalesced': self.coalesced
+        }
+
+
+# Global registry shared by all route handlers
+single_flight = SingleFlight()
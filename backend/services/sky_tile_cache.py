@@ -0,0 +1,238 @@
+"""
+HEALPix tile cache for cone and frustum queries
+Results are cached per fixed sky tile (HEALPix pixel x magnitude band), so
+users looking in nearly the same direction share entries. A request is
+answered by assembling the covering tiles, fetching only the missing ones,
+and trimming the union to the exact cone.
+
+A fetch the source caps at max_rows is cached too: each of its tiles is
+stored as {"cutoff": magnitude, "stars": [...]}, complete only for stars
+brighter than the cutoff, so wide cones query the source once per tile
+rather than on every request.
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import hashlib
+
+import numpy as np
+from loguru import logger
+
+from catalog.healpix import angular_separation_mask, order_for_radius, query_disc_nest
+from catalog.lod import thin_to_level
+from services.cache_service import cache_service
+from services.single_flight import single_flight
+from services.gaia_service import gaia_service
+from config import settings
+
+
+# Faint edges of the magnitude bands; band 0 is everything brighter than the
+# first edge and the last band everything fainter than the last edge
+SKY_TILE_MAG_EDGES = (6.0, 8.0, 10.0, 11.0, 12.0, 13.0, 14.0, 15.0, 16.0, 17.0, 18.0, 19.0, 20.0, 21.0)
+
+# Finest tile order used; small cones share tiles at this order
+SKY_TILE_MAX_ORDER = 8
+
+# Padding for the tile cover, for sources whose tile assignment comes from a
+# slightly different position than the returned ra/dec (Gaia source_id)
+SKY_TILE_MARGIN_DEG = 1.0 / 60.0
+
+
+def band_limits(band: int) -> Tuple[Optional[float], Optional[float]]:
+    """Half-open magnitude range [bright, faint) of a band (None = unbounded)"""
+    bright = SKY_TILE_MAG_EDGES[band - 1] if band > 0 else None
+    faint = SKY_TILE_MAG_EDGES[band] if band < len(SKY_TILE_MAG_EDGES) else None
+    return bright, faint
+
+
+def tile_order(radius_deg: float) -> int:
+    """Tile order for a cone radius (coarser tiles for wider cones)"""
+    return order_for_radius(radius_deg, SKY_TILE_MAX_ORDER)
+
+
+class SkyTileCache:
+    """
+    Tile-assembled cone queries over one star source
+
+    The source provides
+        fetch(order, pixels, mag_min, mag_max, max_rows) -> stars sorted by magnitude
+        pixel_of(stars, order) -> tile index of each star
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fetch: Callable[[int, List[int], Optional[float], Optional[float], int], Awaitable[List[Dict]]],
+        pixel_of: Callable[[List[Dict], int], np.ndarray],
+        max_rows: int
+    ):
+        self.name = name
+        self.fetch = fetch
+        self.pixel_of = pixel_of
+        self.max_rows = max_rows
+        # Tiles served from cache vs fetched from the source
+        self.tile_hits = 0
+        self.tile_fetches = 0
+
+    def _tile_key(self, order: int, pix: int, band: int) -> Dict[str, Any]:
+        return {"type": "sky_tile", "source": self.name, "order": order, "pix": pix, "band": band}
+
+    async def query_cone(
+        self,
+        ra: float,
+        dec: float,
+        radius_deg: float,
+        max_stars: int,
+        mag_limit: float,
+        lod_level: Optional[int] = None
+    ) -> Tuple[List[Dict], bool]:
+        """
+        Brightest max_stars stars within the cone that are brighter than mag_limit
+
+        Bands are assembled brightest first and the walk stops once enough
+        stars are collected, since fainter bands cannot displace them. With
+        lod_level, the stars are thinned to the brightest LOD_TILE_STARS per
+        tile of that order (see catalog.lod) as each band arrives, so only
+        stars that survive thinning count toward max_stars. As in the local
+        pyramid, whole level tiles are ranked before the cone is cut: tiles
+        are fetched no finer than lod_level, so each covers whole level
+        tiles, and a star on the cone's edge keeps the rank it has among
+        every star of its level tile (fainter than mag_limit excepted, which
+        cannot outrank it).
+
+        Returns:
+            (stars sorted by magnitude, True if every tile came from cache)
+        """
+        order = tile_order(radius_deg)
+        if lod_level is not None:
+            order = min(order, lod_level)
+        pixels = query_disc_nest(order, ra, dec, radius_deg + SKY_TILE_MARGIN_DEG).tolist()
+
+        selected: List[Dict] = []
+        # Every star of the covering tiles in magnitude order, ranked for LOD thinning
+        ranked: List[Dict] = []
+        all_cached = True
+        for band in range(len(SKY_TILE_MAG_EDGES) + 1):
+            bright, _ = band_limits(band)
+            if bright is not None and bright >= mag_limit:
+                break
+
+            stars, cached, cutoff = await self._band_stars(order, pixels, band)
+            all_cached &= cached
+            limit = mag_limit if cutoff is None else min(mag_limit, cutoff)
+            # Bands are disjoint magnitude ranges, so sorting each keeps the whole list sorted
+            if lod_level is None:
+                band_stars = self._trim(stars, ra, dec, radius_deg, limit)
+                band_stars.sort(key=lambda star: star['magnitude'])
+                selected.extend(band_stars)
+            else:
+                ranked.extend(sorted(
+                    (star for star in stars if star['magnitude'] < limit),
+                    key=lambda star: star['magnitude']
+                ))
+                keep = thin_to_level(self.pixel_of(ranked, lod_level), lod_level, lod_level)
+                selected = self._trim(
+                    [star for star, kept in zip(ranked, keep.tolist()) if kept],
+                    ra, dec, radius_deg, limit
+                )
+
+            if cutoff is not None:
+                # The source capped this band; stars past the cutoff may be missing
+                logger.warning(f"Sky tile band {band} truncated at mag {cutoff:.2f} ({self.name})")
+                break
+            if len(selected) >= max_stars:
+                break
+
+        return selected[:max_stars], all_cached
+
+    @staticmethod
+    def _trim(stars: List[Dict], ra: float, dec: float, radius_deg: float, mag_limit: float) -> List[Dict]:
+        """Stars inside the exact cone and brighter than mag_limit"""
+        if not stars:
+            return []
+        mask = angular_separation_mask(
+            [star['ra'] for star in stars],
+            [star['dec'] for star in stars],
+            ra, dec, radius_deg
+        )
+        mask &= np.array([star['magnitude'] for star in stars]) < mag_limit
+        return [star for star, keep in zip(stars, mask.tolist()) if keep]
+
+    async def _band_stars(
+        self,
+        order: int,
+        pixels: List[int],
+        band: int
+    ) -> Tuple[List[Dict], bool, Optional[float]]:
+        """
+        Stars of one band across the tiles
+
+        Returns (stars, all tiles cached, truncation cutoff magnitude or None)
+        """
+        stars: List[Dict] = []
+        missing: List[int] = []
+        cutoff: Optional[float] = None
+        tiles = await cache_service.get_many([self._tile_key(order, pix, band) for pix in pixels])
+        for pix, tile in zip(pixels, tiles):
+            if tile is None:
+                missing.append(pix)
+            elif isinstance(tile, dict):
+                # Truncated tile: complete only below its cutoff
+                stars.extend(tile["stars"])
+                cutoff = tile["cutoff"] if cutoff is None else min(cutoff, tile["cutoff"])
+            else:
+                stars.extend(tile)
+        self.tile_hits += len(pixels) - len(missing)
+
+        if not missing:
+            return stars, True, cutoff
+
+        # Concurrent requests missing the same tiles share one fetch
+        digest = hashlib.sha1(",".join(map(str, missing)).encode()).hexdigest()
+        fetched, fetch_cutoff = await single_flight.do(
+            f"sky_tile:{self.name}:{order}:{band}:{digest}",
+            lambda: self._fetch_tiles(order, missing, band)
+        )
+        stars.extend(fetched)
+        if fetch_cutoff is not None:
+            cutoff = fetch_cutoff if cutoff is None else min(cutoff, fetch_cutoff)
+        return stars, False, cutoff
+
+    async def _fetch_tiles(self, order: int, pixels: List[int], band: int) -> Tuple[List[Dict], Optional[float]]:
+        """
+        Fetch one band for a set of tiles and cache each tile (empty ones too)
+
+        Returns (stars, None) or, when the source capped the result, the
+        stars brighter than the cutoff magnitude and that cutoff. Stars at
+        the cutoff itself may be incomplete, so they are left out.
+        """
+        bright, faint = band_limits(band)
+        stars = await self.fetch(order, pixels, bright, faint, self.max_rows)
+        self.tile_fetches += len(pixels)
+
+        cutoff = None
+        if len(stars) >= self.max_rows:
+            cutoff = stars[-1]['magnitude']
+            stars = [star for star in stars if star['magnitude'] < cutoff]
+
+        tiles: Dict[int, List[Dict]] = {pix: [] for pix in pixels}
+        for star, pix in zip(stars, self.pixel_of(stars, order).tolist()):
+            if pix in tiles:
+                tiles[pix].append(star)
+        for pix, tile in tiles.items():
+            value = tile if cutoff is None else {"cutoff": cutoff, "stars": tile}
+            await cache_service.set(self._tile_key(order, pix, band), value)
+        return stars, cutoff
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'tile_hits': self.tile_hits,
+            'tile_fetches': self.tile_fetches
+        }
+
+
+# Tile cache over the remote Gaia archive (cone and frustum endpoints)
+gaia_tile_cache = SkyTileCache(
+    name="gaia",
+    fetch=gaia_service.query_tiles_async,
+    pixel_of=gaia_service.source_id_pixels,
+    max_rows=settings.GAIA_MAX_ROWS
+)
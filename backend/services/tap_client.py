@@ -0,0 +1,196 @@
+"""
+Asynchronous TAP client for the Gaia archive
+ADQL queries go to the TAP synchronous endpoint over one pooled HTTP session,
+at most MAX_CONCURRENT_QUERIES at a time and each bounded by
+GAIA_TIMEOUT_SECONDS from the call, waiting for a free slot included.
+Cancelling a query (e.g. the client disconnected) closes its HTTP request instead of leaving a worker thread blocked on it.
+Results are parsed from the CSV stream as it arrives and handed out in
+fixed-size DataFrame chunks (see catalog.tap_stream).
+"""
+from typing import AsyncIterator, Dict, Optional
+import asyncio
+import re
+
+import httpx
+import pandas as pd
+from loguru import logger
+
+from config import settings
+from catalog.tap_stream import CsvColumnChunker
+from services.executors import executors
+
+
+class TapError(Exception):
+    """The TAP service rejected a query or answered with an error document"""
+
+
+# Error message of a TAP error VOTable (<INFO name="QUERY_STATUS" value="ERROR">...</INFO>)
+_TAP_ERROR_INFO = re.compile(rb'<INFO[^>]*name="QUERY_STATUS"[^>]*>(.*?)</INFO>', re.DOTALL)
+
+
+class TapClient:
+    """Concurrency-limited ADQL client over a pooled httpx session"""
+
+    def __init__(
+        self,
+        base_url: str,
+        max_concurrent: int = 10,
+        timeout_seconds: float = 60.0,
+        max_rows: Optional[int] = None,
+        chunk_rows: int = 50000,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        """
+        Args:
+            base_url: TAP service root (the sync endpoint is {base_url}/sync)
+            max_concurrent: Queries allowed in flight; also the connection pool size
+            timeout_seconds: Wall-clock limit per query, including the download
+            max_rows: MAXREC sent with each query (None = the service default)
+            chunk_rows: Rows per DataFrame chunk yielded by stream()
+            transport: Optional httpx transport (e.g. httpx.MockTransport for a stub service)
+        """
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrent = max_concurrent
+        self.timeout_seconds = timeout_seconds
+        self.max_rows = max_rows
+        self.chunk_rows = chunk_rows
+        self.transport = transport
+        self.client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        # Counters for /health
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.cancelled = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Shared session, created on first use so it binds to the running loop"""
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url,
+                transport=self.transport,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrent,
+                    max_keepalive_connections=self.max_concurrent
+                ),
+                timeout=httpx.Timeout(self.timeout_seconds),
+                headers={"User-Agent": f"{settings.API_TITLE}/{settings.API_VERSION}"}
+            )
+        return self.client
+
+    async def stream(self, adql: str) -> AsyncIterator[pd.DataFrame]:
+        """
+        Run an ADQL query and yield its rows in chunks of chunk_rows
+
+        Waits for a free slot first and holds it until the result is fully
+        read, so consume with contextlib.aclosing() to release it promptly
+        when stopping early. One deadline, timeout_seconds from the call,
+        bounds the wait for a slot, the request and every read of the
+        result. Raises TapError for service errors and asyncio.TimeoutError
+        once the deadline has passed.
+        """
+        deadline = asyncio.get_running_loop().time() + self.timeout_seconds
+        self.waiting += 1
+        try:
+            async with asyncio.timeout_at(deadline):
+                await self._semaphore.acquire()
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"TAP query waited {self.timeout_seconds}s for a free slot")
+            raise
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        try:
+            client = self._get_client()
+            request = client.build_request("POST", "/sync", data=self._params(adql))
+            async with asyncio.timeout_at(deadline):
+                response = await client.send(request, stream=True)
+            try:
+                async with asyncio.timeout_at(deadline):
+                    await self._check_response(response)
+                chunker = CsvColumnChunker(self.chunk_rows)
+                reads = response.aiter_bytes()
+                while True:
+                    # The consumer's time between chunks counts against the deadline too
+                    async with asyncio.timeout_at(deadline):
+                        data = await anext(reads, None)
+                        if data is None:
+                            break
+                        # Parsing is CPU work; keep it off the event loop
+                        chunks = await executors.run_io(chunker.feed, data)
+                    for chunk in chunks:
+                        yield pd.DataFrame(chunk, copy=False)
+                last = chunker.flush()
+                if last is not None:
+                    yield pd.DataFrame(last, copy=False)
+            finally:
+                await response.aclose()
+            self.completed += 1
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"TAP query timed out after {self.timeout_seconds}s")
+            raise
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            logger.info("TAP query cancelled")
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def _params(self, adql: str) -> Dict[str, str]:
+        params = {
+            "REQUEST": "doQuery",
+            "LANG": "ADQL",
+            "FORMAT": "csv",
+            "QUERY": adql
+        }
+        if self.max_rows is not None:
+            params["MAXREC"] = str(self.max_rows)
+        return params
+
+    @staticmethod
+    async def _check_response(response: httpx.Response):
+        if response.status_code >= 500:
+            # Server-side trouble is transient: raise httpx.HTTPStatusError so callers retry
+            response.raise_for_status()
+        # Query errors come back as a VOTable, with or without an HTTP error status
+        if response.status_code >= 400 or "xml" in response.headers.get("content-type", ""):
+            body = await response.aread()
+            match = _TAP_ERROR_INFO.search(body)
+            detail = match.group(1).decode("utf-8", "replace").strip() if match else body[:200].decode("utf-8", "replace")
+            raise TapError(f"TAP query failed ({response.status_code}): {detail}")
+
+    async def close(self):
+        """Close pooled connections (application shutdown)"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'max_concurrent': self.max_concurrent,
+            'active': self.active,
+            'waiting': self.waiting,
+            'completed': self.completed,
+            'failed': self.failed,
+            'timeouts': self.timeouts,
+            'cancelled': self.cancelled
+        }
+
+
+# Global client for the Gaia archive
+tap_client = TapClient(
+    settings.GAIA_TAP_URL,
+    max_concurrent=settings.MAX_CONCURRENT_QUERIES,
+    timeout_seconds=settings.GAIA_TIMEOUT_SECONDS,
+    max_rows=settings.GAIA_MAX_ROWS,
+    chunk_rows=settings.GAIA_STREAM_CHUNK_ROWS
+)
@@ -0,0 +1,157 @@
+"""
+Startup warmup
+Runs in the background once the API is up: pages the local catalog in, then
+sends the most common requests (the bright catalog in JSON and binary for
+each BRIGHT_CATALOG_PREBUILD bucket, and WARMUP_PATHS) through the app
+itself, so their results land in the same caches real requests use.
+/health/ready reports 503 until it has finished, so a load balancer only
+routes users to warm workers.
+
+Region (/region) responses are not warmed: they are cached under the exact
+ra/dec/radius of the request, which follow the viewer's camera and would
+almost never match a precomputed key. The paged-in catalog is what makes
+those first queries fast.
+
+Under serve.py every worker pages the catalog in, but only the worker holding
+WARMUP_LOCK_FILE sends the requests; the others wait for it and then serve
+from the shared caches (the SQLite result cache and BRIGHT_CATALOG_SHARED_DIR).
+"""
+from typing import Dict, List, Optional
+from pathlib import Path
+import asyncio
+import time
+
+import httpx
+from loguru import logger
+
+from config import settings
+from services.bright_catalog_responses import prebuild_limits
+from services.executors import executors
+from services.file_lock import acquire, try_lock
+from services.local_catalog_service import local_catalog_service
+from services.metrics import warmup_traffic
+
+
+class WarmupService:
+    """Background warmup and the readiness state reported by /health"""
+
+    def __init__(self):
+        self.state = "pending"  # pending -> running -> ready
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.preloaded_bytes = 0
+        self.requests = 0
+        self.failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def start(self, app):
+        """Run the warmup in the background (or mark the API ready when it is disabled)"""
+        if not settings.WARMUP_ENABLED:
+            self.state = "ready"
+            return
+        self._task = asyncio.ensure_future(self.run(app))
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def paths(self) -> List[str]:
+        """Request paths to warm (the default bright catalog bucket last, see prebuild_limits)"""
+        paths = [
+            f"/api/stars/bright-catalog?mag_limit={mag_limit}&format={response_format}"
+            for mag_limit in prebuild_limits()
+            for response_format in ("json", "bin")
+        ]
+        paths.extend(path.strip() for path in settings.WARMUP_PATHS.split(",") if path.strip())
+        return paths
+
+    async def run(self, app):
+        self.state = "running"
+        self.started_at = time.time()
+        lock = None
+        try:
+            if settings.WARMUP_PRELOAD_CATALOG:
+                start = time.time()
+                self.preloaded_bytes = await executors.run_io(local_catalog_service.preload)
+                logger.info(f"Catalog preloaded: {self.preloaded_bytes / 1e6:.1f} MB in {(time.time() - start) * 1000:.0f}ms")
+
+            lock = self._open_lock()
+            if lock is not None and not try_lock(lock):
+                logger.info("Another worker is sending the warmup requests; waiting for it")
+                await acquire(lock)
+            else:
+                await self._send_requests(app)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Never keep a worker out of rotation because warming failed
+            logger.error(f"Warmup failed: {e!r}")
+        finally:
+            # Closing the file releases the lock
+            if lock is not None:
+                lock.close()
+        self.finished_at = time.time()
+        self.state = "ready"
+        logger.success(
+            f"✅ Warmup finished in {self.finished_at - self.started_at:.1f}s "
+            f"({self.requests} requests, {self.failures} failed)"
+        )
+
+    @staticmethod
+    def _open_lock():
+        if not settings.WARMUP_LOCK_FILE:
+            return None
+        path = Path(settings.WARMUP_LOCK_FILE)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            return open(path, "wb")
+        except OSError as e:
+            logger.warning(f"Warmup lock file unusable, warming this worker: {e}")
+            return None
+
+    async def _send_requests(self, app):
+        token = warmup_traffic.set(True)
+        try:
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport,
+                base_url="http://warmup",
+                timeout=settings.WARMUP_REQUEST_TIMEOUT_SECONDS
+            ) as client:
+                for path in self.paths():
+                    await self._request(client, path)
+        finally:
+            warmup_traffic.reset(token)
+
+    async def _request(self, client: httpx.AsyncClient, path: str):
+        start = time.time()
+        self.requests += 1
+        try:
+            response = await asyncio.wait_for(client.get(path), settings.WARMUP_REQUEST_TIMEOUT_SECONDS)
+            if response.status_code >= 400:
+                raise RuntimeError(f"HTTP {response.status_code}")
+            logger.info(f"Warmed {path} in {(time.time() - start) * 1000:.0f}ms")
+        except (asyncio.TimeoutError, httpx.HTTPError, RuntimeError) as e:
+            self.failures += 1
+            logger.warning(f"Warmup request failed: {path}: {e!r}")
+
+    def stats(self) -> Dict:
+        return {
+            'state': self.state,
+            'seconds': round((self.finished_at or time.time()) - self.started_at, 1) if self.started_at else None,
+            'preloaded_mb': round(self.preloaded_bytes / 1e6, 1),
+            'requests': self.requests,
+            'failures': self.failures
+        }
+
+
+# Global instance
+warmup_service = WarmupService()
@@ -0,0 +1,145 @@
+"""
+Shared fixtures: a small synthetic catalog database
+"""
+from pathlib import Path
+import sqlite3
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from catalog.binary_format import write_binary_catalog
+from catalog.catalog_db import STAR_ROW_COLUMNS, build_catalog_db
+from catalog.healpix import HEALPIX_ORDER, ang2pix_nest
+from catalog.magnitude_index import create_offsets_table
+from catalog.star_columns import read_sqlite_columns
+
+
+CATALOG_STARS = 20000
+CATALOG_MAG_LIMIT = 12.0
+
+
+def make_star_rows(count: int = CATALOG_STARS, seed: int = 1, mag_limit: float = CATALOG_MAG_LIMIT):
+    """STAR_ROW_COLUMNS tuples of random stars over the whole sky, in magnitude order"""
+    rng = np.random.default_rng(seed)
+    ra = rng.uniform(0.0, 360.0, count)
+    dec = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, count)))
+    magnitude = np.sort(rng.uniform(-1.0, mag_limit, count))
+    distance = rng.uniform(1.0, 1000.0, count)
+    ra_rad, dec_rad = np.radians(ra), np.radians(dec)
+    x = distance * np.cos(dec_rad) * np.cos(ra_rad)
+    y = distance * np.cos(dec_rad) * np.sin(ra_rad)
+    z = distance * np.sin(dec_rad)
+    bp_rp = rng.uniform(-0.3, 3.0, count)
+    rgb = rng.integers(0, 0xFFFFFF, count)
+    pixels = ang2pix_nest(HEALPIX_ORDER, ra, dec)
+    return [
+        (
+            str(1000 + i), float(ra[i]), float(dec[i]), float(x[i]), float(y[i]), float(z[i]),
+            1000.0 / float(distance[i]), float(distance[i]), float(magnitude[i]), float(bp_rp[i]),
+            int(rgb[i]), 0.5, -0.5, None if i % 3 else 12.5, 5800.0, int(pixels[i])
+        )
+        for i in range(count)
+    ]
+
+
+def write_catalog_db(path: Path, rows, hpx: bool = True, offsets: bool = True):
+    """
+    Catalog database as older download scripts created it
+
+    rows should be in magnitude order. hpx=False leaves out the hpx column and
+    offsets=False the mag_offsets table.
+    """
+    columns = STAR_ROW_COLUMNS if hpx else STAR_ROW_COLUMNS[:-1]
+    conn = sqlite3.connect(path)
+    conn.execute(f"""
+    CREATE TABLE stars (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        source_id TEXT UNIQUE NOT NULL,
+        ra REAL NOT NULL, dec REAL NOT NULL,
+        x REAL NOT NULL, y REAL NOT NULL, z REAL NOT NULL,
+        parallax REAL, distance_pc REAL, magnitude REAL NOT NULL, bp_rp REAL,
+        rgb INTEGER,
+        pmra REAL, pmdec REAL, radial_velocity REAL, temperature REAL
+        {', hpx INTEGER' if hpx else ''}
+    )
+    """)
+    conn.execute("CREATE INDEX idx_magnitude ON stars(magnitude)")
+    if hpx:
+        conn.execute("CREATE INDEX idx_hpx ON stars(hpx)")
+    conn.executemany(
+        f"INSERT INTO stars ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        [row[:len(columns)] for row in rows]
+    )
+    if offsets:
+        create_offsets_table(conn, np.array([row[8] for row in rows]))
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture(scope="session")
+def star_rows():
+    return make_star_rows()
+
+
+@pytest.fixture(scope="session")
+def catalog_db(tmp_path_factory, star_rows) -> Path:
+    """Catalog database (with its binary copy) built from star_rows"""
+    path = tmp_path_factory.mktemp("catalog") / "gaia_catalog.db"
+    build_catalog_db(path, [star_rows], {'mag_limit': repr(CATALOG_MAG_LIMIT), 'color_mode': 'bp_rp'})
+    write_binary_catalog(path.with_suffix(".bin"), read_sqlite_columns(path))
+    return path
+
+
+@pytest.fixture
+def serve(catalog_db, tmp_path, monkeypatch):
+    """
+    Factory of TestClients of the app, serving catalog_db from SQLite with fresh caches
+
+    Keyword arguments override settings (warmup is off unless enabled here).
+    """
+    from fastapi.testclient import TestClient
+
+    import app as app_module
+    from config import settings
+    from services.bright_catalog_responses import BrightCatalogResponses, bright_catalog_responses
+    from services.cache_service import CacheService, cache_service
+    from services.executors import executors
+    from services.local_catalog_service import LocalCatalogService, local_catalog_service
+    from services.warmup import WarmupService, warmup_service
+
+    def client(**overrides):
+        for name, value in {
+            'CATALOG_ENGINE': "sqlite",
+            'BRIGHT_CATALOG_PREBUILD': "",
+            'BRIGHT_CATALOG_SHARED_DIR': str(tmp_path / "bright_catalog"),
+            'WARMUP_ENABLED': False,
+            'WARMUP_LOCK_FILE': str(tmp_path / "warmup.lock"),
+            **overrides
+        }.items():
+            monkeypatch.setattr(settings, name, value)
+        # Catalog scans run on the I/O threads (test_executors covers the process pool)
+        monkeypatch.setattr(executors, "cpu_processes", 0)
+        # The routes hold the global services: give them the state of new instances
+        for service, fresh in (
+            (cache_service, CacheService()),
+            (bright_catalog_responses, BrightCatalogResponses()),
+            (local_catalog_service, LocalCatalogService(str(catalog_db))),
+            (warmup_service, WarmupService()),
+        ):
+            for name, value in vars(fresh).items():
+                monkeypatch.setattr(service, name, value)
+        monkeypatch.setattr(cache_service, "db_path", str(tmp_path / "cache.db"))
+        return TestClient(app_module.app)
+
+    return client
+
+
+@pytest.fixture
+def api(serve):
+    """TestClient of the app with the default test settings"""
+    with serve() as client:
+        yield client
@@ -0,0 +1,48 @@
+"""
+API responses: the JSON, NDJSON and packed formats carry the same stars
+"""
+import json
+
+import numpy as np
+import pytest
+
+from catalog.packed_format import PACKED_MAGIC, packed_count
+from test_packed_format import unpack
+
+
+REGION = {'ra': 266.4, 'dec': -29.0, 'radius': 15.0, 'limit': 5000}
+
+
+def ndjson_stars(response) -> list:
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+
+def test_region_formats_agree(api):
+    stars = api.get("/api/stars/region", params=REGION).json()['stars']
+    assert stars
+
+    streamed = api.get("/api/stars/region", params={**REGION, 'format': 'ndjson'})
+    assert streamed.headers['content-type'].startswith("application/x-ndjson")
+    assert ndjson_stars(streamed) == stars
+
+    packed = api.get("/api/stars/region", params={**REGION, 'format': 'bin'})
+    assert packed.headers['X-Star-Count'] == str(len(stars))
+    arrays = unpack(packed.content)
+    assert arrays['ids'].tolist() == [int(star['source_id']) for star in stars]
+    assert arrays['positions'] == pytest.approx(np.array([[star['x'], star['y'], star['z']] for star in stars]), rel=1e-5)
+
+
+def test_region_format_from_accept_header(api):
+    packed = api.get("/api/stars/region", params=REGION, headers={'Accept': "application/octet-stream"})
+    assert packed.content[:4] == PACKED_MAGIC
+    streamed = api.get("/api/stars/region", params=REGION, headers={'Accept': "application/x-ndjson"})
+    assert len(ndjson_stars(streamed)) == packed_count(packed.content)
+
+
+def test_bright_catalog_formats_agree(api):
+    stars = api.get("/api/stars/bright-catalog", params={'mag_limit': 6.0}).json()['stars']
+    assert stars and all(star['magnitude'] < 6.0 for star in stars)
+    packed = unpack(api.get("/api/stars/bright-catalog", params={'mag_limit': 6.0, 'format': 'bin'}).content)
+    assert packed['ids'].tolist() == [int(star['source_id']) for star in stars]
+    streamed = api.get("/api/stars/bright-catalog", params={'mag_limit': 6.0, 'format': 'ndjson'})
+    assert [star['source_id'] for star in ndjson_stars(streamed)] == [star['source_id'] for star in stars]
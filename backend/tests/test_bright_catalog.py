@@ -0,0 +1,36 @@
+"""
+Bright catalog: every mag_limit is a prefix of one magnitude-sorted buffer
+"""
+import pytest
+
+from conftest import make_star_rows, write_catalog_db
+from services.local_catalog_service import LocalCatalogService
+
+
+def brute_force(rows, mag_limit):
+    return [row[0] for row in sorted(rows, key=lambda row: row[8]) if row[8] < mag_limit]
+
+
+@pytest.mark.parametrize("mag_limit", [-2.0, 2.0, 6.5, 7.05, 12.0, 20.0])
+def test_bright_matches_brute_force(catalog_db, star_rows, mag_limit):
+    stars = LocalCatalogService(str(catalog_db))._query_all_bright_stars_sync(mag_limit)
+    assert [star['source_id'] for star in stars] == brute_force(star_rows, mag_limit)
+
+
+def test_nearby_limits_share_one_buffer(catalog_db, star_rows):
+    service = LocalCatalogService(str(catalog_db))
+    wide = service._query_all_bright_stars_sync(7.5)
+    buffer = service._bright_stars
+    narrow = service._query_all_bright_stars_sync(7.2)
+    assert service._bright_stars is buffer
+    assert service._bright_limit == 8.0
+    assert narrow == wide[:len(narrow)]
+    assert [star['source_id'] for star in narrow] == brute_force(star_rows, 7.2)
+
+
+def test_catalog_without_offsets(tmp_path):
+    # Older catalogs: no mag_offsets table and rows in arbitrary order
+    rows = make_star_rows(3000, seed=11)
+    path = write_catalog_db(tmp_path / "old.db", rows[::-1], offsets=False)
+    stars = LocalCatalogService(str(path))._query_all_bright_stars_sync(6.0)
+    assert [star['source_id'] for star in stars] == brute_force(rows, 6.0)
@@ -0,0 +1,99 @@
+"""
+Precompressed bright catalog bodies: ETags, revalidation and encodings
+"""
+import pytest
+
+from services.bright_catalog_responses import accepted_encoding, etag_matches, mag_limit_bucket, mag_limit_buckets
+
+
+@pytest.mark.parametrize("response_format", ["json", "bin"])
+def test_revalidation(api, response_format):
+    params = {'mag_limit': 6.0, 'format': response_format}
+    first = api.get("/api/stars/bright-catalog", params=params)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    revalidated = api.get("/api/stars/bright-catalog", params=params, headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers['ETag'] == etag
+
+    listed = api.get("/api/stars/bright-catalog", params=params, headers={'If-None-Match': f'"stale", {etag}'})
+    assert listed.status_code == 304
+
+    stale = api.get("/api/stars/bright-catalog", params=params, headers={'If-None-Match': '"stale"'})
+    assert stale.status_code == 200
+    assert stale.content == first.content
+
+
+def test_etag_per_encoding(api):
+    params = {'mag_limit': 6.0}
+    identity = api.get("/api/stars/bright-catalog", params=params, headers={'Accept-Encoding': "identity"})
+    gzipped = api.get("/api/stars/bright-catalog", params=params, headers={'Accept-Encoding': "gzip"})
+    assert identity.headers['ETag'] != gzipped.headers['ETag']
+    assert gzipped.headers['Content-Encoding'] == "gzip"
+    # httpx decodes the body: both representations carry the same stars
+    assert identity.json() == gzipped.json()
+
+    crossed = api.get(
+        "/api/stars/bright-catalog", params=params,
+        headers={'Accept-Encoding': "gzip", 'If-None-Match': identity.headers['ETag']}
+    )
+    assert crossed.status_code == 200
+
+
+def test_different_limits_have_different_etags(api):
+    bright = api.get("/api/stars/bright-catalog", params={'mag_limit': 3.0})
+    faint = api.get("/api/stars/bright-catalog", params={'mag_limit': 6.0})
+    assert bright.headers['ETag'] != faint.headers['ETag']
+    assert bright.json()['count'] < faint.json()['count']
+
+
+def test_limits_share_their_bucket(api):
+    from services.bright_catalog_responses import bright_catalog_responses
+
+    first = api.get("/api/stars/bright-catalog", params={'mag_limit': 5.63})
+    second = api.get("/api/stars/bright-catalog", params={'mag_limit': 5.9})
+    assert first.headers['X-Magnitude-Limit'] == second.headers['X-Magnitude-Limit'] == "6.0"
+    assert first.headers['ETag'] == second.headers['ETag']
+    assert bright_catalog_responses.builds == 1
+
+
+def test_mag_limit_buckets():
+    assert mag_limit_bucket(6.0, 0.5) == 6.0
+    assert mag_limit_bucket(6.01, 0.5) == 6.5
+    assert mag_limit_bucket(0.2, 0.5) == 1.0
+    assert mag_limit_bucket(10.0, 0.5) == 10.0
+    assert mag_limit_buckets(0.5) == [1.0 + 0.5 * i for i in range(19)]
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("", "identity"),
+    ("gzip, deflate", "gzip"),
+    ("gzip;q=0, identity", "identity"),
+    ("*", "gzip"),
+])
+def test_accepted_encoding(header, expected):
+    assert accepted_encoding(header, ("gzip",)) == expected
+
+
+def test_etag_matches():
+    assert etag_matches('"a", "b"', '"b"')
+    assert etag_matches('*', '"b"')
+    assert etag_matches('W/"b"', '"b"')
+    assert not etag_matches('"a"', '"b"')
+
+
+def test_other_workers_load_the_shared_body(api, monkeypatch):
+    from services.bright_catalog_responses import BrightCatalogResponses, bright_catalog_responses
+
+    first = api.get("/api/stars/bright-catalog", params={'mag_limit': 6.0})
+    assert bright_catalog_responses.builds == 1
+    # A second worker starts with an empty cache
+    for name, value in vars(BrightCatalogResponses()).items():
+        monkeypatch.setattr(bright_catalog_responses, name, value)
+    second = api.get("/api/stars/bright-catalog", params={'mag_limit': 6.0})
+    assert bright_catalog_responses.builds == 0
+    assert bright_catalog_responses.shared_loads == 1
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert second.content == first.content
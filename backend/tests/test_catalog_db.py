@@ -0,0 +1,50 @@
+"""
+Catalog database builds: bulk load into a temp file, then rename into place
+"""
+import sqlite3
+
+import pytest
+
+from catalog.catalog_db import build_catalog_db
+from conftest import make_star_rows
+from services.local_catalog_service import LocalCatalogService
+
+
+ROWS = make_star_rows(3000, seed=3)
+
+
+def tables(path):
+    with sqlite3.connect(path) as conn:
+        return {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def test_build_in_magnitude_order(tmp_path):
+    path = tmp_path / "catalog.db"
+    assert build_catalog_db(path, [ROWS[:1000], [], ROWS[1000:]]) == (len(ROWS), True)
+    assert not (tmp_path / "catalog.db.tmp").exists()
+    assert 'mag_offsets' in tables(path)
+    with sqlite3.connect(path) as conn:
+        assert [row[0] for row in conn.execute("SELECT source_id FROM stars ORDER BY id")] == [row[0] for row in ROWS]
+
+
+def test_unordered_rows_skip_the_offsets_table(tmp_path):
+    path = tmp_path / "catalog.db"
+    assert build_catalog_db(path, [ROWS[1500:], ROWS[:1500]]) == (len(ROWS), False)
+    assert 'mag_offsets' not in tables(path)
+    stars = LocalCatalogService(str(path))._query_all_bright_stars_sync(5.0)
+    assert [star['source_id'] for star in stars] == [row[0] for row in ROWS if row[8] < 5.0]
+
+
+def test_failed_build_keeps_the_existing_catalog(tmp_path):
+    path = tmp_path / "catalog.db"
+    build_catalog_db(path, [ROWS[:100]])
+
+    def batches():
+        yield ROWS[:2000]
+        raise RuntimeError("download failed")
+
+    with pytest.raises(RuntimeError):
+        build_catalog_db(path, batches())
+    assert not (tmp_path / "catalog.db.tmp").exists()
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM stars").fetchone()[0] == 100
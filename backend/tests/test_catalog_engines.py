@@ -0,0 +1,63 @@
+"""
+The in-memory columnar engine and the SQLite catalog answer queries alike
+"""
+import pytest
+
+from services.columnar_catalog import ColumnarCatalog
+from services.local_catalog_service import LocalCatalogService
+
+
+@pytest.fixture(scope="module", params=["sqlite", "binary"])
+def services(request, catalog_db):
+    """SQLite service and a service with the columnar engine loaded from SQLite or the .bin file"""
+    sqlite = LocalCatalogService(str(catalog_db))
+    memory = LocalCatalogService(str(catalog_db))
+    if request.param == "sqlite":
+        memory.engine = ColumnarCatalog.from_sqlite(catalog_db)
+    else:
+        memory.engine = ColumnarCatalog.from_binary(catalog_db.with_suffix(".bin"))
+    return sqlite, memory
+
+
+def assert_same_stars(a, b):
+    assert [star['source_id'] for star in a] == [star['source_id'] for star in b]
+    for left, right in zip(a, b):
+        assert left.keys() == right.keys()
+        for key, value in left.items():
+            if isinstance(value, float):
+                assert right[key] == pytest.approx(value, rel=1e-5, abs=1e-6), key
+            else:
+                assert right[key] == value, key
+
+
+@pytest.mark.parametrize("args", [
+    (10.0, 5.0, 20.0, 50000, 12.0, None),
+    (359.0, -1.0, 8.0, 50000, 9.0, None),
+    (200.0, -60.0, 30.0, 100, 12.0, None),
+    (80.0, 60.0, 40.0, 50000, 12.0, 1),
+    (300.0, 10.0, 25.0, 50000, 12.0, 3),
+])
+def test_cone(services, args):
+    sqlite, memory = services
+    stars = sqlite._query_cone_sync(*args)
+    assert stars
+    assert_same_stars(stars, memory._query_cone_sync(*args))
+
+
+@pytest.mark.parametrize("args", [
+    (0.0, 0.0, 0.0, 200.0, 50000, 12.0),
+    (300.0, -100.0, 50.0, 150.0, 500, 10.0),
+])
+def test_nearby(services, args):
+    sqlite, memory = services
+    stars = sqlite._query_nearby_stars_sync(*args)
+    assert stars
+    assert_same_stars(stars, memory._query_nearby_stars_sync(*args))
+
+
+@pytest.mark.parametrize("mag_limit", [2.0, 6.5, 12.0])
+def test_bright(services, mag_limit):
+    sqlite, memory = services
+    stars = sqlite._query_all_bright_stars_sync(mag_limit)
+    assert all(star['magnitude'] < mag_limit for star in stars)
+    assert_same_stars(stars, memory._query_all_bright_stars_sync(mag_limit))
@@ -0,0 +1,85 @@
+"""
+Incremental catalog refreshes end up identical to full builds
+"""
+import sqlite3
+
+import numpy as np
+
+from catalog.catalog_db import STAR_ROW_COLUMNS, build_catalog_db, update_catalog_db
+from catalog.healpix import HEALPIX_ORDER
+from catalog.lod import lod_levels
+from conftest import make_star_rows
+
+
+MAGNITUDE = STAR_ROW_COLUMNS.index('magnitude')
+ROWS = make_star_rows(6000, seed=7, mag_limit=9.0)
+
+
+def rows_below(mag_limit: float, low: float = -np.inf):
+    return [row for row in ROWS if low <= row[MAGNITUDE] < mag_limit]
+
+
+def build(path, mag_limit: float):
+    build_catalog_db(path, [rows_below(mag_limit)], {'mag_limit': repr(mag_limit)})
+    return path
+
+
+def snapshot(path):
+    """Every table an incremental refresh touches, in rowid order"""
+    with sqlite3.connect(path) as conn:
+        return {
+            'stars': conn.execute(f"SELECT id, {', '.join(STAR_ROW_COLUMNS)}, lod FROM stars ORDER BY id").fetchall(),
+            'mag_offsets': conn.execute("SELECT * FROM mag_offsets ORDER BY 1").fetchall(),
+            'stars_rtree': conn.execute("SELECT * FROM stars_rtree ORDER BY id").fetchall(),
+            'meta': conn.execute("SELECT * FROM catalog_meta ORDER BY 1").fetchall()
+        }
+
+
+def test_extending_the_limit_matches_a_full_build(tmp_path):
+    path = build(tmp_path / "refreshed.db", 7.0)
+    # The delta overlaps the stored catalog, as a refresh query with a margin would
+    counts = update_catalog_db(path, [rows_below(9.0, low=6.5)], 9.0, {'mag_limit': repr(9.0)})
+    expected = snapshot(build(tmp_path / "full.db", 9.0))
+
+    assert counts['inserted'] == len(rows_below(9.0, low=7.0))
+    assert counts['updated'] == len(rows_below(7.0, low=6.5))
+    assert counts['removed'] == 0
+    assert counts['in_order']
+    assert snapshot(path) == expected
+
+
+def test_delta_in_several_batches(tmp_path):
+    path = build(tmp_path / "refreshed.db", 5.0)
+    delta = rows_below(9.0, low=5.0)
+    update_catalog_db(path, [delta[i:i + 500] for i in range(0, len(delta), 500)], 9.0, {'mag_limit': repr(9.0)})
+    assert snapshot(path) == snapshot(build(tmp_path / "full.db", 9.0))
+
+
+def test_lowering_the_limit_trims_the_faint_tail(tmp_path):
+    path = build(tmp_path / "refreshed.db", 9.0)
+    counts = update_catalog_db(path, [], 8.0, {'mag_limit': repr(8.0)})
+    assert counts['removed'] == len(rows_below(9.0, low=8.0))
+    assert snapshot(path) == snapshot(build(tmp_path / "full.db", 8.0))
+
+
+
+def test_update_breaking_magnitude_order_drops_the_offsets(tmp_path):
+    path = build(tmp_path / "refreshed.db", 9.0)
+    brightened = list(ROWS[-1])
+    brightened[MAGNITUDE] = -5.0
+    counts = update_catalog_db(path, [[tuple(brightened)]], 9.0)
+    assert counts['updated'] == 1 and not counts['in_order']
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'mag_offsets'").fetchone() is None
+
+def test_moved_stars_get_their_levels_recomputed(tmp_path):
+    path = build(tmp_path / "refreshed.db", 9.0)
+    # Move the brightest stars to a neighbour's pixel: other stars' tile ranks change
+    pixel = STAR_ROW_COLUMNS.index('hpx')
+    moved = [row[:pixel] + (ROWS[-1 - i][pixel],) + row[pixel + 1:] for i, row in enumerate(ROWS[:50])]
+    counts = update_catalog_db(path, [moved], 9.0)
+    assert counts['updated'] == 50
+
+    with sqlite3.connect(path) as conn:
+        pixels, levels = (np.array(column) for column in zip(*conn.execute("SELECT hpx, lod FROM stars ORDER BY id")))
+    assert np.array_equal(levels, lod_levels(pixels, HEALPIX_ORDER))
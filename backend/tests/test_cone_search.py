@@ -0,0 +1,113 @@
+"""
+HEALPix-indexed cone search returns exactly the stars inside the cone
+"""
+import sqlite3
+
+import numpy as np
+import pytest
+
+import services.local_catalog_service as local_catalog_module
+from catalog.healpix import HEALPIX_ORDER, angular_separation_mask
+from catalog.lod import thin_to_level
+from conftest import make_star_rows, write_catalog_db
+from services.local_catalog_service import LocalCatalogService
+
+
+def brute_force(rows, ra, dec, radius, mag_limit):
+    ras = np.array([row[1] for row in rows])
+    decs = np.array([row[2] for row in rows])
+    mags = np.array([row[8] for row in rows])
+    inside = angular_separation_mask(ras, decs, ra, dec, radius) & (mags < mag_limit)
+    return [rows[i][0] for i in np.flatnonzero(inside)]
+
+
+@pytest.mark.parametrize("ra, dec, radius, mag_limit", [
+    (150.0, 20.0, 12.0, 13.0),
+    (359.0, -1.0, 8.0, 9.0),       # straddles RA 0/360
+    (30.0, 88.0, 6.0, 13.0),       # around the north pole
+    (200.0, -60.0, 0.5, 13.0),
+    (80.0, 10.0, 60.0, 4.0),
+])
+def test_cone_matches_brute_force(catalog_db, star_rows, ra, dec, radius, mag_limit):
+    service = LocalCatalogService(str(catalog_db))
+    stars = service._query_cone_sync(ra, dec, radius, 50000, mag_limit)
+    # Brightest first; rows are generated in magnitude order
+    assert [star['source_id'] for star in stars] == brute_force(star_rows, ra, dec, radius, mag_limit)
+
+
+def test_max_stars_keeps_the_brightest(catalog_db, star_rows):
+    service = LocalCatalogService(str(catalog_db))
+    stars = service._query_cone_sync(10.0, -20.0, 30.0, 25, 13.0)
+    assert [star['source_id'] for star in stars] == brute_force(star_rows, 10.0, -20.0, 30.0, 13.0)[:25]
+
+
+@pytest.fixture
+def walked(monkeypatch):
+    """Rows read by each magnitude-ordered cone walk (with small slices)"""
+    monkeypatch.setattr(local_catalog_module, "CONE_SLICE_MIN_ROWS", 64)
+    counts = []
+    walk = LocalCatalogService._walk_cone_slices
+
+    def counting(*args):
+        rows = walk(*args)
+        counts.append(len(rows))
+        return rows
+
+    monkeypatch.setattr(LocalCatalogService, "_walk_cone_slices", staticmethod(counting))
+    return counts
+
+
+@pytest.mark.parametrize("radius", [12.0, 60.0])
+@pytest.mark.parametrize("max_stars", [10, 100, 1000, 2000, 50000])
+def test_cone_walk_matches_brute_force(catalog_db, star_rows, walked, radius, max_stars):
+    service = LocalCatalogService(str(catalog_db))
+    stars = service._query_cone_sync(80.0, 10.0, radius, max_stars, 13.0)
+    assert [star['source_id'] for star in stars] == brute_force(star_rows, 80.0, 10.0, radius, 13.0)[:max_stars]
+    assert len(walked) == 1
+
+
+def test_wide_cone_reads_about_max_stars_rows(catalog_db, star_rows, walked):
+    service = LocalCatalogService(str(catalog_db))
+    stars = service._query_cone_sync(80.0, 10.0, 60.0, 50, 13.0)
+    assert len(stars) == 50
+    inside = len(brute_force(star_rows, 80.0, 10.0, 60.0, 13.0))
+    assert walked[0] < inside / 4
+
+
+@pytest.mark.parametrize("hpx", [True, False])
+def test_cone_walk_with_lod_ranking(tmp_path, walked, hpx):
+    rows = make_star_rows(8000, seed=9)
+    # No lod column: the walk ranks whole level tiles itself (or every row without hpx)
+    service = LocalCatalogService(str(write_catalog_db(tmp_path / "old.db", rows, hpx=hpx)), read_only=True)
+    stars = service._query_cone_sync(250.0, -20.0, 25.0, 40, 13.0, lod_level=1)
+    keep = thin_to_level(np.array([row[15] for row in rows]), HEALPIX_ORDER, 1, tile_stars=256)
+    kept_ids = {row[0] for row, kept in zip(rows, keep) if kept}
+    expected = [source_id for source_id in brute_force(rows, 250.0, -20.0, 25.0, 13.0) if source_id in kept_ids]
+    assert [star['source_id'] for star in stars] == expected[:40]
+    assert walked
+
+
+def test_catalog_without_hpx_is_migrated(tmp_path):
+    rows = make_star_rows(3000, seed=5)
+    service = LocalCatalogService(str(write_catalog_db(tmp_path / "old.db", rows, hpx=False)))
+    stars = service._query_cone_sync(100.0, 45.0, 20.0, 50000, 13.0)
+    assert [star['source_id'] for star in stars] == brute_force(rows, 100.0, 45.0, 20.0, 13.0)
+    assert service._healpix_ready
+
+
+def test_read_only_service_leaves_the_catalog_unchanged(tmp_path):
+    rows = make_star_rows(3000, seed=5)
+    path = write_catalog_db(tmp_path / "old.db", rows, hpx=False)
+    service = LocalCatalogService(str(path), read_only=True)
+    stars = service._query_cone_sync(100.0, 45.0, 20.0, 50000, 13.0)
+    assert [star['source_id'] for star in stars] == brute_force(rows, 100.0, 45.0, 20.0, 13.0)
+    assert not service._healpix_ready
+    with sqlite3.connect(path) as conn:
+        assert "hpx" not in {row[1] for row in conn.execute("PRAGMA table_info(stars)")}
+
+
+def test_cone_batches_match_the_cone_query(catalog_db):
+    service = LocalCatalogService(str(catalog_db))
+    batches = list(service.iter_cone_batches(150.0, 20.0, 25.0, 50000, 12.0, batch_size=100))
+    assert batches and all(0 < len(batch) <= 100 for batch in batches)
+    assert [star for batch in batches for star in batch] == service._query_cone_sync(150.0, 20.0, 25.0, 50000, 12.0)
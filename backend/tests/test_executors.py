@@ -0,0 +1,52 @@
+"""
+Catalog scans in the CPU pool return the same stars as in-process queries
+"""
+import asyncio
+
+import numpy as np
+import pytest
+
+import services.local_catalog_service as local_catalog_module
+from services.columnar_catalog import ColumnarCatalog
+from services.executors import ExecutorPools, cpu_pool_size
+from services.local_catalog_service import LocalCatalogService
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pools = ExecutorPools(io_threads=2, cpu_processes=1)
+    asyncio.run(pools.start())
+    assert pools.cpu_enabled
+    yield pools
+    pools.shutdown()
+
+
+@pytest.mark.parametrize("engine", [False, True])
+def test_pool_queries_match_in_process(pool, catalog_db, monkeypatch, engine):
+    monkeypatch.setattr(local_catalog_module, "executors", pool)
+    service = LocalCatalogService(str(catalog_db))
+    if engine:
+        service.engine = ColumnarCatalog.from_binary(catalog_db.with_suffix(".bin"))
+        service._engine_mapped = True
+    cone = (120.0, -30.0, 20.0, 5000, 12.0, None)
+    nearby = (10.0, 20.0, -30.0, 300.0, 5000, 12.0)
+
+    async def queries():
+        return await service.query_cone_async(*cone), await service.query_nearby_stars_async(*nearby)
+
+    completed = pool.cpu_stats.completed
+    pooled_cone, pooled_nearby = asyncio.run(queries())
+    assert pool.cpu_stats.completed == completed + 2
+    for pooled, local in ((pooled_cone, service._query_cone_sync(*cone)), (pooled_nearby, service._query_nearby_stars_sync(*nearby))):
+        assert local
+        assert [star['source_id'] for star in pooled] == [star['source_id'] for star in local]
+        assert np.allclose([star['x'] for star in pooled], [star['x'] for star in local], rtol=1e-5)
+
+
+def test_cpu_pool_size(monkeypatch):
+    monkeypatch.setattr("os.cpu_count", lambda: 8)
+    assert cpu_pool_size(3, 4) == 3
+    assert cpu_pool_size(0, 4) == 0
+    assert cpu_pool_size(-1, 1) == 8
+    assert cpu_pool_size(-1, 4) == 2
+    assert cpu_pool_size(-1, 16) == 0
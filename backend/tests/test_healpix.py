@@ -0,0 +1,54 @@
+"""
+HEALPix helpers: disc queries must cover every pixel a brute-force test finds
+"""
+import numpy as np
+import pytest
+
+from catalog.healpix import (
+    HEALPIX_ORDER,
+    angular_separation_mask,
+    ang2pix_nest,
+    pixel_ranges,
+    query_disc_nest,
+)
+
+
+def random_sky(count: int, seed: int):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(0.0, 360.0, count), np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, count)))
+
+
+@pytest.mark.parametrize("order", [0, 2, 4, 6, 8])
+@pytest.mark.parametrize("center, radius", [
+    ((10.0, 5.0), 20.0),
+    ((359.5, -2.0), 3.0),      # straddles RA 0/360
+    ((120.0, 89.0), 5.0),      # around the north pole
+    ((250.0, -80.0), 15.0),
+    ((45.0, 30.0), 0.2),
+    ((0.0, 0.0), 120.0),
+])
+def test_query_disc_covers_brute_force(order, center, radius):
+    ra, dec = random_sky(200000, seed=order)
+    inside = angular_separation_mask(ra, dec, center[0], center[1], radius)
+    expected = set(ang2pix_nest(order, ra[inside], dec[inside]).tolist())
+    found = set(query_disc_nest(order, center[0], center[1], radius).tolist())
+    assert expected <= found
+
+
+def test_query_disc_is_not_the_whole_sky():
+    pixels = query_disc_nest(6, 80.0, 20.0, 2.0)
+    assert 0 < len(pixels) < 12 * 4 ** 6 // 100
+
+
+def test_pixel_ranges_select_the_disc_stars():
+    ra, dec = random_sky(100000, seed=7)
+    fine = ang2pix_nest(HEALPIX_ORDER, ra, dec)
+    order = 5
+    ranges = pixel_ranges(order, query_disc_nest(order, 200.0, -30.0, 8.0), HEALPIX_ORDER)
+    in_ranges = np.zeros(len(ra), dtype=bool)
+    for start, end in ranges:
+        in_ranges |= (fine >= start) & (fine < end)
+    inside = angular_separation_mask(ra, dec, 200.0, -30.0, 8.0)
+    assert not np.any(inside & ~in_ranges)
+    # Ranges are sorted and disjoint
+    assert all(a[1] <= b[0] for a, b in zip(ranges, ranges[1:]))
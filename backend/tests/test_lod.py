@@ -0,0 +1,101 @@
+"""
+LOD pyramid: levels, thinning and star budgets
+"""
+import sqlite3
+
+import numpy as np
+import pytest
+
+from catalog.lod import (
+    LOD_MAX_ORDER,
+    LOD_TILE_STARS,
+    level_density,
+    level_for_budget,
+    lod_levels,
+    thin_to_level,
+)
+
+
+PIXEL_ORDER = 6
+
+
+def random_pixels(count: int, seed: int = 3) -> np.ndarray:
+    # Clustered, like the Milky Way: most stars in a few base pixels
+    rng = np.random.default_rng(seed)
+    base = rng.choice(12, size=count, p=[0.4, 0.2] + [0.04] * 10)
+    return (base << (2 * PIXEL_ORDER)) + rng.integers(0, 4 ** PIXEL_ORDER, count)
+
+
+def brute_force_levels(pixels: np.ndarray, tile_stars: int, max_order: int) -> np.ndarray:
+    levels = np.full(len(pixels), max_order + 1)
+    for i, pixel in enumerate(pixels.tolist()):
+        for level in range(max_order + 1):
+            shift = 2 * (PIXEL_ORDER - level)
+            rank = np.count_nonzero((pixels[:i] >> shift) == (pixel >> shift))
+            if rank < tile_stars:
+                levels[i] = level
+                break
+    return levels
+
+
+def test_levels_match_brute_force():
+    pixels = random_pixels(3000)
+    levels = lod_levels(pixels, PIXEL_ORDER, tile_stars=8, max_order=4)
+    assert levels.tolist() == brute_force_levels(pixels, 8, 4).tolist()
+
+
+def test_levels_keep_at_most_tile_stars_per_tile():
+    pixels = random_pixels(50000)
+    levels = lod_levels(pixels, PIXEL_ORDER, tile_stars=16, max_order=PIXEL_ORDER)
+    for level in range(PIXEL_ORDER + 1):
+        kept = pixels[levels <= level] >> (2 * (PIXEL_ORDER - level))
+        assert np.bincount(kept).max() <= 16
+        # Thinning a magnitude-ordered list to a level keeps the same stars
+        assert np.array_equal(thin_to_level(pixels, PIXEL_ORDER, level, tile_stars=16), levels <= level)
+
+
+def test_levels_are_nested():
+    pixels = random_pixels(20000)
+    levels = lod_levels(pixels, PIXEL_ORDER, tile_stars=16, max_order=PIXEL_ORDER)
+    previous = np.zeros(len(pixels), dtype=bool)
+    for level in range(PIXEL_ORDER + 2):
+        kept = levels <= level
+        assert not np.any(previous & ~kept)
+        previous = kept
+
+
+@pytest.mark.parametrize("budget", [500, 5000, 50000])
+@pytest.mark.parametrize("radius", [0.5, 5.0, 30.0, 90.0])
+def test_level_for_budget_fits_the_budget(budget, radius):
+    level = level_for_budget(budget, radius)
+    area = 2 * np.pi * (1 - np.cos(np.radians(radius))) * (180 / np.pi) ** 2
+    if level > LOD_MAX_ORDER:
+        # Full depth fits
+        assert level_density(LOD_MAX_ORDER) * area <= budget
+        return
+    if level > 0:
+        assert level_density(level) * area <= budget
+    assert level_density(level + 1) * area > budget
+
+
+def test_zooming_in_reaches_deeper_levels():
+    levels = [level_for_budget(5000, radius) for radius in (90.0, 30.0, 10.0, 3.0, 1.0)]
+    assert levels == sorted(levels)
+    assert levels[0] < levels[-1]
+
+
+def test_region_budget_bounds_the_result(api, catalog_db):
+    budget = 200
+    params = {'ra': 10, 'dec': 20, 'radius': 30, 'limit': 50000}
+    full = api.get("/api/stars/region", params=params).json()
+    thinned = api.get("/api/stars/region", params={**params, 'budget': budget}).json()
+    level = thinned['lod_level']
+    assert full['lod_level'] is None
+    assert level == level_for_budget(budget, 30)
+    assert thinned['count'] < full['count']
+    # Exactly the stars stored at or below that level
+    with sqlite3.connect(catalog_db) as conn:
+        levels = dict(conn.execute("SELECT source_id, lod FROM stars"))
+    expected = [star['source_id'] for star in full['stars'] if levels[star['source_id']] <= level]
+    assert [star['source_id'] for star in thinned['stars']] == expected
+    assert thinned['count'] <= LOD_TILE_STARS * 12 * 4 ** level
@@ -0,0 +1,46 @@
+"""
+/metrics: stage timers, request histograms and the snapshots shared by workers
+"""
+import asyncio
+import json
+import os
+
+from services.metrics import Metrics, PREFIX
+
+
+def test_scrape_reports_the_stages_of_a_request(api):
+    response = api.get("/api/stars/region", params={'ra': 10.0, 'dec': 20.0, 'radius': 15.0})
+    assert response.status_code == 200
+    api.get("/api/stars/region", params={'ra': 10.0, 'dec': 20.0, 'radius': 15.0})
+
+    scrape = api.get("/metrics")
+    assert scrape.status_code == 200
+    text = scrape.text
+    endpoint = 'endpoint="/api/stars/region"'
+    assert any(
+        line.startswith(f"{PREFIX}stage_seconds_count{{") and endpoint in line and 'stage="catalog_query"' in line
+        for line in text.splitlines()
+    )
+    assert any(
+        line.startswith(f"{PREFIX}request_seconds_count{{") and endpoint in line and 'status="200"' in line
+        for line in text.splitlines()
+    )
+    # The second request is answered by the memory cache
+    assert f'{PREFIX}cache_lookups_total{{{endpoint},result="memory_hit"}}' in text
+    assert f"{PREFIX}cache_hit_ratio{{{endpoint}}}" in text
+
+
+def test_snapshots_of_other_workers_are_merged(tmp_path):
+    worker = Metrics(shared_dir=tmp_path)
+    worker.observe_request("/api/stars/region", "GET", "200", 0.01, 100)
+    worker.cache_lookup("miss")
+    worker.flush()
+    # Pretend the snapshot was written by another process
+    os.replace(tmp_path / f"{os.getpid()}.json", tmp_path / "1.json")
+    assert json.loads((tmp_path / "1.json").read_text())["metrics"]
+
+    scraper = Metrics(shared_dir=tmp_path)
+    scraper.observe_request("/api/stars/region", "GET", "200", 0.02, 100)
+    text = asyncio.run(scraper.render())
+    assert f'{PREFIX}request_seconds_count{{endpoint="/api/stars/region",method="GET",status="200"}} 2' in text
+    assert f'{PREFIX}cache_lookups_total{{endpoint="background",result="miss"}} 1' in text
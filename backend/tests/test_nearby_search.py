@@ -0,0 +1,31 @@
+"""
+Nearby-star queries: the R*Tree prefilter returns the same stars as a scan
+"""
+import numpy as np
+import pytest
+
+from config import settings
+from services.local_catalog_service import LocalCatalogService
+
+
+def brute_force(rows, camera, max_distance, max_stars, mag_limit):
+    xyz = np.array([row[3:6] for row in rows])
+    mags = np.array([row[8] for row in rows])
+    distance_sq = ((xyz - np.array(camera)) ** 2).sum(axis=1)
+    keep = np.flatnonzero((distance_sq < max_distance ** 2) & (mags < mag_limit))
+    keep = keep[np.lexsort((mags[keep], distance_sq[keep]))][:max_stars]
+    return [rows[i][0] for i in keep]
+
+
+@pytest.mark.parametrize("spatial_index", [True, False])
+@pytest.mark.parametrize("camera, max_distance, max_stars, mag_limit", [
+    ((0.0, 0.0, 0.0), 200.0, 50000, 12.0),
+    ((300.0, -100.0, 50.0), 150.0, 500, 10.0),
+    ((900.0, 900.0, 900.0), 100.0, 50000, 12.0),
+])
+def test_nearby_matches_brute_force(catalog_db, star_rows, monkeypatch, spatial_index, camera, max_distance, max_stars, mag_limit):
+    monkeypatch.setattr(settings, "SPATIAL_INDEX_ENABLED", spatial_index)
+    service = LocalCatalogService(str(catalog_db))
+    stars = service._query_nearby_stars_sync(*camera, max_distance, max_stars, mag_limit)
+    assert service._rtree_ready == spatial_index
+    assert [star['source_id'] for star in stars] == brute_force(star_rows, camera, max_distance, max_stars, mag_limit)
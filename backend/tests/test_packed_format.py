@@ -0,0 +1,45 @@
+"""
+Packed binary payloads decode back to the stars they were built from
+"""
+import numpy as np
+import pytest
+
+from catalog.packed_format import PACKED_MAGIC, pack_star_records, packed_count
+
+
+def unpack(body: bytes) -> dict:
+    """Decode a packed payload following the layout in catalog.packed_format"""
+    assert body[:4] == PACKED_MAGIC
+    count = packed_count(body)
+    offset = 16
+    arrays = {}
+    for name, width in (('positions', 3), ('colors', 3), ('sizes', 1)):
+        arrays[name] = np.frombuffer(body, dtype='<f4', count=count * width, offset=offset).reshape(count, width)
+        offset += count * width * 4
+    offset += 4 if count % 2 else 0
+    arrays['ids'] = np.frombuffer(body, dtype='<i8', count=count, offset=offset)
+    assert offset + count * 8 == len(body)
+    return arrays
+
+
+def test_round_trip():
+    stars = [
+        {'source_id': str(10 ** 18 + i), 'x': i * 1.5, 'y': -i, 'z': 0.25, 'r': 0.1, 'g': 0.2, 'b': 0.3, 'magnitude': i}
+        for i in range(7)
+    ]
+    stars.append({'source_id': None, 'x': 1.0, 'y': 2.0, 'z': 3.0, 'magnitude': None})
+    arrays = unpack(pack_star_records(stars))
+
+    assert arrays['ids'].tolist() == [10 ** 18 + i for i in range(7)] + [0]
+    assert arrays['positions'][:7] == pytest.approx(np.array([[i * 1.5, -i, 0.25] for i in range(7)]))
+    assert arrays['colors'][0] == pytest.approx([0.1, 0.2, 0.3])
+    # Missing colors are white, missing magnitudes are faint
+    assert arrays['colors'][7] == pytest.approx([1.0, 1.0, 1.0])
+    assert arrays['sizes'][7, 0] == pytest.approx(0.5)
+    assert np.all(np.diff(arrays['sizes'][:7, 0]) <= 0)
+
+
+@pytest.mark.parametrize("count", [0, 1, 2])
+def test_small_payloads(count):
+    stars = [{'source_id': str(i + 1), 'x': 1.0, 'y': 1.0, 'z': 1.0, 'magnitude': 5.0} for i in range(count)]
+    assert unpack(pack_star_records(stars))['ids'].tolist() == list(range(1, count + 1))
@@ -0,0 +1,54 @@
+"""
+QCV1 cache value codec round trips
+"""
+import pytest
+
+from catalog.record_codec import COMPRESSIONS, decode_value, encode_value
+
+
+RECORDS = [
+    {'source_id': '4472832130942575872', 'ra': 269.45, 'dec': 4.69, 'parallax': 546.97,
+     'hpx': 123456789, 'radial_velocity': None, 'name': "Barnard's Star", 'tags': ['m', 4]},
+    {'source_id': '2', 'ra': 0.0, 'dec': -90.0, 'parallax': None,
+     'hpx': -5, 'radial_velocity': -110.5, 'name': 'Ωmega ✦', 'tags': None},
+    {'source_id': '', 'ra': 359.999999, 'dec': 1e-300, 'parallax': 1.5,
+     'hpx': 2 ** 62, 'radial_velocity': 0.0, 'name': '', 'tags': {'nested': [1, 2]}},
+]
+
+
+@pytest.mark.parametrize("compression", ["none", "zlib"])
+@pytest.mark.parametrize("columnar", [True, False])
+def test_records_round_trip(compression, columnar):
+    assert decode_value(encode_value(RECORDS, compression, columnar)) == RECORDS
+
+
+@pytest.mark.parametrize("value", [
+    [],
+    {'count': 3, 'stars': [1, 2, 3]},
+    [{'a': 1}, {'b': 2}],               # differing keys: stored as JSON
+    [{'big': 2 ** 70}],                 # outside int64
+    [{'x': 1, 'y': 1.5}, {'x': 2.0, 'y': None}],
+    "text",
+    None,
+])
+def test_other_values_round_trip(value):
+    assert decode_value(encode_value(value, 'zlib')) == value
+
+
+def test_columnar_is_smaller_than_json():
+    records = [
+        {'source_id': str(10 ** 18 + i), 'ra': i * 0.001, 'dec': -i * 0.002, 'magnitude': 5 + i * 1e-4}
+        for i in range(2000)
+    ]
+    assert len(encode_value(records, columnar=True)) < len(encode_value(records, columnar=False))
+
+
+def test_header_names_the_compression():
+    blob = encode_value(RECORDS, 'zlib')
+    assert blob[:4] == b"QCV1"
+    assert blob[5] == COMPRESSIONS['zlib']
+
+
+def test_rejects_foreign_blobs():
+    with pytest.raises(ValueError):
+        decode_value(b"JSON" + b"\0" * 8)
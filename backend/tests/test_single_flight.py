@@ -0,0 +1,108 @@
+"""
+SingleFlight coalesces concurrent identical computations
+"""
+import asyncio
+
+import pytest
+
+from services.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_computation():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {'stars': 42}
+
+        results = await asyncio.gather(*(flight.do("bright:7", compute) for _ in range(10)))
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert results == [{'stars': 42}] * 10
+    assert flight.coalesced == 9
+    assert flight.in_flight == 0
+
+
+def test_different_keys_and_later_calls_run_again():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def compute(key):
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return key
+
+        await asyncio.gather(flight.do("a", lambda: compute("a")), flight.do("b", lambda: compute("b")))
+        await flight.do("a", lambda: compute("a"))
+        return calls
+
+    assert sorted(asyncio.run(scenario())) == ["a", "a", "b"]
+
+
+def test_errors_reach_every_waiter():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("TAP down")
+
+        return await asyncio.gather(*(flight.do("k", compute) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_cancelled_waiter_leaves_the_computation_running():
+    async def scenario():
+        flight = SingleFlight()
+        started = asyncio.Event()
+
+        async def compute():
+            started.set()
+            await asyncio.sleep(0.05)
+            return "done"
+
+        first = asyncio.ensure_future(flight.do("k", compute))
+        second = asyncio.ensure_future(flight.do("k", compute))
+        await started.wait()
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == "done"
+
+
+def test_computation_is_cancelled_when_every_waiter_has_gone():
+    async def scenario():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def compute():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiters = [asyncio.ensure_future(flight.do("k", compute)) for _ in range(2)]
+        await started.wait()
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), 1.0)
+        await asyncio.sleep(0)
+        return flight
+
+    flight = asyncio.run(scenario())
+    assert flight.in_flight == 0
+    assert not flight.waiters
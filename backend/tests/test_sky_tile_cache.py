@@ -0,0 +1,87 @@
+"""
+Tile-assembled cone queries return what one query of the whole source would
+"""
+import asyncio
+
+import numpy as np
+import pytest
+
+from catalog.healpix import SOURCE_ID_HEALPIX_ORDER, SOURCE_ID_HEALPIX_SHIFT, ang2pix_nest, angular_separation_mask
+from catalog.lod import thin_to_level
+from services.gaia_service import GaiaService
+from services.sky_tile_cache import SkyTileCache
+
+
+def make_source_stars(count: int = 20000, seed: int = 3):
+    """Gaia-like stars crowded around (40, 10), in magnitude order"""
+    rng = np.random.default_rng(seed)
+    ra = rng.normal(40.0, 8.0, count) % 360.0
+    dec = np.clip(rng.normal(10.0, 8.0, count), -89.0, 89.0)
+    magnitude = np.sort(rng.uniform(0.0, 16.0, count))
+    pixels = ang2pix_nest(SOURCE_ID_HEALPIX_ORDER, ra, dec)
+    return [
+        {'source_id': str((int(pixels[i]) << SOURCE_ID_HEALPIX_SHIFT) + i), 'ra': float(ra[i]),
+         'dec': float(dec[i]), 'magnitude': float(magnitude[i])}
+        for i in range(count)
+    ]
+
+
+def fake_fetch(stars):
+    async def fetch(order, pixels, mag_min, mag_max, max_rows):
+        tiles = set(pixels)
+        found = [
+            star for star, pix in zip(stars, GaiaService.source_id_pixels(stars, order).tolist())
+            if pix in tiles
+            and (mag_min is None or star['magnitude'] >= mag_min)
+            and (mag_max is None or star['magnitude'] < mag_max)
+        ]
+        return found[:max_rows]
+    return fetch
+
+
+def whole_source_query(stars, ra, dec, radius, max_stars, mag_limit, lod_level=None):
+    keep = np.ones(len(stars), dtype=bool)
+    if lod_level is not None:
+        # Rank every star of each level tile, as the local pyramid does
+        keep = thin_to_level(GaiaService.source_id_pixels(stars, lod_level), lod_level, lod_level)
+    keep &= angular_separation_mask([s['ra'] for s in stars], [s['dec'] for s in stars], ra, dec, radius)
+    keep &= np.array([s['magnitude'] for s in stars]) < mag_limit
+    return [stars[i]['source_id'] for i in np.flatnonzero(keep)][:max_stars]
+
+
+@pytest.fixture
+def fresh_cache(tmp_path, monkeypatch):
+    from services.cache_service import CacheService, cache_service
+    for name, value in vars(CacheService()).items():
+        monkeypatch.setattr(cache_service, name, value)
+    monkeypatch.setattr(cache_service, "db_path", str(tmp_path / "cache.db"))
+    return cache_service
+
+
+@pytest.mark.parametrize("ra, dec, radius, max_stars, mag_limit, lod_level", [
+    (40.0, 10.0, 5.0, 100000, 14.0, None),
+    (40.0, 10.0, 5.0, 300, 14.0, None),
+    # Cones cutting through crowded level tiles
+    (52.0, 18.0, 6.0, 100000, 15.0, 2),
+    (30.0, 3.0, 4.0, 100000, 16.0, 3),
+    (40.0, 10.0, 12.0, 500, 15.0, 1),
+])
+def test_cone_matches_the_whole_source(fresh_cache, ra, dec, radius, max_stars, mag_limit, lod_level):
+    stars = make_source_stars()
+    tiles = SkyTileCache("test", fake_fetch(stars), GaiaService.source_id_pixels, max_rows=100000)
+
+    async def scenario():
+        await fresh_cache.initialize()
+        try:
+            first, first_cached = await tiles.query_cone(ra, dec, radius, max_stars, mag_limit, lod_level)
+            second, second_cached = await tiles.query_cone(ra, dec, radius, max_stars, mag_limit, lod_level)
+        finally:
+            await fresh_cache.close()
+        return first, first_cached, second, second_cached
+
+    first, first_cached, second, second_cached = asyncio.run(scenario())
+    expected = whole_source_query(stars, ra, dec, radius, max_stars, mag_limit, lod_level)
+    assert expected
+    assert [star['source_id'] for star in first] == expected
+    assert [star['source_id'] for star in second] == expected
+    assert not first_cached and second_cached
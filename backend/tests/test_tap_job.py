@@ -0,0 +1,85 @@
+"""
+Asynchronous TAP jobs of the catalog downloader: polling, deadline and cleanup
+"""
+import importlib.util
+from pathlib import Path
+
+import httpx
+import pytest
+
+
+JOB_URL = "https://tap.test/tap/async/job1"
+
+
+@pytest.fixture
+def download(tmp_path, monkeypatch):
+    """scripts/download_gaia_catalog.py as a module, with a clock that sleeps instantly"""
+    # The script logs to gaia_download.log in the working directory
+    monkeypatch.chdir(tmp_path)
+    path = Path(__file__).resolve().parents[1] / "scripts" / "download_gaia_catalog.py"
+    spec = importlib.util.spec_from_file_location("download_gaia_catalog", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    clock = [0.0]
+    monkeypatch.setattr(module.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(module.time, "sleep", lambda seconds: clock.__setitem__(0, clock[0] + seconds))
+    return module
+
+
+def tap_server(monkeypatch, phases):
+    """Fake UWS endpoint walking through phases; returns the requests it received"""
+    requests = []
+    phases = iter(phases)
+    state = {'phase': None}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append((request.method, str(request.url), request.content.decode()))
+        url = str(request.url)
+        if request.method == "POST" and url.endswith("/async"):
+            return httpx.Response(303, headers={'location': JOB_URL})
+        if request.method == "POST" and url == f"{JOB_URL}/phase":
+            state['phase'] = "ABORTED"
+            return httpx.Response(303, headers={'location': JOB_URL})
+        if url == f"{JOB_URL}/phase":
+            state['phase'] = state['phase'] if state['phase'] == "ABORTED" else next(phases, state['phase'])
+            return httpx.Response(200, text=state['phase'])
+        if url == f"{JOB_URL}/error":
+            return httpx.Response(200, text="query failed")
+        if url == f"{JOB_URL}/results/result":
+            return httpx.Response(200, content=b"source_id\n1\n")
+        if request.method == "DELETE" and url == JOB_URL:
+            return httpx.Response(303, headers={'location': "https://tap.test/tap/async"})
+        return httpx.Response(404)
+
+    client = httpx.Client
+    monkeypatch.setattr(httpx, "Client", lambda **kwargs: client(transport=httpx.MockTransport(handler), **kwargs))
+    return requests
+
+
+def downloader(download, tmp_path, **kwargs):
+    return download.GaiaCatalogDownloader(str(tmp_path / "catalog.db"), tap_url="https://tap.test/tap", **kwargs)
+
+
+def test_completed_job_is_streamed_and_deleted(download, tmp_path, monkeypatch):
+    requests = tap_server(monkeypatch, ["QUEUED", "EXECUTING", "COMPLETED"])
+    body = b"".join(downloader(download, tmp_path).stream_tap_job("SELECT 1"))
+    assert body == b"source_id\n1\n"
+    assert requests[-1][:2] == ("DELETE", JOB_URL)
+
+
+def test_job_past_the_deadline_is_aborted_and_deleted(download, tmp_path, monkeypatch):
+    requests = tap_server(monkeypatch, ["EXECUTING"])
+    with pytest.raises(TimeoutError):
+        b"".join(downloader(download, tmp_path, job_timeout=30.0).stream_tap_job("SELECT 1"))
+    assert ("POST", f"{JOB_URL}/phase", "PHASE=ABORT") in requests
+    assert requests[-1][:2] == ("DELETE", JOB_URL)
+    # Polling stopped at the deadline
+    assert download.time.monotonic() == pytest.approx(30.0)
+
+
+def test_failed_job_is_deleted(download, tmp_path, monkeypatch):
+    requests = tap_server(monkeypatch, ["EXECUTING", "ERROR"])
+    with pytest.raises(RuntimeError, match="query failed"):
+        b"".join(downloader(download, tmp_path).stream_tap_job("SELECT 1"))
+    assert requests[-1][:2] == ("DELETE", JOB_URL)
@@ -0,0 +1,72 @@
+"""
+Startup warmup: readiness and the responses it leaves in the caches
+"""
+import time
+
+from services.bright_catalog_responses import mag_limit_buckets, prebuild_limits
+
+
+def wait_until_ready(client, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = client.get("/health/ready")
+        if response.status_code == 200:
+            return response.json()
+        assert response.status_code == 503
+        time.sleep(0.05)
+    raise AssertionError("warmup did not finish")
+
+
+def test_ready_after_warmup(serve):
+    from services.bright_catalog_responses import bright_catalog_responses
+
+    with serve(
+        WARMUP_ENABLED=True, WARMUP_PATHS="", BRIGHT_CATALOG_PREBUILD="7.0"
+    ) as client:
+        warmup = wait_until_ready(client)['warmup']
+        assert warmup['state'] == "ready"
+        assert warmup['failures'] == 0
+        builds = bright_catalog_responses.builds
+        response = client.get("/api/stars/bright-catalog", params={'mag_limit': 7.0})
+        assert response.status_code == 200
+        assert bright_catalog_responses.builds == builds
+
+
+def test_prebuild_builds_the_default_bucket_last(monkeypatch):
+    from config import settings
+
+    monkeypatch.setattr(settings, "BRIGHT_CATALOG_PREBUILD", "all")
+    limits = prebuild_limits()
+    assert sorted(limits) == mag_limit_buckets()
+    assert limits[-1] == 7.0
+    monkeypatch.setattr(settings, "BRIGHT_CATALOG_PREBUILD", "8.2, 7, 3")
+    assert prebuild_limits() == [3.0, 8.5, 7.0]
+
+
+def test_default_body_is_cached_after_warming_every_bucket(serve):
+    from services.bright_catalog_responses import bright_catalog_responses
+
+    with serve(
+        WARMUP_ENABLED=True, WARMUP_PATHS="", BRIGHT_CATALOG_PREBUILD="all"
+    ) as client:
+        wait_until_ready(client)
+        assert bright_catalog_responses.builds == 2 * len(mag_limit_buckets())
+        assert len(bright_catalog_responses._entries) == bright_catalog_responses.max_entries
+        assert (7.0, "json") in bright_catalog_responses._entries
+        assert (7.0, "bin") in bright_catalog_responses._entries
+        builds = bright_catalog_responses.builds
+        assert client.get("/api/stars/bright-catalog").status_code == 200
+        assert bright_catalog_responses.builds == builds
+
+
+def test_only_bright_catalog_and_extra_paths_are_warmed(monkeypatch):
+    from config import settings
+    from services.warmup import WarmupService
+
+    monkeypatch.setattr(settings, "BRIGHT_CATALOG_PREBUILD", "6.0")
+    monkeypatch.setattr(settings, "WARMUP_PATHS", "/api/stars/galactic-center, ")
+    assert WarmupService().paths() == [
+        "/api/stars/bright-catalog?mag_limit=6.0&format=json",
+        "/api/stars/bright-catalog?mag_limit=6.0&format=bin",
+        "/api/stars/galactic-center",
+    ]
@@ -12,6 +12,9 @@ import os
 # Make sure we're in the right directory
 os.chdir('/app')
 
+# Backend: WORKER_COUNT uvicorn workers sharing one prepared catalog (backend/serve.py)
+BACKEND_COMMAND = ['python', 'serve.py', '--host', '0.0.0.0', '--port', '5000']
+
 # Process handles
 backend_process = None
 frontend_process = None
@@ -29,15 +32,9 @@ signal.signal(signal.SIGTERM, signal_handler)
 signal.signal(signal.SIGINT, signal_handler)
 
 try:
-    print('[Entrypoint] Starting backend (Uvicorn on 0.0.0.0:5000)...')
+    print('[Entrypoint] Starting backend (Uvicorn workers on 0.0.0.0:5000)...')
     backend_process = subprocess.Popen(
-        [
-            'python', '-m', 'uvicorn',
-            'app:app',
-            '--host', '0.0.0.0',
-            '--port', '5000',
-            '--log-level', 'info'
-        ],
+        BACKEND_COMMAND,
         cwd='/app/backend',
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
@@ -78,13 +75,7 @@ try:
             # Restart backend
             print('[Entrypoint] Restarting backend...')
             backend_process = subprocess.Popen(
-                [
-                    'python', '-m', 'uvicorn',
-                    'app:app',
-                    '--host', '0.0.0.0',
-                    '--port', '5000',
-                    '--log-level', 'info'
-                ],
+                BACKEND_COMMAND,
                 cwd='/app/backend',
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
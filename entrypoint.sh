@@ -4,9 +4,10 @@ set -e
 echo "[Entrypoint] Starting Celestial Navigator..."
 
 # Start backend in background
-echo "[Entrypoint] Starting backend (Uvicorn on 0.0.0.0:5000)..."
+# serve.py prepares the catalog once, then runs WORKER_COUNT uvicorn workers
+echo "[Entrypoint] Starting backend (Uvicorn workers on 0.0.0.0:5000)..."
 cd /app/backend
-python -m uvicorn app:app --host 0.0.0.0 --port 5000 --log-level info &
+python serve.py --host 0.0.0.0 --port 5000 &
 BACKEND_PID=$!
 echo "[Entrypoint] Backend started (PID: $BACKEND_PID)"
 
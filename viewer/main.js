@@ -202,6 +202,7 @@ class CosmicWebViewer {
 
     // Reload thresholds
     this.lastLoadDirection = new THREE.Vector3();
+    this.lastLoadFov = this.settings.fov;
     this.loadAngleThresholdDeg = 10; // Reload when view direction changes this much
 
     // Saved camera viewpoints (for quick return)
@@ -1239,7 +1240,11 @@ class CosmicWebViewer {
     const currentPos = this.camera.position;
     const distMoved = currentPos.distanceTo(this.lastLoadPosition);
 
-    if (distMoved < this.loadRadius && this.galaxyData.length > 0) {
+    // Zooming (FOV change) needs another level of detail
+    const fovChanged =
+      Math.abs(this.camera.fov - this.lastLoadFov) > this.lastLoadFov * 0.2;
+
+    if (distMoved < this.loadRadius && !fovChanged && this.galaxyData.length > 0) {
       // console.log(`📍 Camera moved ${distMoved.toFixed(0)} units (threshold: ${this.loadRadius})`);
       return; // Don't reload if camera hasn't moved far
     }
@@ -1253,9 +1258,11 @@ class CosmicWebViewer {
       this.camera.getWorldDirection(forward);
       const { ra, dec } = this.vectorToEquatorialDir(forward);
 
-      // Calculate viewing radius (larger radius = more stars)
-      const radius = 15.0; // degrees of sky to query
-      const limit = 5000; // max stars per query
+      // Cone around the view; the server picks the level of detail that
+      // fills it with about `budget` stars, so zooming in reaches fainter stars
+      const radius = Math.min(30.0, Math.max(1.0, this.camera.fov * 0.75));
+      const budget = 5000; // stars to draw per view
+      const limit = 20000; // hard cap per query
 
       console.log(
         `🌍 Querying Gaia DR3: RA=${ra.toFixed(2)}°, Dec=${dec.toFixed(
@@ -1264,7 +1271,7 @@ class CosmicWebViewer {
       );
 
       // Query backend API
-      const url = `${this.apiUrl}/api/stars/region?ra=${ra}&dec=${dec}&radius=${radius}&limit=${limit}`;
+      const url = `${this.apiUrl}/api/stars/region?ra=${ra}&dec=${dec}&radius=${radius}&limit=${limit}&budget=${budget}`;
       const response = await fetch(url);
 
       if (!response.ok) {
@@ -1290,6 +1297,7 @@ class CosmicWebViewer {
       this.currentRegion = { ra, dec, radius };
       this.lastLoadPosition.copy(this.camera.position);
       this.lastLoadDirection.copy(forward);
+      this.lastLoadFov = this.camera.fov;
 
       // Update the visualization
       this.createGalaxyPoints();